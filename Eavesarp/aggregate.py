@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+'''
+Memory bounded aggregation of ARP requests by sender/target pair.
+
+A `PairAggregator` counts requests by pair and the minute bucket of
+history they were received in, in memory until it holds the number
+of counts that fit within its memory limit. The counts are then
+sorted by the integer values of the sender and target and the bucket
+and spilled to a temporary file as a run of fixed size records. When
+flushed, the runs and the counts still in memory are merged with
+`heapq.merge`, combining the counts of each pair as they stream to
+the database along with their history buckets, so inputs of any size
+are aggregated in fixed memory.
+
+Spilled runs are written to the default temporary directory, e.g.
+the one named by TMPDIR, unless a directory is supplied.
+'''
+
+from Eavesarp.sql import write_pair_values, HISTORY_PERIODS
+from Eavesarp.misc import ip_to_int
+from tempfile import TemporaryFile
+from struct import Struct
+from heapq import merge
+
+# Default memory limit in MiB
+DEFAULT_MEMORY_LIMIT = 256
+
+# Estimated bytes of memory held by the count of each pair and
+# bucket: the dictionary entry, key tuple, address strings, bucket and
+# count, plus the MAC address of its sender
+PAIR_BYTES = 400
+
+# Sender, target, bucket, count, MAC address and whether it's known
+RUN_RECORD = Struct('!IIIQ6s?')
+
+# Period of the history buckets requests are counted in
+BUCKET_PERIOD = HISTORY_PERIODS[0]
+
+# Records read from a run at a time
+READ_RECORDS = 4096
+
+def pack_mac(mac):
+
+    return bytes.fromhex(mac.replace(':','')) if mac else b'\x00'*6
+
+def read_run(run,index):
+    '''Generator yielding the `(sender,target,bucket,count,mac,index)`
+    records of a spilled run, where addresses are integer values and
+    `index` is the position of the run.
+    '''
+
+    run.seek(0)
+
+    while True:
+
+        buf = run.read(RUN_RECORD.size*READ_RECORDS)
+        if not buf: break
+
+        for sender, target, bucket, count, mac, known in \
+                RUN_RECORD.iter_unpack(buf):
+            yield (sender,target,bucket,count,
+                mac.hex(':') if known else None,index)
+
+class PairAggregator:
+    '''Count `(timestamp,sender,sender_mac,target)` records by
+    sender/target pair and minute bucket within `memory_limit` MiB,
+    spilling sorted runs to temporary files in `directory` beyond it.
+    The MAC address of each sender is the one of its final request.
+
+    Counts that are already sorted, as those of `update_arrays`, are
+    added as runs of their own, which are held in memory while they
+    fit within the limit.
+    '''
+
+    def __init__(self,memory_limit=DEFAULT_MEMORY_LIMIT,directory=None):
+
+        self.max_pairs = max((memory_limit<<20)//PAIR_BYTES,1)
+        self.directory = directory
+
+        self.counts = {}
+        self.macs = {}
+
+        # Spilled runs and runs held in memory, which are lists of
+        # records, and the number of records held in memory
+        self.runs = []
+        self.held = 0
+
+    def update(self,records):
+        '''Count each `(timestamp,sender,sender_mac,target)` record of
+        `records`, where `timestamp` is in seconds since the epoch.
+        '''
+
+        counts, macs, max_pairs = self.counts, self.macs, self.max_pairs
+
+        # Bounds of the bucket of the previous record
+        start = end = 0
+
+        for timestamp, sender, shw, target in records:
+
+            if not start <= timestamp < end:
+                start = int(timestamp//BUCKET_PERIOD*BUCKET_PERIOD)
+                end = start+BUCKET_PERIOD
+
+            key = (sender,target,start)
+            macs[sender] = shw
+
+            if key in counts:
+                counts[key] += 1
+                continue
+
+            counts[key] = 1
+            if counts.__len__()+self.held >= max_pairs: self.spill()
+
+    def update_arrays(self,senders,targets,counts,buckets,macs):
+        '''Add the counts of pairs and minute buckets from arrays of
+        equal length, as yielded by `Eavesarp.vectorized.scan_chunks`:
+        the integer values of `senders` and `targets`, the number of
+        requests `counts` and the start of each bucket `buckets`,
+        ordered by sender, target and bucket. `macs` maps the integer
+        values of senders to the integer values of their MAC
+        addresses.
+        '''
+
+        # Pending counts precede the run
+        if self.counts: self.spill()
+
+        index = self.runs.__len__()
+        macs = {sender:mac.to_bytes(6,'big').hex(':')
+            for sender,mac in macs.items()}
+
+        run = [(sender,target,bucket,count,macs.get(sender),index)
+            for sender,target,bucket,count in zip(senders.tolist(),
+                targets.tolist(),buckets.tolist(),counts.tolist())]
+
+        if self.held+run.__len__() > self.max_pairs:
+            self.runs.append(self.write_run(run))
+        else:
+            self.runs.append(run)
+            self.held += run.__len__()
+
+    def sorted_counts(self):
+        '''Return the counts held in memory as `(sender,target,bucket,
+        count,mac,index)` tuples sorted by address and bucket, clearing
+        them. `index` is the position of the run they would be spilled
+        to.
+        '''
+
+        macs, index = self.macs, self.runs.__len__()
+
+        # Each address is converted once, as counts share few addresses
+        ints = {}
+        for sender, target, bucket in self.counts:
+            if sender not in ints: ints[sender] = ip_to_int(sender)
+            if target not in ints: ints[target] = ip_to_int(target)
+
+        records = sorted((ints[sender],ints[target],bucket,count,
+            macs.get(sender),index) for (sender,target,bucket),count
+            in self.counts.items())
+
+        self.counts.clear()
+        self.macs.clear()
+
+        return records
+
+    def write_run(self,records):
+        '''Write sorted `records` to a temporary file, returning it.
+        '''
+
+        run = TemporaryFile(dir=self.directory)
+        pack = RUN_RECORD.pack
+
+        for offset in range(0,records.__len__(),READ_RECORDS):
+            run.write(b''.join(
+                pack(sender,target,bucket,count,pack_mac(mac),bool(mac))
+                for sender,target,bucket,count,mac,index
+                in records[offset:offset+READ_RECORDS]))
+
+        return run
+
+    def spill(self):
+
+        self.runs.append(self.write_run(self.sorted_counts()))
+
+    def merge_runs(self,held):
+        '''Generator yielding the combined `(sender,target,count,mac,
+        index,buckets)` record of each pair, ordered by address, where
+        `held` are the counts held in memory as returned by
+        `sorted_counts`, `mac` is from the latest run `index`
+        containing the pair and `buckets` is a list of `(period,
+        bucket,count)` tuples ordered by bucket.
+        '''
+
+        records = merge(*[run if isinstance(run,list) else
+            read_run(run,index) for index,run in enumerate(self.runs)],
+            held,
+            key=lambda record: (record[0],record[1],record[2]))
+
+        previous = None
+        for sender, target, bucket, count, mac, index in records:
+
+            if previous and previous[0] == sender and \
+                    previous[1] == target:
+                previous[2] += count
+                if mac: previous[3], previous[4] = mac, index
+
+                buckets = previous[5]
+                if buckets[-1][1] == bucket:
+                    buckets[-1] = (BUCKET_PERIOD,bucket,buckets[-1][2]+count)
+                else:
+                    buckets.append((BUCKET_PERIOD,bucket,count))
+
+                continue
+
+            if previous: yield previous
+            previous = [sender,target,count,mac,index,
+                [(BUCKET_PERIOD,bucket,count)]]
+
+        if previous: yield previous
+
+    def pairs(self,held):
+        '''Generator yielding the `(sender,target,count,mac,buckets)`
+        tuple of each pair, ordered by address, as accepted by
+        `write_pair_values`. The MAC address of a sender is from the
+        latest run containing it and is only supplied with its final
+        pair, the others having None.
+        '''
+
+        held_pair, latest = None, (-1,None)
+
+        for sender, target, count, mac, index, buckets in \
+                self.merge_runs(held):
+
+            if held_pair:
+                last = held_pair[0] != sender
+                yield held_pair[:3]+(latest[1] if last else None,
+                    held_pair[3])
+                if last: latest = (-1,None)
+
+            if mac and index >= latest[0]: latest = (index,mac)
+            held_pair = (sender,target,count,buckets)
+
+        if held_pair: yield held_pair[:3]+(latest[1],held_pair[3])
+
+    def flush(self,db_session):
+        '''Write the aggregated counts and history to the database and
+        commit, returning the number of requests written.
+        '''
+
+        try:
+            requests = write_pair_values(self.pairs(self.sorted_counts()),
+                db_session)
+            db_session.commit()
+        finally:
+            self.close()
+
+        return requests
+
+    def close(self):
+
+        for run in self.runs:
+            if not isinstance(run,list): run.close()
+
+        self.runs = []
+        self.held = 0
+        self.counts.clear()
+        self.macs.clear()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from Eavesarp.output import COL_ORDER,COL_MAP
+from Eavesarp.columns import COL_ORDER,COL_MAP
 from Eavesarp.color import ColorProfiles
 
 class Argument:
@@ -77,6 +77,12 @@ csv_output_file = Argument('--csv-output-file','-cof',
     '''
 )
 
+ndjson_output_file = Argument('--ndjson-output-file','-nof',
+    default='',
+    help='''Name of file to receive newline delimited JSON output.
+    '''
+)
+
 output_columns = Argument('--output-columns','-oc',
     default=COL_ORDER,
     nargs='+',
@@ -85,6 +91,14 @@ output_columns = Argument('--output-columns','-oc',
     %(default)s. Valid Values: 
     '''+', '.join(list(COL_MAP.keys())))
 
+limit = Argument('--limit','-lim',
+    type=int,
+    default=None,
+    help='''Maximum number of transactions to output, ordered by
+    ARP request count. Useful for showing only the top talkers
+    of large databases.
+    ''')
+
 stale_only = Argument('--stale-only','-so',
     action='store_true',
     help='''Only display records with a stale target.
@@ -107,6 +121,50 @@ force_sender = Argument('--force-sender','-fs',
     help='''Force sender information for all table rows.
     ''')
 
+window = Argument('--window','-win',
+    metavar='DURATION',
+    help='''Output only the pairs requested within this time window,
+    e.g. 15m, 1h or 7d, with their number of requests within it.
+    Counts are read from the history of each pair recorded while
+    capturing, rounded to the minute, hour or day it was rolled up
+    to.
+    ''')
+
+approximate = Argument('--approximate','-ax',
+    action='store_true',
+    help='''Count requests approximately in a Count-Min sketch of
+    fixed size, writing only the most frequent sender/target pairs
+    and pairs requesting stale targets to the database. Bounds
+    memory when monitoring for long periods.
+    ''')
+
+top_k = Argument('--top-k','-tk',
+    default=1000,
+    type=int,
+    help='''Number of most frequent pairs written when counting
+    approximately. Default: %(default)s
+    ''')
+
+sketch_error = Argument('--sketch-error','-se',
+    default=0.00001,
+    type=float,
+    help='''Maximum overcount of an approximate count as a fraction
+    of all requests counted, which holds with 99%% confidence.
+    Smaller values use more memory. Default: %(default)s
+    ''')
+
+profile = Argument('--profile','-prof',
+    nargs='?',
+    const='eavesarp-profile',
+    metavar='PREFIX',
+    help='''Profile the command with cProfile and tracemalloc.
+    Time and peak memory are summarized by subsystem: ingest,
+    filter, db, resolve and render. The profile is written to
+    PREFIX.pstats, collapsed stacks for flame graphs to
+    PREFIX.collapsed and the summary to PREFIX.txt. Default
+    PREFIX: %(const)s
+    ''')
+
 color_profile = Argument('--color-profile','-cp',
     default='default',
     choices=list(ColorProfiles.keys()),
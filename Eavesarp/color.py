@@ -1,22 +1,77 @@
 #!/usr/bin/env python3
 
-import colored
-from emoji import emojize
+from functools import cached_property
 
 class ColorProfile:
+    '''Styles and emojis used to draw output tables. colored and emoji
+    are imported once a profile is used, so that the names of the
+    profiles can be listed by the CLI without loading either.
+
+    Emojis are supplied as aliases, e.g. ":ghost:".
+    '''
 
     def __init__(self,even_color,odd_color,header_color,
             header_bold=True,stale_emoji=None,snac_emojis=None):
 
-        self.snac_emojis = snac_emojis or (False,True)
+        self.even_color = even_color
+        self.odd_color = odd_color
+        self.header_color = header_color
+        self.header_bold = header_bold
+
+        self.stale_alias = stale_emoji
+        self.snac_aliases = snac_emojis or (False,True)
+
+    @cached_property
+    def stale_emoji(self):
+
+        if not self.stale_alias: return None
+
+        from emoji import emojize
+        return emojize(self.stale_alias)
+
+    @cached_property
+    def snac_emojis(self):
+
+        from emoji import emojize
+        return tuple(emojize(v) if isinstance(v,str) else v
+            for v in self.snac_aliases)
+
+    @cached_property
+    def even_style(self):
+
+        import colored
+        return colored.fg(self.even_color)
+
+    @cached_property
+    def odd_style(self):
+
+        import colored
+        return colored.fg(self.odd_color)
+
+    @cached_property
+    def header_style(self):
+
+        import colored
+
+        header_style = colored.fg(self.header_color)
+        if self.header_bold: header_style += colored.attr('bold')
+
+        return header_style
 
-        self.even_style = colored.fg(even_color)
-        self.odd_style = colored.fg(odd_color)
+    @cached_property
+    def styles(self):
+        '''Prefix/suffix pairs for the table formatter, matching the
+        values produced by colored.stylize.
+        '''
 
-        self.header_style = colored.fg(header_color)
-        if header_bold: self.header_style += colored.attr('bold')
+        import colored
 
-        self.stale_emoji=stale_emoji
+        reset = colored.attr('reset')
+        return {
+            'header':(self.header_style,reset),
+            'even':(self.even_style,reset),
+            'odd':(self.odd_style,reset),
+        }
 
     def style_header(self,headers):
         return self.style_list(headers,self.header_style)
@@ -28,6 +83,7 @@ class ColorProfile:
         return self.style_list(values,self.odd_style)
 
     def style_list(self, values, style):
+        import colored
         return [colored.stylize(v,style) for v in values]
 
 ColorProfiles = {
@@ -46,26 +102,26 @@ ColorProfiles = {
     # Novelty color profiles
     'cupcake':ColorProfile(even_color=104, odd_color=164,
         header_color=104, header_bold=True,
-        stale_emoji=emojize(':unicorn_face:'),
-        snac_emojis=(False,emojize(':shortcake:'))),
+        stale_emoji=':unicorn_face:',
+        snac_emojis=(False,':shortcake:')),
     'poo':ColorProfile(even_color=136, odd_color=94,
             header_color=136, header_bold=True,
-            stale_emoji=emojize(':pile_of_poo:')),
+            stale_emoji=':pile_of_poo:'),
     'foxhound':ColorProfile(even_color=166, odd_color=179,
             header_color=166, header_bold=True,
             snac_emojis=(
-                False,emojize(':cigarette:'),
+                False,':cigarette:',
                 ),
-            stale_emoji=emojize(':fox_face:')
+            stale_emoji=':fox_face:'
             ),
     'rhino':ColorProfile(even_color=254, odd_color=244,
             header_color=254, header_bold=True,
-            stale_emoji=emojize(':rhinoceros:')),
+            stale_emoji=':rhinoceros:'),
     'halloween':ColorProfile(even_color=166, odd_color=179,
             header_color=166, header_bold=True,
             snac_emojis=(
-                False,emojize(':jack-o-lantern:'),
+                False,':jack-o-lantern:',
                 ),
-            stale_emoji=emojize(':ghost:')
+            stale_emoji=':ghost:'
             )
 }
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+'''
+Columns of the output table. Kept apart from Eavesarp.output so that
+the CLI can be built without loading the database layer.
+'''
+
+from sys import exit
+
+COL_MAP = {
+    'arp_count':'ARP#',
+    'sender':'Sender',
+    'sender_mac':'Sender MAC',
+    'target':'Target',
+    'target_mac':'Target MAC',
+    'stale':'Stale',
+    'sender_ptr':'Sender PTR',
+    'target_ptr':'Target PTR',
+    'target_forward':'Target PTR Forward',
+    'mitm_op':'MITM',
+    'snac':'SNAC',
+}
+
+COL_ORDER = [
+    'snac',
+    'sender',
+    'target',
+    'arp_count',
+    'stale'
+]
+
+def validate_columns(output_columns):
+
+    vals = COL_MAP.keys()
+    bad = [v for v in output_columns if not v in vals]
+
+    if bad:
+
+        print('- Invalid column values provided: ',','.join(bad))
+        print('- Valid values: ',','.join(vals))
+        print('Exiting!')
+        exit()
+
+    return
@@ -1,26 +1,45 @@
 #!/usr/bin/env python3
 
+import asyncio
 import signal
-import re
 from Eavesarp.sql import *
-from Eavesarp.lists import Lists
+from Eavesarp.federate import (create_federated_db,
+        count_source_transactions)
+from Eavesarp.partition import PartitionCatalog, expand_partitions
 from Eavesarp.decorators import *
 from Eavesarp.validators import *
 from Eavesarp.resolve import *
 from Eavesarp.misc import *
 from Eavesarp.output import *
 from Eavesarp.logo import *
-from scapy.all import sniff,ARP,wrpcap,rdpcap,sr
-from time import sleep
-from multiprocessing.pool import Pool
+from Eavesarp.pcap import (open_capture, iter_arp_requests, PcapError,
+        PcapReader, GLOBAL_HEADER_LENGTH, write_pcap)
+from Eavesarp.vectorized import aggregate_arp_requests
+from Eavesarp.aggregate import (PairAggregator, DEFAULT_MEMORY_LIMIT,
+        BUCKET_PERIOD)
+from Eavesarp.sketch import ApproximateCounter, DEFAULT_TOP_K, DEFAULT_ERROR
+from Eavesarp.helper import CaptureHelper
+from Eavesarp.sniffer import ScapySniffer
+from Eavesarp.simulate import simulate_capture
+from Eavesarp.events import EventStream
+from Eavesarp.scheduler import RedrawScheduler
+from Eavesarp.metrics import CaptureMetrics, MetricsExporter
+from Eavesarp.profiling import span, traced
+from Eavesarp.viewport import Viewport
+from Eavesarp.live import (LiveCounters, render_live, DEFAULT_CAPACITY,
+        FLAG_ARP_RESOLVED, FLAG_STALE)
+from time import sleep, perf_counter, time
+from concurrent.futures import ThreadPoolExecutor
 from sys import stdout
+from collections import Counter
+import multiprocessing
+from pathlib import Path
 
 
-@validate_packet_unpack
-def filter_packet(packet,sender_lists=None,target_lists=None):
-    '''Filter an individual packet. This should be executed in the `lambda`
-    supplied to `do_sniff`. `sender_lists` and `target_lists` should be
-    objects of type `List()`.
+def filter_record(packet,sender_lists=None,target_lists=None):
+    '''Filter an unpacked `(sender,sender_mac,target)` record.
+    `sender_lists` and `target_lists` should be objects of type
+    `List()`.
     '''
 
     if not packet: return False
@@ -35,412 +54,1338 @@ def filter_packet(packet,sender_lists=None,target_lists=None):
 
     return packet
 
-@unpack_packets
-def handle_packets(packets,db_session):
-    '''Handle packets capture from the interface.
+def handle_records(records,db_session,interface=None,timestamp=None):
+    '''Handle `(sender,sender_mac,target)` records. Requests are
+    counted in memory by sender/target pair and written to the
+    database in a single transaction. Counts are also recorded for
+    `interface` when the records were captured on one, and in the
+    history of each pair when they were received at `timestamp`.
     '''
 
-    for packet in packets:
+    counts = Counter()
+    macs = {}
 
-        sender,shw,target = packet
+    for sender,shw,target in records:
+        counts[(sender,target)] += 1
+        macs[sender] = shw
 
-        # GET/CREATE database objects
-        sender = get_or_create_ip(sender,
-                db_session,
-                mac_address=shw)
+    return handle_counts(counts,macs,db_session,interface,timestamp)
 
-        target = get_or_create_ip(target,
-                db_session)
+def handle_counts(counts,macs,db_session,interface=None,timestamp=None):
+    '''Write request counts to the database in a single transaction.
+    `counts` maps `(sender,target)` tuples to the number of requests
+    and `macs` maps each sender to its MAC address. When supplied,
+    `timestamp` is the time the requests were received in seconds
+    since the epoch, which is recorded as the time each pair was
+    seen and in its history.
 
-        # Determine if a transaction record for the
-          # target/sender pair exists
-            # if not, create it
-            # else, get and increment it
-        transaction = db_session.query(Transaction) \
-            .filter(
-                Transaction.sender_ip_id==sender.id,
-                Transaction.target_ip_id==target.id
-            ).first()
+    Returns a `(transaction,sender,target,count,created)` tuple for
+    each pair, where `sender` and `target` are IP objects and
+    `created` indicates that the pair had not been seen before.
+    '''
 
-        if not transaction:
+    if not counts: return []
 
-            transaction = Transaction(sender_ip_id=sender.id,
-                    target_ip_id=target.id)
-            db_session.add(transaction)
+    write_pair_counts(((sender,target,count,macs.get(sender))
+        for (sender,target),count in counts.items()),db_session,
+        timestamp=timestamp)
 
-        else:
+    # Loaded after writing, so a transaction that was just created
+    # counts only the requests written above
+    loaded = get_pair_transactions(counts,db_session)
+
+    transactions = []
+    for pair,count in counts.items():
+
+        transaction, sender, target = loaded[pair]
+        transactions.append((transaction,sender,target,count,
+            transaction.count == count))
+
+    if interface:
+
+        update_interface_counts(
+            {transaction.id:count for transaction,sender,target,count,
+                created in transactions},
+            interface,
+            db_session)
 
-            transaction.count += 1
+    if timestamp is not None:
 
-        db_session.commit()
+        record_history(
+            {transaction.id:count for transaction,sender,target,count,
+                created in transactions},
+            timestamp,
+            db_session)
 
-def do_sniff(interfaces,redraw_frequency,sender_lists,target_lists):
-    '''Start the sniffer while filtering for WHO-HAS broadcast requests.
+    db_session.commit()
+
+    return transactions
+
+# Transactions read from a source database and written at once
+SOURCE_CHUNK_SIZE = 10000
+
+def import_sqlite_file(sfile,outdb_sess):
+    '''Import the source database to the output database by reading
+    its transactions `SOURCE_CHUNK_SIZE` at a time. Note that new id
+    values are assigned to each IP in the process. The source is
+    opened read-only and is not migrated, so it remains unmodified.
     '''
 
-    return sniff(iface=interfaces,
-        lfilter=lambda pkt: filter_packet(pkt,sender_lists,target_lists),
-        count=redraw_frequency
-    )
-
-def async_sniff(interface, redraw_frequency, sender_lists,
-        target_lists, dbfile):
-    '''This function should be started in a distinct process, allowing
-    the one to CTRL^C during execution and gracefully exit the sniffer.
-    Not starting the sniffer in a distinct process results in it blocking
-    forever or until an inordinate number of keyboard interrupts occur.
+    connection = connect_readonly(sfile)
+
+    try:
+
+        history = read_source_rows(connection,'transaction_history',
+            ['period','bucket','count'])
+        interface_counts = read_source_rows(connection,'interface_count',
+            ['interface','count'])
+
+        # =======================================================
+        # TRANSFER TRANSACTIONS TO THE NEW DB A CHUNK AT A TIME
+        # =======================================================
+
+        rows = read_source_transactions(connection)
+
+        while True:
+
+            chunk = rows.fetchmany(SOURCE_CHUNK_SIZE)
+            if not chunk: break
+
+            write_source_transactions(chunk,history,interface_counts,
+                outdb_sess)
+            outdb_sess.commit()
+
+    finally:
+
+        connection.close()
+
+class PcapFollower:
+    '''Import ARP requests from a capture file that may still be
+    growing, e.g. one being written by tcpdump or dumpcap. Each call
+    to `poll` imports only the complete records appended since the
+    previous call, resuming from the offset recorded in the ingest
+    manifest.
+
+    The content preceding the offset is hashed once to confirm that
+    the file is the one previously ingested. The hash is then
+    updated with each new record, so the cost of each poll is
+    proportional to the amount of new data.
+
+    pcap and pcapng files are supported, along with gzip, xz, bz2
+    and zstd compressed variants. Compressed files are treated as
+    complete archives and are imported in full exactly once.
+
+    When `parse_engine` is "numpy", uncompressed classic pcap files
+    are parsed by the vectorized engine in `Eavesarp.vectorized`.
+    Other formats are always parsed by the Python engine.
+
+    Requests are counted by a `PairAggregator` holding at most
+    `memory_limit` MiB of pairs, beyond which they're spilled to
+    temporary files, before they're written to the database along
+    with history buckets of the times recorded in the capture. When
+    `counter` is supplied, an `ApproximateCounter` that may be shared
+    by several files, requests are counted by it instead, without
+    history.
     '''
 
-    sess = create_db(dbfile)
+    def __init__(self,path,outdb_sess,memory_limit=DEFAULT_MEMORY_LIMIT,
+            parse_engine='python',counter=None):
+
+        self.path = path
+        self.parse_engine = parse_engine
+        self.resolved = str(Path(path).resolve())
+        self.outdb_sess = outdb_sess
+        self.memory_limit = memory_limit
+        self.counter = counter
+        self.reader = None
+        self.hasher = None
+        self.sha256 = None
+        self.done = False
+
+    def open(self):
+        '''Open the file and seek to the offset of the previous ingest.
+        Returns False when the file or its header has not yet been
+        written.
+        '''
 
-    # Capture packets
-    packets = do_sniff(interface,
-            redraw_frequency, sender_lists,
-            target_lists)
+        pth = Path(self.resolved)
+        if not pth.exists(): return False
 
-    # Handle packets (to the db they go, yo)
-    handle_packets(packets, sess)
+        ingest = get_ingest(self.resolved,self.outdb_sess)
 
-    sess.close()
+        try:
 
-    return packets
+            self.reader = open_capture(self.resolved,
+                ingest.offset if ingest else None)
 
-def analyze(database_output_file, sender_lists=None, target_lists=None,
-        analysis_output_file=None, pcap_files=[], sqlite_files=[],
-        color_profile=None, dns_resolve=True, csv_output_file=None,
-        output_columns=None, stale_only=False, force_sender=False,
-        *args, **kwargs):
-    '''Create a new database and populate it with records stored in
-    each type of input file.
+        except Exception as e:
+
+            # Wait for the header of a new file to be written
+            if isinstance(e,PcapError) and \
+                    pth.stat().st_size < GLOBAL_HEADER_LENGTH:
+                return False
+
+            self.fail(f'Unable to read capture file ({e}), skipping: '
+                f'{self.path}')
+            return False
+
+        self.sha256 = ingest.sha256 if ingest else None
+
+        return True
+
+    def close(self):
+
+        if self.reader: self.reader.infile.close()
+        self.reader = None
+
+    def fail(self,message):
+
+        print('- '+message)
+        self.done = True
+        self.close()
+
+    def fail_changed(self,change):
+
+        self.fail(f'Input file {change} since last ingest, skipping: '
+            f'{self.path}\n- Analyze without --incremental to rebuild '
+            'the output database')
+
+    def import_requests(self):
+        '''Import each complete ARP request remaining in the capture,
+        returning the number of requests imported.
+        '''
+
+        aggregator = self.counter or PairAggregator(self.memory_limit)
+        history = not self.counter
+
+        try:
+
+            with span('ingest'):
+
+                if self.parse_engine == 'numpy' and \
+                        not self.reader.compression and \
+                        isinstance(self.reader,PcapReader):
+
+                    self.reader.offset = aggregate_arp_requests(
+                        self.resolved,aggregator,self.reader.offset,
+                        BUCKET_PERIOD if history else None)
+                    self.reader.rewind()
+
+                else:
+
+                    aggregator.update(iter_arp_requests(self.reader,
+                        history))
+
+            with span('db'): return aggregator.flush(self.outdb_sess)
+
+        finally:
+            if not self.counter: aggregator.close()
+
+    def poll_compressed(self):
+        '''Import the full content of a compressed capture once.
+        '''
+
+        self.done = True
+        sha256 = hash_file(self.resolved).hexdigest()
+
+        if self.sha256:
+
+            if self.sha256 == sha256: self.close()
+            else: self.fail_changed('changed')
+
+            return 0
+
+        try:
+            count = self.import_requests()
+        except Exception as e:
+            self.fail(f'Error while reading capture file ({e}): '
+                f'{self.path}')
+            return 0
+
+        self.close()
+
+        stat = Path(self.resolved).stat()
+        update_ingest(self.resolved,'pcap',stat.st_size,stat.st_mtime,
+                sha256,self.outdb_sess)
+
+        return count
+
+    def poll(self):
+        '''Import new records and return the number of ARP requests
+        imported.
+        '''
+
+        if self.done or (not self.reader and not self.open()):
+            return 0
+
+        if self.reader.compression: return self.poll_compressed()
+
+        start = self.reader.offset
+        size = Path(self.resolved).stat().st_size
+
+        if size < start:
+            self.fail_changed('truncated')
+            return 0
+        elif size == start:
+            return 0
+
+        # Confirm the previously ingested content is unchanged
+        if not self.hasher:
+
+            self.hasher = hash_file(self.resolved,start)
+
+            if self.sha256 and self.hasher.hexdigest() != self.sha256:
+                self.fail_changed('changed')
+                return 0
+
+        count = self.import_requests()
+
+        if self.reader.offset != start:
+
+            self.hasher = hash_file(self.resolved,self.reader.offset,
+                    self.hasher,start)
+
+            stat = Path(self.resolved).stat()
+            update_ingest(self.resolved,'pcap',stat.st_size,
+                    stat.st_mtime,self.hasher.hexdigest(),
+                    self.outdb_sess,self.reader.offset)
+
+        return count
+
+def ingest_file(path,file_type,outdb_sess,follow=False,
+        parse_engine='python',memory_limit=DEFAULT_MEMORY_LIMIT,
+        counter=None):
+    '''Import an input file to the output database while maintaining
+    the ingest manifest:
+
+    - Unchanged files are skipped
+    - Only records appended to pcap files since the last ingest
+    are imported
+    - Files that have otherwise changed are skipped, since their
+    prior contribution cannot be removed from the database
+
+    The `PcapFollower` used to import a pcap file is returned, and
+    it is left open when `follow` is set.
     '''
 
-    outdb_sess = create_db(database_output_file,overwrite=True)
+    pth = Path(path).resolve()
+    stat = pth.stat()
+    ingest = get_ingest(str(pth),outdb_sess)
+
+    unchanged = ingest and ingest.size == stat.st_size and \
+            ingest.mtime == stat.st_mtime
+
+    if unchanged and not follow:
+        print(f'- Skipping unchanged input file: {path}')
+        return
 
     # ===================
     # HANDLE SQLITE FILES
     # ===================
 
-    '''
-    Import the source database to the new database by reading in
-    each transaction. Note that new id values are assigned to
-    each IP in the process.
-    '''
-    for sfile in sqlite_files:
+    if file_type == 'sqlite':
 
-        isess = create_db(sfile)
+        sha256 = hash_file(pth).hexdigest()
 
-        # ====================================================
-        # ITERATE OVER EACH TRANSACTION AND TRANSFER TO NEW DB
-        # ====================================================
+        if ingest and ingest.sha256 == sha256:
+            print(f'- Skipping unchanged input file: {path}')
+        elif ingest:
+            print(f'- Input file changed since last ingest, skipping: '
+                f'{path}\n- Analyze without --incremental to rebuild '
+                'the output database')
+        else:
+            with span('ingest'): import_sqlite_file(path,outdb_sess)
 
-        for t in isess.query(Transaction).all():
+        update_ingest(str(pth),file_type,stat.st_size,stat.st_mtime,
+                ingest.sha256 if ingest else sha256,outdb_sess)
 
-            ips = []
-            for handle in ['sender','target']:
+        return
 
-                transaction_ip = tip = t.__getattribute__(handle)
+    # ==================
+    # HANDLE PCAP FILES
+    # ==================
 
-                # Create a dictionary of arguments to create the IP
-                kwargs = {
-                    'db_session':outdb_sess,
-                }
-                for attr in ['value','arp_resolve_attempted',
-                    'reverse_dns_attempted', 'mac_address']:
-                    kwargs[attr] = tip.__getattribute__(attr)
+    if ingest and ingest.offset and not unchanged:
+        print(f'- Importing new records from {path} '
+            f'(offset {ingest.offset})')
 
-                # Create the new IP
-                ip = get_or_create_ip(**kwargs)
+    follower = PcapFollower(path,outdb_sess,memory_limit,parse_engine,
+            counter)
+    follower.poll()
 
-                # Associate the ptr
-                ptr = tip.ptr[0].value if tip.ptr else None
-                if ptr:
+    if not follow: follower.close()
 
-                    get_or_create_ptr(ptr,ip.id,outdb_sess,
-                            tip.ptr[0].forward_ip)
+    return follower
 
-                # Append the ip
-                ips.append(ip)
+def follow_pcap_files(followers,interval,draw):
+    '''Poll each `PcapFollower` every `interval` seconds, calling
+    `draw` with the number of requests imported whenever new records
+    have been imported. Runs until interrupted.
+    '''
 
-            # Expand list into sender/target value
-            sender, target = ips
+    count = 0
 
-            # ======================
-            # HANDLE THE TRANSACTION
-            # ======================
+    try:
 
-            transaction = outdb_sess.query(Transaction).filter(
-                Transaction.sender_ip_id==sender.id,
-                Transaction.target_ip_id==target.id).first()
+        while True:
 
-            if transaction:
+            imported = sum([f.poll() for f in followers])
 
-                transaction.count += t.count
+            if imported:
+                count += imported
+                draw(count)
 
-            else:
+            sleep(interval)
 
-                outdb_sess.add(
-                    Transaction(
-                        sender_ip_id=sender.id,
-                        target_ip_id=target.id,
-                        count=t.count,
-                    )
-                )
+    except KeyboardInterrupt:
 
-            outdb_sess.commit()
+        print('\n- CTRL^C Caught...')
 
-    # =====================
-    # HANDLE EACH PCAP FILE
-    # =====================
+    finally:
 
-    '''
-    This is much easier than SQLITE files since we can just use
-    Scapy to slurp the packets from each target file, filter each
-    packet, and then use `handle_packets` to populate the database.
-    '''
+        for follower in followers: follower.close()
 
-    for pfile in pcap_files:
-
-        # Assure that each packet is ARP WHO-HAS
-        packets = [p for p in rdpcap(pfile) if filter_packet(p)]
-
-        # Insert the records
-        handle_packets(
-            packets,
-            outdb_sess
-        )
-
-    print(get_output_table(
-        outdb_sess,
-        sender_lists=sender_lists,
-        target_lists=target_lists,
-        color_profile=color_profile,
-        columns=output_columns,
-        stale_only=stale_only,
-        force_sender=force_sender
-    ))
-
-    if csv_output_file:
-        print(f'- Writing csv output to {csv_output_file}')
-        with open(csv_output_file,'w') as outfile:
-            outfile.write(
-                get_output_csv(
-                    outdb_sess,
-                    sender_lists=sender_lists,
-                    target_lists=target_lists
-                ).read()
-            )
+def analyze(database_output_file, sender_lists=None, target_lists=None,
+        analysis_output_file=None, pcap_files=[], sqlite_files=[],
+        color_profile=None, dns_resolve=True, csv_output_file=None,
+        output_columns=None, stale_only=False, force_sender=False,
+        limit=None, ndjson_output_file=None, federated=False,
+        incremental=False, follow=False, follow_interval=1.0,
+        parse_engine='python', memory_limit=DEFAULT_MEMORY_LIMIT,
+        approximate=False, top_k=DEFAULT_TOP_K, sketch_error=DEFAULT_ERROR,
+        window=None, *args, **kwargs):
+    '''Create a new database and populate it with records stored in
+    each type of input file.
 
-    outdb_sess.close()
+    When `incremental` is set, the existing output database is
+    updated instead. Only input files that are new, or the new
+    records of pcap files that have grown, are imported according
+    to the ingest manifest stored in the output database.
 
-def capture(interface,database_output_file,redraw_frequency,arp_resolve,
-        dns_resolve,sender_lists,target_lists,color_profile,
-        output_columns,display_false,pcap_output_file,force_sender,
-        stale_only,*args,**kwargs):
+    When `follow` is set, pcap files are polled for new records
+    every `follow_interval` seconds after the initial import and the
+    output table is redrawn as requests arrive. Exports are written
+    once following is interrupted.
 
-    dbfile = database_output_file
+    `parse_engine` selects the parser used for pcap files, either
+    "python" or "numpy". Requests are aggregated within
+    `memory_limit` MiB, spilling to temporary files beyond it.
 
-    osigint = signal.signal(signal.SIGINT,signal.SIG_IGN)
-    pool = Pool(3)
-    signal.signal(signal.SIGINT, osigint)
+    When `approximate` is set, requests of pcap files are instead
+    counted by an `ApproximateCounter` with a relative error of
+    `sketch_error`, and only the `top_k` heavy hitters and pairs
+    requesting stale targets are written.
 
-    try:
+    When `window` is set, only the requests of the final `window`
+    seconds are output, as recorded in the history of each pair.
 
-        # ==============
-        # START SNIFFING
-        # ==============
+    When `federated` is set, SQLite files are instead queried in
+    place through read-only aggregate views and no output database
+    is created. The views are materialized in memory when the output
+    is windowed or spans more than one page.
 
-        '''
-        The sniffer is started in a distinct process because Scapy
-        will block forever when scapy.all.sniff is called. This allows
-        us to interrupt execution of the sniffer by terminating the
-        process.
+    SQLite files that catalog the partitions of a capture are
+    replaced by the partitions, pruning those closed before the
+    window.
+    '''
 
-        TODO: It may be easier to use threading. Pool methods were fresh
-        to me at the time of original development.
-        '''
+    sqlite_files = expand_partitions(sqlite_files,
+        time()-window if window else None)
 
+    if not sqlite_files and not pcap_files:
+        print('- No partitions were written within the window.')
+        return
 
-        ptable = None
-        pcount = 0
-        # Handle new database file. When verbose, alert user that a new
-        # capture must occur prior to printing results.
+    if federated:
 
-        arp_resolution = ('disabled','enabled')[arp_resolve]
-        dns_resolution = ('disabled','enabled')[dns_resolve]
+        # ==================================
+        # QUERY THE SQLITE FILES IN PLACE
+        # ==================================
 
-        print('\x1b[2J\x1b[H\33[F')
-        print(logo+'\n')
-        print(f'Capture interface: {interface}')
-        print(f'ARP resolution:    {arp_resolution}')
-        print(f'DNS resolution:    {dns_resolution}')
-        sess = create_db(dbfile)
+        # Views aggregate the files on every query, so they're
+        # materialized when the history is joined or the output table
+        # is read in pages
+        materialize = bool(window) or not limit and \
+            count_source_transactions(sqlite_files) > OUTPUT_PAGE_SIZE
 
-        # ======================================
-        # CREATE AN IP FOR THE CURRENT INTERFACE
-        # ======================================
+        with span('ingest'):
+            outdb_sess = create_federated_db(sqlite_files,materialize)
 
+    else:
 
-        iface_mac, iface_ips = get_interfaces()[interface]
-        for ip in iface_ips:
-            ip = get_or_create_ip(ip,
-                sess,
-                mac_address=iface_mac)
+        outdb_sess = create_db(database_output_file,
+                overwrite=not incremental)
 
-        if not Path(dbfile).exists():
-            print('- Initializing capture\n- This may take time depending '\
-                'on network traffic and filter configurations')
-        else:
+        # ===================
+        # HANDLE SQLITE FILES
+        # ===================
 
-            print(f'Requests analyzed: {pcount}\n')
-            ptable = get_output_table(
-                sess,
+        for sfile in sqlite_files:
+            ingest_file(sfile,'sqlite',outdb_sess)
+
+        # =====================
+        # HANDLE EACH PCAP FILE
+        # =====================
+
+        # Targets known to be stale are loaded after the SQLite files
+        # are imported
+        counter = None
+        if approximate:
+            counter = ApproximateCounter(top_k,sketch_error)
+            counter.refresh(outdb_sess)
+
+        followers = [ingest_file(pfile,'pcap',outdb_sess,follow,
+                parse_engine,memory_limit,counter) for pfile in pcap_files]
+
+        if counter:
+            print(f'- Approximate counts: {counter.describe()}')
+
+    def build_table():
+
+        with span('render'):
+            return get_output_table(
+                outdb_sess,
                 sender_lists=sender_lists,
                 target_lists=target_lists,
-                dns_resolve=dns_resolve,
                 color_profile=color_profile,
-                arp_resolve=arp_resolve,
                 columns=output_columns,
-                display_false=display_false,
+                stale_only=stale_only,
                 force_sender=force_sender,
-                stale_only=stale_only)
+                limit=limit,
+                since=time()-window if window else None
+            )
+
+    ptable = build_table()
+    print(ptable)
+
+    # ========================
+    # FOLLOW GROWING PCAPS
+    # ========================
+
+    if follow:
+
+        def draw(count):
+
+            nonlocal ptable
+
+            # Clear the previous table from the screen
+            stdout.write('\033[F\033[K'*(ptable.split('\n').__len__()+2))
+
+            ptable = build_table()
+            print(f'Requests imported: {count}\n')
             print(ptable)
 
-        # Cache packets that will be written to output file
-        pkts = []
-        sniff_result = None
-        arp_resolve_result, dns_resolve_result = None, None
+        print('- Following pcap files for new records...\n')
+        follow_pcap_files([f for f in followers if f],follow_interval,draw)
 
-        # Loop eternally
-        while True:
+    # ====================
+    # STREAM FILE EXPORTS
+    # ====================
 
+    for output_file, export_format in [(csv_output_file,'csv'),
+            (ndjson_output_file,'ndjson')]:
 
-            # Handle sniff results
-            if sniff_result and sniff_result.ready():
+        if not output_file: continue
 
-                packets = sniff_result.get()
-                sniff_result = None
+        with span('render'):
+            export_output(outdb_sess,
+                output_file,
+                export_format,
+                sender_lists=sender_lists,
+                target_lists=target_lists,
+                limit=limit,
+                stale_only=stale_only,
+                since=time()-window if window else None)
 
-                # Capture packets for the output file
-                if pcap_output_file and packets: pkts += packets
+    outdb_sess.close()
 
-                if packets: pcount += packets.__len__()
+# Seconds between rollups of the history of each pair
+ROLLUP_INTERVAL = 60
+
+class CaptureOrchestrator:
+    '''Drive a capture from events instead of polling:
+
+    - a source queued requests or stopped
+    - requests were written, possibly adding unresolved IPs
+    - a DNS or ARP resolution completed
+
+    Sources run in threads and wake the event loop as they queue
+    requests. Resolution is performed by a thread pool, but its
+    results are written by the event loop, leaving the session of
+    the event loop as the only writer to the database.
+
+    Changes are coalesced into frames timed by `scheduler`, a
+    `RedrawScheduler`. Each frame writes the changes to the database
+    and calls `redraw` with the number of requests written and the
+    status of the scheduler, unless `redraw` is None as when
+    capturing headless. Changes are also emitted to `events`, an
+    `EventStream`, when supplied. Status messages are passed to
+    `log`.
+
+    IPs are resolved by `arp_resolver` and `dns_resolver`, which
+    accept the arguments of `arp_resolve` and `reverse_dns_resolve`,
+    allowing a `SimulatedResponder` to answer instead of the network.
+    The capture ends once every source has stopped or, when `drain`
+    is set, once the resolutions pending at that time are written.
+
+    Throughput and latencies are recorded in `metrics`, a
+    `CaptureMetrics`, which are summarized in the status passed to
+    `redraw` and exported by `exporter`, a `MetricsExporter`, when
+    supplied.
+
+    When `counter`, an `ApproximateCounter`, is supplied, requests
+    are counted by it and only the pairs it selects are written.
+
+    Requests are recorded in the history of each pair, which is
+    rolled up every `ROLLUP_INTERVAL` seconds. Pairs not seen for
+    `retention` seconds are then expired when it's set.
+
+    When `catalog`, a `PartitionCatalog`, is supplied, `db_session`
+    is a session of its current partition and is replaced by that of
+    a new partition as each becomes due. Partitions closed before the
+    retention are removed.
+
+    When `live`, a `LiveCounters`, is supplied, accepted requests and
+    ARP resolutions are counted by it as soon as they're read,
+    ahead of the database.
+    '''
 
-                # Clear the previous table from the screen using
-                # escape sequences screen
-                # https://stackoverflow.com/questions/5290994/remove-and-replace-printed-items/5291044#5291044
-                if ptable:
-                    lcount = ptable.split('\n').__len__()+2
-                    stdout.write('\033[F\033[K'*lcount)
+    def __init__(self,db_session,sources,redraw,interfaces,
+            scheduler=None,sender_lists=None,target_lists=None,
+            arp_resolve=False,dns_resolve=False,keep_frames=False,
+            resolver_workers=4,events=None,log=print,
+            arp_resolver=arp_resolve,dns_resolver=reverse_dns_resolve,
+            drain=False,metrics=None,exporter=None,counter=None,
+            retention=None,catalog=None,live=None):
+
+        self.db_session = db_session
+        self.sources = sources
+        self.redraw = redraw
+        self.interfaces = interfaces
+        self.scheduler = scheduler or RedrawScheduler()
+        self.sender_lists = sender_lists
+        self.target_lists = target_lists
+        self.arp_resolve = arp_resolve
+        self.dns_resolve = dns_resolve
+        self.keep_frames = keep_frames
+        self.resolver_workers = resolver_workers
+        self.events = events
+        self.log = log
+        self.arp_resolver = arp_resolver
+        self.dns_resolver = dns_resolver
+        self.drain = drain
+        self.metrics = metrics or CaptureMetrics(sources)
+        self.exporter = exporter
+        self.counter = counter
+        self.retention = retention
+        self.catalog = catalog
+        self.live = live
+        self.next_rollup = 0
+
+        # Requests read from each interface that have not been written
+        self.records = {}
+        self.frames = []
+        self.count = 0
+
+        # IP ids being resolved and resolutions awaiting a write
+        self.resolving = {'arp':set(),'dns':set()}
+        self.futures = set()
+        self.completed = []
+
+        self.interrupted = False
+
+    def notify(self):
+        '''Wake the event loop. Safe to call from any thread.
+        '''
 
-                ptable = get_output_table(
-                    sess,
-                    sender_lists=sender_lists,
-                    target_lists=target_lists,
-                    dns_resolve=dns_resolve,
-                    color_profile=color_profile,
-                    arp_resolve=arp_resolve,
-                    columns=output_columns,
-                    display_false=display_false,
-                    force_sender=force_sender,
-                    stale_only=stale_only)
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def interrupt(self):
+
+        self.interrupted = True
+        self.wakeup.set()
+
+    def read_sources(self):
+        '''Move the requests queued by each source to `records`,
+        returning the sources that have stopped.
+        '''
+
+        # Checked first so that the final requests of a stopped
+        # source are read below
+        stopped = [source for source in self.sources
+                if not source.running]
+
+        for source in self.sources:
+
+            with span('ingest'): items = source.get()
+            filtered = 0
+
+            records = self.records.setdefault(source.interface,[])
+            start = records.__len__()
+
+            with span('filter'):
+
+                for record, frame in items:
+
+                    if not filter_record(record,self.sender_lists,
+                            self.target_lists):
+                        filtered += 1
+                        continue
+
+                    records.append(record)
+                    if self.keep_frames: self.frames.append(frame)
+
+            if not records: del self.records[source.interface]
+            elif self.live: self.live.add_records(records[start:])
+
+            if items:
+                self.metrics.add_requests(source.interface,
+                    items.__len__(),filtered)
+
+        return stopped
+
+    def write_records(self):
+
+        for interface in list(self.records):
+
+            start = perf_counter()
+            with span('db'):
 
-                print(f'Requests analyzed: {pcount}\n')
-                print(ptable)
+                if self.counter:
+                    self.counter.update(self.records[interface])
+                    transactions = handle_counts(
+                        *self.counter.collect(self.db_session),
+                        self.db_session,interface,time())
+                else:
+                    transactions = handle_records(self.records[interface],
+                        self.db_session,interface,time())
+            self.metrics.flush_seconds.observe(perf_counter()-start)
 
-            # Do sniffing
-            elif not sniff_result:
+            written = self.records.pop(interface).__len__()
+            self.metrics.flush_requests.observe(written)
+            self.count += written
 
+            if self.catalog: self.catalog.add_requests(written)
 
-                sniff_result = pool.apply_async(
-                    async_sniff,
-                    (
-                        interface,
-                        redraw_frequency,
-                        sender_lists,
-                        target_lists,
-                        database_output_file,
-                    )
-                )
+            if self.events:
+                self.emit_transactions(transactions,interface)
 
-            # ==================
-            # DNS/ARP RESOLUTION
-            # ==================
+    def emit_transactions(self,transactions,interface):
 
-            # Do reverse resolution
-            if dns_resolve:
+        for transaction, sender, target, count, created in transactions:
 
-                # Reset dns resolution results
-                if not dns_resolve_result or dns_resolve_result.ready():
+            fields = dict(interface=interface,
+                sender=sender.value,
+                sender_mac=sender.mac_address,
+                target=target.value,
+                count=transaction.count)
 
-                    to_resolve = sess.query(IP) \
-                            .filter(IP.reverse_dns_attempted != True) \
-                            .count()
+            if created: self.events.emit('new_pair',**fields)
+            else: self.events.emit('count_update',increment=count,**fields)
 
-                    if to_resolve:
+    def emit_resolution(self,kind,ip):
+        '''Emit events for a requested target once ARP resolution has
+        confirmed it to be stale. MITM candidates are emitted by the
+        latter of its ARP and DNS resolutions.
+        '''
+
+        if not ip.arp_resolve_attempted or ip.mac_address: return
+
+        senders = [value for value, in self.db_session.query(IP.value) \
+            .join(Transaction,Transaction.sender_ip_id==IP.id) \
+            .filter(Transaction.target_ip_id==ip.id)]
+
+        if not senders: return
+
+        if kind == 'arp':
+            self.events.emit('stale_target',target=ip.value,
+                senders=senders)
+
+        ptr = self.db_session.query(PTR).filter(PTR.ip_id==ip.id).first()
+
+        if ptr and ptr.forward_ip and ptr.forward_ip != ip.value:
+            self.events.emit('mitm_candidate',
+                target=ip.value,
+                senders=senders,
+                ptr=ptr.value,
+                forward_ip=ptr.forward_ip)
+
+    def submit(self,kind,ip_id,func,*args):
+
+        self.resolving[kind].add(ip_id)
+
+        self.metrics.backlog[kind] = self.resolving[kind].__len__()
+
+        future = self.loop.run_in_executor(self.executor,
+            traced('resolve',func),*args)
+        future.add_done_callback(
+            lambda future: self.complete(kind,ip_id,future))
+        self.futures.add(future)
+
+    def complete(self,kind,ip_id,future):
+
+        self.futures.discard(future)
+        if future.cancelled(): return
+
+        self.completed.append((kind,ip_id,future))
+        self.wakeup.set()
+
+    def schedule_resolution(self):
+        '''Submit each IP that has not been resolved and is not being
+        resolved to the thread pool.
+        '''
+
+        if self.arp_resolve:
+
+            ip_interfaces = None
+
+            for ip in self.db_session.query(IP) \
+                    .filter(IP.arp_resolve_attempted == False):
+
+                if ip.id in self.resolving['arp']: continue
+
+                # Resolve from the interface the IP was observed on
+                if ip_interfaces is None:
+                    ip_interfaces = get_ip_interfaces(self.db_session)
+
+                interface = ip_interfaces.get(ip.id)
+                if interface not in self.interfaces:
+                    interface = self.interfaces[0]
 
-                       dns_resolve_result = pool.apply_async(
-                            reverse_dns_resolve_ips,
-                            (database_output_file,)
+                self.submit('arp',ip.id,self.arp_resolver,interface,
+                        ip.value)
+
+        if self.dns_resolve:
+
+            for ip in self.db_session.query(IP) \
+                    .filter(IP.reverse_dns_attempted == False):
+
+                if ip.id in self.resolving['dns']: continue
+
+                self.submit('dns',ip.id,self.dns_resolver,ip.value)
+
+    def apply_resolutions(self):
+        '''Write the results of completed resolutions.
+        '''
+
+        resolved = []
+
+        for kind, ip_id, future in self.completed:
+
+            self.resolving[kind].discard(ip_id)
+            ip = self.db_session.query(IP).get(ip_id)
+
+            try:
+                result = future.result()
+            except Exception:
+                result = None
+
+            self.metrics.add_resolution(kind,
+                result if kind == 'arp' else (result or (None,))[0])
+
+            if kind == 'arp':
+
+                if result: ip.mac_address = result
+                ip.arp_resolve_attempted = True
+
+            else:
+
+                ptr, forward_ip = result or (None,None)
+                if ptr:
+                    self.db_session.add(
+                        PTR(ip_id=ip.id,
+                            value=ptr[:ptr.__len__()-1],
+                            forward_ip=forward_ip)
                         )
+                ip.reverse_dns_attempted = True
 
-            # Do ARP resolution
-            if arp_resolve:
+            resolved.append((kind,ip))
 
-                if not arp_resolve_result or arp_resolve_result.ready():
+        self.completed = []
+        self.db_session.commit()
 
-                    to_resolve = sess.query(IP) \
-                            .filter(IP.arp_resolve_attempted != True) \
-                            .count()
+        for kind in self.resolving:
+            self.metrics.backlog[kind] = self.resolving[kind].__len__()
 
-                    if to_resolve:
+        if self.live:
+            self.live.set_target_flags({ip.value:FLAG_ARP_RESOLVED|
+                (0 if ip.mac_address else FLAG_STALE)
+                for kind, ip in resolved if kind == 'arp'})
 
-                        arp_resolve_result = pool.apply_async(
-                            arp_resolve_ips,
-                                (interface, database_output_file,)
-                            )
+        # Pairs requesting targets found stale are written once they
+        # are known, even if no further requests are captured. Their
+        # interface is unknown.
+        if self.counter and [ip for kind, ip in resolved
+                if kind == 'arp' and not ip.mac_address]:
 
-            sleep(.2)
+            transactions = handle_counts(
+                *self.counter.collect(self.db_session),self.db_session,
+                timestamp=time())
+            if self.events: self.emit_transactions(transactions,None)
 
+        if self.events:
 
-    except KeyboardInterrupt:
+            arp_ids = {ip.id for kind, ip in resolved if kind == 'arp'}
 
-        print('\n- CTRL^C Caught...')
-        sess.close()
+            for kind, ip in resolved:
 
-    finally:
+                # Emitted once by the ARP resolution when both of the
+                # resolutions of an IP completed together
+                if kind == 'dns' and ip.id in arp_ids: continue
+                self.emit_resolution(kind,ip)
 
-        # ===================
-        # HANDLE OUTPUT FILES
-        # ===================
+    def roll_up(self):
+        '''Roll up the history of each pair, and expire pairs beyond
+        the retention, once every `ROLLUP_INTERVAL` seconds.
+        '''
 
-        if pcap_output_file: wrpcap(pcap_output_file,pkts)
+        now = time()
+        if now < self.next_rollup: return
 
-        # =====================
-        # CLOSE CHILD PROCESSES
-        # =====================
+        self.next_rollup = now+ROLLUP_INTERVAL
+
+        with span('db'):
+            expired = roll_up_history(self.db_session,now,self.retention)
+
+        if expired: self.log(f'- Expired {expired} pairs not seen within '
+            'the retention')
+
+        if self.catalog and self.retention:
+
+            with span('db'):
+                removed = self.catalog.expire(now-self.retention)
+
+            if removed: self.log(f'- Removed {removed} partitions closed '
+                'before the retention')
+
+    def rotate(self):
+        '''Write to a new partition once the current one is due. The
+        objects drawn from the partitions are expired, so that they're
+        read again with the changes of the frame.
+        '''
+
+        if not self.catalog: return
+
+        now = time()
+
+        if self.catalog.due(now):
+
+            with span('db'):
+                self.db_session = self.catalog.rotate(self.db_session,now)
+
+            self.log(f'- Writing to partition {self.catalog.partition.path}')
+
+        else:
+
+            self.catalog.session.expire_all()
+
+    def draw_frame(self):
+        '''Write the requests and resolutions received since the
+        previous frame and redraw once for all of them.
+        '''
+
+        with self.scheduler.frame():
+
+            if self.records:
+                self.write_records()
+                with span('resolve'): self.schedule_resolution()
+
+            if self.completed:
+                with span('db'): self.apply_resolutions()
+
+            self.roll_up()
+            self.rotate()
+            self.metrics.sample()
+
+            if self.redraw:
+
+                start = perf_counter()
+                with span('render'):
+                    self.redraw(self.count,
+                        f'{self.scheduler.status()}\n'
+                        f'{self.metrics.status()}')
+                self.metrics.render_seconds.observe(perf_counter()-start)
+
+            if self.events: self.events.flush()
+
+    @property
+    def draining(self):
+
+        return self.drain and bool(self.futures or self.completed)
+
+    async def run(self):
+
+        self.loop = asyncio.get_event_loop()
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(self.resolver_workers)
+
+        # Handled between events so that writes are never interrupted
+        self.loop.add_signal_handler(signal.SIGINT,self.interrupt)
+
+        if self.events: await self.events.start()
+        if self.exporter: await self.exporter.start()
+
+        for source in self.sources:
+            source.notify = self.notify
+            source.start()
 
         try:
 
-            pool.close()
+            self.schedule_resolution()
+
+            while self.sources or self.draining:
+
+                # Wait for an event, or for a pending frame to be due
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(),
+                            self.scheduler.delay())
+                except asyncio.TimeoutError:
+                    pass
+
+                self.wakeup.clear()
+
+                if self.interrupted: break
+
+                stopped = self.read_sources()
+
+                if self.records or self.completed:
+                    self.scheduler.request()
 
-            if sniff_result:
-                print('- Waiting for the sniffer process...',end='')
-                sniff_result.wait(5)
-                print('done')
+                # Final requests of stopped sources are drawn at once
+                if stopped or self.scheduler.due(): self.draw_frame()
 
-            if dns_resolve_result:
-                print('- Waiting for the DNS resolver process...',end='')
-                dns_resolve_result.wait(5)
-                print('done')
+                for source in stopped:
+                    self.log(f'- {source.describe_exit()}')
+                    self.sources.remove(source)
 
-            if arp_resolve_result:
-                print('- Waiting for the ARP resolver ocess...',end='')
-                arp_resolve_result.wait(5)
-                print('done')
+            if self.interrupted:
 
-        except KeyboardInterrupt:
+                self.log('\n- CTRL^C Caught...')
 
-            pool.terminate()
+                self.read_sources()
+                self.write_records()
 
-        pool.join()
+        finally:
 
+            if self.events: await self.events.close()
+            if self.exporter: await self.exporter.close()
+
+            self.loop.remove_signal_handler(signal.SIGINT)
+
+            for source in self.sources: source.stop()
+
+            # Resolutions that have not started are abandoned
+            for future in list(self.futures): future.cancel()
+
+            if self.futures:
+                self.log('- Waiting for resolvers...')
+                self.executor.shutdown(wait=True)
+            else:
+                self.executor.shutdown(wait=False)
+
+def load_live_counters(live,db_session):
+    '''Count the requests of each pair in the database, and flag the
+    targets resolved by ARP, in `live`.
+    '''
+
+    sender, target = aliased(IP), aliased(IP)
+
+    live.add_counts({(sender_value,target_value):count
+        for sender_value, target_value, count in db_session.query(
+            sender.value,target.value,Transaction.count) \
+            .join(sender,Transaction.sender_ip_id==sender.id) \
+            .join(target,Transaction.target_ip_id==target.id)})
+
+    live.set_target_flags({value:FLAG_ARP_RESOLVED|
+        (0 if mac_address else FLAG_STALE)
+        for value, mac_address in db_session.query(IP.value,
+            IP.mac_address).filter(IP.arp_resolve_attempted==True)})
+
+def capture(interfaces,database_output_file,redraw_frequency,arp_resolve,
+        dns_resolve,sender_lists,target_lists,color_profile,
+        output_columns,display_false,pcap_output_file,force_sender,
+        stale_only,limit=None,capture_helper=None,capture_stream=None,
+        buffer_size=64,headless=False,event_output=None,render_budget=100,
+        viewport=False,simulate=None,simulate_rate=1000,simulate_seed=0,
+        metrics_file=None,metrics_port=None,metrics_interval=10,
+        queue_size=0,approximate=False,top_k=DEFAULT_TOP_K,
+        sketch_error=DEFAULT_ERROR,window=None,retention=None,
+        partition_period=None,partition_size=None,live_counters=False,
+        live_capacity=DEFAULT_CAPACITY,*args,**kwargs):
+    '''Capture ARP requests on each of `interfaces` and redraw the
+    output table as they are analyzed.
+
+    Packets are sniffed by Scapy unless `capture_helper` is set to
+    "tcpdump" or "dumpcap", in which case the helper captures with a
+    kernel buffer of `buffer_size` MiB and a pcap stream is read from
+    its standard output. `capture_stream` reads the stream of a
+    helper started elsewhere from a named pipe or, when "-", from
+    standard input, attributing requests to the first interface.
+
+    Each interface is read by a distinct source running in a
+    background thread, while a `CaptureOrchestrator` writes the
+    requests of every source to the database and schedules DNS and
+    ARP resolution as events occur.
+
+    The table is redrawn at most `redraw_frequency` times per second,
+    less often while redraws take longer than `render_budget`
+    milliseconds.
+
+    When `viewport` is set, the table is drawn in a curses `Viewport`
+    that can be scrolled, sorted and searched. The table is never
+    rendered when `headless` is set. Changes are
+    emitted as NDJSON events to standard output when `event_output`
+    is "-", or to clients of a Unix socket at the path it provides.
+
+    When `simulate` is set, requests are instead generated, or
+    replayed from the capture file at the path it provides, at
+    `simulate_rate` requests per second on each interface, and
+    resolution is answered by a `SimulatedResponder`. See
+    `simulate_capture`.
+
+    Sources queue at most `queue_size` requests awaiting a flush,
+    dropping those that exceed it, or any number when it's 0. Pipeline
+    metrics are summarized above the table and, in the Prometheus
+    text format, written to `metrics_file` every `metrics_interval`
+    seconds and served on `metrics_port` of the loopback interface.
+
+    When `approximate` is set, requests are counted by an
+    `ApproximateCounter` with a relative error of `sketch_error`, and
+    only the `top_k` heavy hitters and pairs requesting targets found
+    to be stale are written as transactions.
+
+    Requests are recorded in the history of each pair. When `window`
+    is set, only the requests of the final `window` seconds are
+    drawn. Pairs not seen for `retention` seconds are expired.
+
+    When `partition_period` or `partition_size` is set, requests are
+    written to partitions created every `partition_period` seconds
+    or once they exceed `partition_size` MiB, and the database output
+    file catalogs them (see `PartitionCatalog`). The table is drawn
+    from the partitions in aggregate.
+
+    When `live_counters` is set, the table is instead drawn by a
+    renderer process from `LiveCounters` of `live_capacity` pairs,
+    which are loaded from the database and updated as requests are
+    read, so drawing is independent of writes to the database.
+    '''
+
+    dbfile = database_output_file
+    orchestrator = display = catalog = live = renderer = None
+
+    try:
+
+        ptable, lcount = None, 0
+
+        arp_resolution = ('disabled','enabled')[arp_resolve]
+        dns_resolution = ('disabled','enabled')[dns_resolve]
+
+        if not headless and not viewport:
+            print('\x1b[2J\x1b[H\33[F')
+            print(logo+'\n')
+
+        print(f'Capture interfaces: {", ".join(interfaces)}')
+        if simulate:
+            print(f'Simulation:         {simulate} at '
+                f'{simulate_rate or "unlimited"} requests/s')
+        elif capture_stream:
+            print(f'Capture stream:     {capture_stream}')
+        else:
+            print(f'Capture helper:     {capture_helper or "scapy"}')
+        print(f'ARP resolution:     {arp_resolution}')
+        print(f'DNS resolution:     {dns_resolution}')
+        if approximate:
+            print(f'Counting:           approximate, top {top_k} pairs')
+
+        if partition_period or partition_size:
+            catalog = PartitionCatalog(dbfile,partition_period,
+                partition_size,window)
+            sess = catalog.open(time())
+            print(f'Partitions:         {catalog.describe()}')
+        else:
+            sess = create_db(dbfile)
+
+        # The table is drawn from every partition
+        query_sess = catalog.session if catalog else sess
+
+        # ======================================
+        # CREATE AN IP FOR EACH CAPTURE INTERFACE
+        # ======================================
+
+        # Simulated interfaces have no addresses
+        local_interfaces = get_interfaces() if not simulate else {}
+        for interface in interfaces:
+            if interface not in local_interfaces: continue
+            iface_mac, iface_ips = local_interfaces[interface]
+            for ip in iface_ips:
+                ip = get_or_create_ip(ip,
+                    sess,
+                    mac_address=iface_mac)
+
+        counter = None
+        if approximate:
+            counter = ApproximateCounter(top_k,sketch_error)
+            counter.refresh(sess)
+
+        def draw_table(count=0,status=''):
+
+            nonlocal ptable, lcount
+
+            # Clear the previous table from the screen using
+            # escape sequences screen
+            # https://stackoverflow.com/questions/5290994/remove-and-replace-printed-items/5291044#5291044
+            if ptable:
+                stdout.write('\033[F\033[K'*lcount)
+
+            ptable = get_output_table(
+                query_sess,
+                sender_lists=sender_lists,
+                target_lists=target_lists,
+                dns_resolve=dns_resolve,
+                color_profile=color_profile,
+                arp_resolve=arp_resolve,
+                columns=output_columns,
+                display_false=display_false,
+                force_sender=force_sender,
+                stale_only=stale_only,
+                limit=limit,
+                since=time()-window if window else None)
+
+            print(f'Requests analyzed: {count}')
+            print(f'{status}\n')
+            print(ptable)
+
+            # Lines printed above, including those of the status
+            lcount = ptable.split('\n').__len__()+ \
+                status.split('\n').__len__()+2
+
+        log = print
+
+        if live_counters:
+
+            # Statuses are published for the renderer
+            live = LiveCounters(capacity=live_capacity)
+            load_live_counters(live,query_sess)
+            redraw = live.publish
+
+            stopped = multiprocessing.Event()
+            renderer = multiprocessing.Process(target=render_live,
+                args=(live,stopped,redraw_frequency),
+                kwargs=dict(color_profile=color_profile,
+                    columns=output_columns,
+                    display_false=display_false,
+                    force_sender=force_sender,
+                    stale_only=stale_only,
+                    limit=limit,
+                    arp_resolve=arp_resolve),
+                daemon=True)
+            renderer.start()
+
+        elif headless:
+            redraw = None
+        elif viewport:
+            display = Viewport(query_sess,
+                columns=output_columns,
+                sender_lists=sender_lists,
+                target_lists=target_lists,
+                arp_resolve=arp_resolve,
+                dns_resolve=dns_resolve,
+                display_false=display_false,
+                stale_only=stale_only,
+                limit=limit,
+                window=window)
+            redraw, log = display.update, display.log
+        else:
+            redraw = draw_table
+            redraw()
+
+        # ==============
+        # START SNIFFING
+        # ==============
+
+        keep_frames = bool(pcap_output_file)
+        resolvers = {}
+
+        if simulate:
+            sources, responder = simulate_capture(interfaces,simulate,
+                simulate_rate,simulate_seed,keep_frames,queue_size)
+            resolvers = dict(arp_resolver=responder.arp_resolve,
+                dns_resolver=responder.reverse_dns_resolve,
+                drain=True)
+        elif capture_stream:
+            sources = [CaptureHelper(interfaces[0],
+                stream=capture_stream,
+                keep_frames=keep_frames,
+                max_queue=queue_size)]
+        elif capture_helper:
+            sources = [CaptureHelper(interface,capture_helper,
+                buffer_size=buffer_size,keep_frames=keep_frames,
+                max_queue=queue_size) for interface in interfaces]
+        else:
+            sources = [ScapySniffer(interface,keep_frames,
+                max_queue=queue_size) for interface in interfaces]
+
+        metrics = CaptureMetrics(sources)
+        exporter = None
+        if metrics_file or metrics_port:
+            exporter = MetricsExporter(metrics,metrics_file,metrics_port,
+                metrics_interval)
+
+        orchestrator = CaptureOrchestrator(sess,
+            sources,
+            redraw,
+            interfaces,
+            scheduler=RedrawScheduler(redraw_frequency,render_budget/1000),
+            sender_lists=sender_lists,
+            target_lists=target_lists,
+            arp_resolve=arp_resolve,
+            dns_resolve=dns_resolve,
+            keep_frames=keep_frames,
+            events=EventStream(event_output) if event_output else None,
+            log=log,
+            metrics=metrics,
+            exporter=exporter,
+            counter=counter,
+            retention=retention,
+            catalog=catalog,
+            live=live,
+            **resolvers)
+
+        loop = asyncio.get_event_loop()
+
+        if display:
+            display.start(loop)
+            display.update()
+
+        loop.run_until_complete(orchestrator.run())
+
+        if catalog:
+            catalog.close(orchestrator.db_session,time())
+        else:
+            sess.close()
+
+    except KeyboardInterrupt:
+
+        print('\n- CTRL^C Caught...')
+
+    finally:
+
+        if display: display.stop()
+
+        # The final counts are drawn before the renderer exits
+        if renderer:
+            stopped.set()
+            renderer.join()
+
+        if live: live.close()
+
+        # ===================
+        # HANDLE OUTPUT FILES
+        # ===================
+
+        if pcap_output_file and orchestrator:
+            if capture_helper or capture_stream or simulate:
+                write_pcap(pcap_output_file,orchestrator.frames)
+            else:
+                from scapy.all import wrpcap
+                wrpcap(pcap_output_file,orchestrator.frames)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+'''
+Newline delimited JSON events emitted during capture.
+
+Events are written to standard output or to each client connected
+to a Unix socket, allowing unattended sensors to report findings
+without rendering the output table. Each event is a JSON object
+with `event` and `time` members:
+
+- new_pair: a sender requested a target for the first time
+- count_update: requests were counted for a sender/target pair
+- stale_target: ARP resolution of a requested target failed
+- mitm_candidate: a stale target has a PTR record resolving to a
+  different IP
+'''
+
+from pathlib import Path
+from time import time
+from sys import stderr
+import asyncio
+import json
+import sys
+import stat
+
+# Clients that fall this far behind are disconnected rather than
+# buffering events indefinitely
+MAX_CLIENT_BUFFER = 1<<22
+
+class EventStream:
+    '''Emit events to standard output when `output` is "-", otherwise
+    to clients of a Unix socket created at the path `output`.
+
+    Events are buffered until `flush` is called, which the capture
+    orchestrator does once per handled batch.
+    '''
+
+    def __init__(self,output='-'):
+
+        self.output = output
+
+        # Standard output of the process, even while status messages
+        # are redirected from it
+        self.stdout = sys.__stdout__ if output == '-' else None
+        self.server = None
+        self.clients = []
+
+    async def start(self):
+
+        if self.stdout: return
+
+        # Replace the socket left by a previous capture
+        path = Path(self.output)
+        if path.exists() and stat.S_ISSOCK(path.stat().st_mode):
+            path.unlink()
+
+        self.server = await asyncio.start_unix_server(self.connect,
+                path=self.output)
+
+    async def connect(self,reader,writer):
+
+        self.clients.append(writer)
+
+    def emit(self,event,**fields):
+
+        line = json.dumps(dict(event=event,time=time(),**fields))+'\n'
+
+        if self.stdout:
+
+            try:
+                self.stdout.write(line)
+            except BrokenPipeError:
+                self.close_stdout()
+
+            return
+
+        line = line.encode()
+        for writer in list(self.clients):
+
+            if writer.is_closing() or \
+                    writer.transport.get_write_buffer_size() > \
+                    MAX_CLIENT_BUFFER:
+                writer.close()
+                self.clients.remove(writer)
+                continue
+
+            writer.write(line)
+
+    def flush(self):
+
+        if not self.stdout: return
+
+        try:
+            self.stdout.flush()
+        except BrokenPipeError:
+            self.close_stdout()
+
+    def close_stdout(self):
+
+        # The consumer has exited. Capture continues without events.
+        print('- Event output closed',file=stderr)
+        self.stdout = None
+
+    async def close(self):
+
+        self.flush()
+
+        if not self.server: return
+
+        for writer in self.clients: writer.close()
+
+        self.server.close()
+        await self.server.wait_closed()
+
+        try:
+            Path(self.output).unlink()
+        except FileNotFoundError:
+            pass
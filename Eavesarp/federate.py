@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+'''
+Read-only federated queries over multiple eavesarp databases.
+
+Source databases are attached read-only to an in-memory database
+and exposed through temporary `ip`, `ptr`, `transaction` and
+`transaction_history` views that aggregate the sources by IP
+address. Since temporary objects take precedence over those of
+attached databases, the ORM models and output functions in this
+package query the views transparently without copying the sources.
+
+Views aggregate the sources on every query, which suits a single
+query of the output, but not output read a page at a time or joined
+with the history of each pair. The sources may instead be
+materialized, i.e. aggregated once into temporary tables of the
+same names, indexed like the models, after which they're detached.
+Sources that are still being written, e.g. the partition being
+written by a capture, then remain attached and are queried live
+through views along with the tables.
+
+SQLite limits the number of attached databases. When more sources
+are supplied than can be attached at once, they're aggregated in
+batches into intermediate temporary tables.
+'''
+
+from Eavesarp.misc import ip_to_int
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from pathlib import Path
+import sqlite3
+
+# Used when the limit cannot be read from the sqlite3 module
+DEFAULT_ATTACH_LIMIT = 10
+
+# ====================
+# SOURCE ROW SELECTS
+# ====================
+
+'''
+Each select extracts rows from a single attached database, which
+is identified by the `{schema}` placeholder. Rows are keyed by IP
+value so that they can be merged across databases, which assign
+distinct id values to each IP. Aggregates are decomposable (MAX
+and SUM), so the rows of a batch can be aggregated again later.
+'''
+
+IP_SELECT = '''
+SELECT value,
+    MAX(arp_resolve_attempted) AS arp_resolve_attempted,
+    MAX(reverse_dns_attempted) AS reverse_dns_attempted,
+    MAX(mac_address) AS mac_address
+FROM {schema}.ip GROUP BY value
+'''
+
+# The forward IP is read from the row of the greatest PTR value, as
+# SQLite reads bare columns from the row selected by MAX
+PTR_SELECT = '''
+SELECT ip.value AS ip_value,
+    MAX(ptr.value) AS value,
+    ptr.forward_ip AS forward_ip
+FROM {schema}.ptr AS ptr
+JOIN {schema}.ip AS ip ON ip.id = ptr.ip_id
+GROUP BY ip.value
+'''
+
+TRANSACTION_SELECT = '''
+SELECT sender.value AS sender,
+    target.value AS target,
+    SUM(t.count) AS count,
+    {first_seen} AS first_seen,
+    {last_seen} AS last_seen
+FROM {schema}."transaction" AS t
+JOIN {schema}.ip AS sender ON sender.id = t.sender_ip_id
+JOIN {schema}.ip AS target ON target.id = t.target_ip_id
+GROUP BY sender.value, target.value
+'''
+
+HISTORY_SELECT = '''
+SELECT sender.value AS sender,
+    target.value AS target,
+    h.period AS period,
+    h.bucket AS bucket,
+    SUM(h.count) AS count
+FROM {schema}.transaction_history AS h
+JOIN {schema}."transaction" AS t ON t.id = h.transaction_id
+JOIN {schema}.ip AS sender ON sender.id = t.sender_ip_id
+JOIN {schema}.ip AS target ON target.id = t.target_ip_id
+GROUP BY sender.value, target.value, h.period, h.bucket
+'''
+
+# Selected from sources created before transaction history was
+# recorded
+EMPTY_HISTORY_SELECT = '''
+SELECT NULL AS sender, NULL AS target, NULL AS period, NULL AS bucket,
+    NULL AS count WHERE 0
+'''
+
+# ========================
+# AGGREGATE VIEW SELECTS
+# ========================
+
+'''
+Each select aggregates the rows produced by `{source}`, which is
+either a UNION ALL of the source selects or a temporary table
+populated by batches, and defines a temporary view or table. Columns
+match the models in `Eavesarp.sql`. The integer value of an IP is
+used as its id, providing the same id for an address regardless of
+source.
+'''
+
+IP_VIEW = '''
+SELECT eavesarp_ip_int(value) AS id,
+    value,
+    eavesarp_ip_int(value) AS int_value,
+    MAX(arp_resolve_attempted) AS arp_resolve_attempted,
+    MAX(reverse_dns_attempted) AS reverse_dns_attempted,
+    MAX(mac_address) AS mac_address
+FROM ({source}) GROUP BY value
+'''
+
+# Forward IPs are read as by `PTR_SELECT`
+PTR_VIEW = '''
+SELECT eavesarp_ip_int(ip_value) AS id,
+    eavesarp_ip_int(ip_value) AS ip_id,
+    MAX(value) AS value,
+    forward_ip
+FROM ({source}) GROUP BY ip_value
+'''
+
+TRANSACTION_VIEW = '''
+SELECT ROW_NUMBER() OVER (ORDER BY sender, target) AS id,
+    eavesarp_ip_int(sender) AS sender_ip_id,
+    eavesarp_ip_int(target) AS target_ip_id,
+    SUM(count) AS count,
+    MIN(first_seen) AS first_seen,
+    MAX(last_seen) AS last_seen
+FROM ({source}) GROUP BY sender, target
+'''
+
+HISTORY_VIEW = '''
+SELECT t.id AS transaction_id,
+    h.period AS period,
+    h.bucket AS bucket,
+    SUM(h.count) AS count
+FROM ({source}) AS h
+JOIN "transaction" AS t
+    ON t.sender_ip_id = eavesarp_ip_int(h.sender)
+    AND t.target_ip_id = eavesarp_ip_int(h.target)
+GROUP BY h.sender, h.target, h.period, h.bucket
+'''
+
+# (name, columns of source rows, source select, view)
+VIEWS = [
+    ('ip','value, arp_resolve_attempted, reverse_dns_attempted, '
+        'mac_address',IP_SELECT,IP_VIEW),
+    ('ptr','ip_value, value, forward_ip',PTR_SELECT,PTR_VIEW),
+    ('transaction','sender, target, count, first_seen, last_seen',
+        TRANSACTION_SELECT,TRANSACTION_VIEW),
+    ('transaction_history','sender, target, period, bucket, count',
+        HISTORY_SELECT,HISTORY_VIEW),
+]
+
+# (table, columns) of each index of the temporary tables, matching
+# the indexes of the models
+INDEXES = [
+    ('ip','id'),
+    ('ip','arp_resolve_attempted, mac_address'),
+    ('ip','mac_address'),
+    ('ptr','ip_id'),
+    ('transaction','id'),
+    ('transaction','sender_ip_id, target_ip_id'),
+    ('transaction','target_ip_id, sender_ip_id'),
+    ('transaction','count'),
+    ('transaction_history','transaction_id, period, bucket'),
+    ('transaction_history','period, bucket'),
+]
+
+def get_attach_limit(connection):
+    '''Return the maximum number of databases that can be attached
+    to a connection.
+    '''
+
+    try:
+        return connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except AttributeError:
+        return DEFAULT_ATTACH_LIMIT
+
+def attach(connection,dbfiles):
+    '''Attach each database file read-only, returning the list of
+    schema names.
+    '''
+
+    schemas = []
+    for ind,dbfile in enumerate(dbfiles):
+
+        pth = Path(dbfile)
+        if not pth.is_file():
+            raise Exception(f'File not found: {dbfile}')
+
+        schema = f'source_{ind}'
+        connection.execute(f'ATTACH DATABASE ? AS {schema}',
+                (pth.resolve().as_uri()+'?mode=ro',))
+        schemas.append(schema)
+
+    return schemas
+
+def detach(connection,schemas):
+
+    for schema in schemas:
+        connection.execute(f'DETACH DATABASE {schema}')
+
+def drop_views(connection):
+    '''Drop the views and temporary tables of a connection and detach
+    its sources.
+    '''
+
+    temp = dict(connection.execute('SELECT name, type '
+        "FROM sqlite_temp_master WHERE type IN ('table','view')"))
+
+    for name, columns, select, view in VIEWS:
+        for table in [name,f'federated_{name}']:
+            if table in temp:
+                connection.execute(f'DROP {temp[table]} temp."{table}"')
+
+    detach(connection,[name for seq, name, dbfile in
+        connection.execute('PRAGMA database_list')
+        if name.startswith('source_')])
+
+def source_select(connection,select,schema):
+    '''Return the select for a schema, in which columns and tables
+    added by later versions of the schema are replaced by NULL values
+    when the source predates them.
+    '''
+
+    columns = {row[1] for row in connection.execute(
+        f'PRAGMA {schema}.table_info("transaction")')}
+
+    if select == HISTORY_SELECT and not connection.execute(
+            f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' "
+            "AND name='transaction_history'").fetchone():
+        return EMPTY_HISTORY_SELECT
+
+    return select.format(schema=schema,
+        first_seen='MIN(t.first_seen)' if 'first_seen' in columns
+            else 'NULL',
+        last_seen='MAX(t.last_seen)' if 'last_seen' in columns
+            else 'NULL')
+
+def union(connection,select,schemas):
+    '''Return a UNION ALL of the select for each schema.
+    '''
+
+    return '\nUNION ALL\n'.join(
+        [source_select(connection,select,schema) for schema in schemas]
+    )
+
+def create_views(connection,dbfiles,live=0,materialize=False):
+    '''Create temporary views aggregating each database file,
+    replacing those previously created on the connection. When
+    `materialize` is set, the sources are instead aggregated once
+    into indexed temporary tables, except for the final `live`
+    database files, which remain attached and are queried through
+    views along with the tables, so that changes to them are seen.
+    '''
+
+    drop_views(connection)
+
+    limit = get_attach_limit(connection)
+
+    if materialize:
+
+        live = min(live,limit,dbfiles.__len__())
+        split = dbfiles.__len__()-live
+
+        # Without live files, files that can be attached at once are
+        # aggregated directly rather than in batches
+        if not live and split <= limit: split = 0
+
+    else:
+
+        live = dbfiles.__len__()
+        split = max(dbfiles.__len__()-limit,0)
+
+    batched, attached = dbfiles[:split], dbfiles[split:]
+    sources = []
+
+    # ==================================
+    # AGGREGATE THE SOURCES IN BATCHES
+    # ==================================
+
+    if batched:
+
+        for name, columns, select, view in VIEWS:
+            connection.execute(
+                f'CREATE TEMP TABLE federated_{name} ({columns})'
+            )
+            sources.append(f'SELECT * FROM federated_{name}')
+
+        for offset in range(0,batched.__len__(),limit):
+
+            schemas = attach(connection,batched[offset:offset+limit])
+
+            for name, columns, select, view in VIEWS:
+                connection.execute(
+                    f'INSERT INTO federated_{name} '+
+                        union(connection,select,schemas)
+                )
+
+            connection.commit()
+            detach(connection,schemas)
+
+    # ======================================
+    # AGGREGATE THE TABLES OR CREATE VIEWS
+    # ======================================
+
+    schemas = attach(connection,attached)
+
+    for ind, (name, columns, select, view) in enumerate(VIEWS):
+
+        source = union(connection,select,schemas)
+        if batched:
+            source = sources[ind]+('\nUNION ALL\n'+source if schemas
+                else '')
+
+        connection.execute(f'CREATE TEMP {"VIEW" if live else "TABLE"} '
+            f'"{name}" AS '+view.format(source=source))
+
+    if live: return
+
+    for ind, (table, columns) in enumerate(INDEXES):
+        connection.execute(f'CREATE INDEX temp.federated_index_{ind} '
+            f'ON "{table}" ({columns})')
+
+    for name, columns, select, view in VIEWS:
+        connection.execute(f'DROP TABLE IF EXISTS temp.federated_{name}')
+
+    connection.commit()
+    detach(connection,schemas)
+
+def create_federated_connection(dbfiles,live=0,materialize=False):
+    '''Create an in-memory SQLite connection with temporary views
+    aggregating each database file, or tables when `materialize` is
+    set, of which the final `live` files are queried through views
+    (see `create_views`).
+    '''
+
+    connection = sqlite3.connect('file::memory:',uri=True,
+            check_same_thread=False)
+    connection.create_function('eavesarp_ip_int',1,ip_to_int,
+            deterministic=True)
+
+    create_views(connection,dbfiles,live,materialize)
+
+    return connection
+
+def federated_session(connection):
+    '''Return a session querying a federated connection.
+    '''
+
+    engine = create_engine('sqlite://',
+            creator=lambda: connection,
+            poolclass=StaticPool)
+
+    Session = sessionmaker()
+    Session.configure(bind=engine)
+
+    return Session()
+
+def create_federated_db(dbfiles,materialize=False):
+    '''Return a read-only session that queries each database file
+    in aggregate, materializing them when `materialize` is set.
+    '''
+
+    return federated_session(create_federated_connection(dbfiles,0,
+        materialize))
+
+def count_source_transactions(dbfiles):
+    '''Return the number of transactions held by the database files,
+    counting a pair once for each file that holds it.
+    '''
+
+    count = 0
+    for dbfile in dbfiles:
+
+        connection = sqlite3.connect(
+            Path(dbfile).resolve().as_uri()+'?mode=ro',uri=True)
+
+        try:
+            count += connection.execute(
+                'SELECT COUNT(*) FROM "transaction"').fetchone()[0]
+        finally:
+            connection.close()
+
+    return count
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+'''
+Capture through an external helper, i.e. tcpdump or dumpcap.
+
+The helper captures with a BPF filter matching only ARP WHO-HAS
+requests and a large kernel buffer, writing a pcap stream to its
+standard output. The stream is parsed in a background thread and
+the requests are queued for the capture loop, which remains the
+only writer to the database.
+
+A stream written by a helper started elsewhere can be read from a
+named pipe or standard input instead.
+'''
+
+from Eavesarp.pcap import open_stream, parse_arp
+from Eavesarp.sniffer import CaptureSource
+from subprocess import Popen, PIPE, TimeoutExpired
+from sys import stdin
+
+HELPERS = ['tcpdump','dumpcap']
+
+# ARP requests only: opcode 1 at offset 6 of the ARP header
+CAPTURE_FILTER = 'arp and arp[6:2] = 1'
+
+# Large enough for an ARP request behind stacked VLAN tags
+SNAPLEN = 128
+
+# Kernel capture buffer size in MiB
+DEFAULT_BUFFER_SIZE = 64
+
+def helper_command(helper,interface,buffer_size=DEFAULT_BUFFER_SIZE):
+    '''Return the command line that runs a helper, writing captured
+    ARP requests to standard output.
+    '''
+
+    if helper == 'tcpdump':
+
+        # -U flushes each packet to the pipe as it's captured and -B
+        # expects KiB
+        return ['tcpdump','-i',interface,'-U','-n','-w','-',
+                '-s',str(SNAPLEN),'-B',str(buffer_size*1024),
+                CAPTURE_FILTER]
+
+    elif helper == 'dumpcap':
+
+        return ['dumpcap','-i',interface,'-q','-w','-',
+                '-s',str(SNAPLEN),'-B',str(buffer_size),
+                '-f',CAPTURE_FILTER]
+
+    raise ValueError(f'Unsupported capture helper: {helper}')
+
+class CaptureHelper(CaptureSource):
+    '''Run a capture helper on an interface, or attach to the pcap
+    stream of one when `stream` is supplied.
+
+    `stream` is the path to a named pipe or file, or "-" for
+    standard input.
+    '''
+
+    def __init__(self,interface,helper='tcpdump',stream=None,
+            buffer_size=DEFAULT_BUFFER_SIZE,keep_frames=False,
+            max_queue=0):
+
+        super().__init__(interface,keep_frames,max_queue)
+        self.helper = helper
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.process = None
+
+    def start(self):
+
+        infile = None
+
+        if self.stream == '-':
+
+            infile = stdin.buffer
+
+        elif not self.stream:
+
+            # A distinct session keeps CTRL^C from reaching the helper
+            # so that it can be stopped after the final redraw
+            self.process = Popen(
+                helper_command(self.helper,self.interface,
+                    self.buffer_size),
+                stdout=PIPE,
+                stderr=PIPE,
+                start_new_session=True)
+
+            infile = self.process.stdout
+
+        super().start(infile)
+
+    def read(self,infile=None):
+        '''Parse the stream until it's closed. Named pipes are opened
+        here since opening blocks until a writer is connected.
+        '''
+
+        if infile is None: infile = open(self.stream,'rb')
+
+        reader = open_stream(infile)
+        put, keep_frames = self.put, self.keep_frames
+
+        for frame in reader.records():
+            record = parse_arp(frame[2],frame[1])
+            if record: put(record,frame if keep_frames else None)
+
+    def describe_exit(self):
+
+        if self.process and self.process.poll():
+
+            message = self.process.stderr.read().decode(errors='replace') \
+                    .strip().split('\n')[-1]
+
+            return f'{self.helper} exited with status ' \
+                f'{self.process.returncode}: {message}'
+
+        return self.error or 'Capture stream closed'
+
+    def stop(self,timeout=5):
+
+        if self.process and self.process.poll() is None:
+
+            self.process.terminate()
+
+            try:
+                self.process.wait(timeout)
+            except TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+        # Threads reading standard input or a named pipe may block
+        # until the writer closes it
+        if self.process: super().stop(timeout)
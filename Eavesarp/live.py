@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+'''
+Live pair counters shared between the capture loop and a renderer.
+
+`LiveCounters` holds a count for each sender/target pair in
+fixed-width slots of a `multiprocessing.shared_memory` block. The
+capture loop counts requests as soon as they're read from each
+source, before they're written to the database, and a renderer
+process draws the table from the slots. The database remains the
+durable copy of the capture, but drawing never waits for, or locks,
+the database file.
+
+The capture loop is the only writer. Each slot is a `(sender,target,
+count,flags)` record of integer IP values, which is located through a
+dictionary held by the writer, and slots are appended in the order
+pairs are first seen. Readers take no locks: the writer increments a
+sequence number before and after each change, and readers copy the
+slots again when the number was odd or changed while copying.
+
+Only the pairs that fit in the `capacity` slots are counted, and
+those that don't are counted as overflow. Flags record whether the
+target of a pair was resolved by ARP and, if so, whether it's stale,
+which is sufficient for the default columns of the table. MAC
+addresses, PTR records and MITM opportunities are only read from the
+database.
+'''
+
+from Eavesarp.misc import ip_to_int, int_to_ip
+from Eavesarp.table import TableFormatter
+from Eavesarp.columns import COL_MAP, COL_ORDER
+from multiprocessing import shared_memory
+from collections import Counter
+from heapq import nsmallest
+from struct import Struct
+from sys import stdout
+from time import sleep
+import signal
+
+# Sequence number, capacity, slots used, requests counted, requests
+# of pairs beyond the capacity and the length of the status
+HEADER = Struct('<QIIQQI')
+
+# Sequence number, the first field of the header
+SEQUENCE = Struct('<Q')
+
+# Fields of the header following the sequence number and preceding
+# the length of the status
+COUNTS = Struct('<IIQQ')
+
+# Length of the status, the final field of the header
+STATUS_LENGTH = Struct('<I')
+
+# Bytes reserved for the status drawn above the table
+STATUS_SIZE = 1024
+
+# Sender, target, count and flags
+SLOT = Struct('<IIQI4x')
+
+SLOT_OFFSET = HEADER.size+STATUS_SIZE
+
+# Flags of the target of a pair
+FLAG_ARP_RESOLVED = 1
+FLAG_STALE = 2
+
+# Columns that can be drawn from the counters
+LIVE_COLUMNS = ['snac','sender','target','arp_count','stale']
+
+# Default number of slots, about 6 MiB
+DEFAULT_CAPACITY = 1<<18
+
+# Attempts to copy a consistent snapshot, after which the final copy
+# is returned regardless, and seconds waited between attempts for
+# the writer to finish a change
+READ_ATTEMPTS = 100
+READ_RETRY_DELAY = .001
+
+class LiveCounters:
+    '''Count requests by pair in a shared memory block of `capacity`
+    slots, created with `name` or a random name when None. When
+    `create` is not set, the existing block named `name` is attached
+    for reading instead.
+    '''
+
+    def __init__(self,name=None,capacity=DEFAULT_CAPACITY,create=True):
+
+        if create:
+            self.shm = shared_memory.SharedMemory(name,create=True,
+                size=SLOT_OFFSET+capacity*SLOT.size)
+            HEADER.pack_into(self.shm.buf,0,0,capacity,0,0,0,0)
+        else:
+            self.shm = attach_shared_memory(name)
+
+        self.capacity = HEADER.unpack_from(self.shm.buf,0)[1]
+        self.owner = create
+
+        # Writer state: the slot of each pair, slots of each target
+        # and the flags of targets
+        self.slots = {}
+        self.targets = {}
+        self.target_flags = {}
+        self.sequence = 0
+        self.used = 0
+        self.requests = 0
+        self.overflow = 0
+
+    @property
+    def name(self):
+
+        return self.shm.name
+
+    def __getstate__(self):
+
+        return self.name
+
+    def __setstate__(self,name):
+
+        self.__init__(name,create=False)
+
+    # ======
+    # WRITER
+    # ======
+
+    def begin(self):
+
+        self.sequence += 1
+        SEQUENCE.pack_into(self.shm.buf,0,self.sequence)
+
+    def end(self):
+
+        # The counts are stored before the sequence number is, so a
+        # reader never sees an even number with the previous counts
+        COUNTS.pack_into(self.shm.buf,SEQUENCE.size,self.capacity,
+            self.used,self.requests,self.overflow)
+
+        self.sequence += 1
+        SEQUENCE.pack_into(self.shm.buf,0,self.sequence)
+
+    def add_counts(self,counts):
+        '''Add `counts`, mapping `(sender,target)` tuples of IP
+        addresses to numbers of requests.
+        '''
+
+        buf, slots = self.shm.buf, self.slots
+
+        self.begin()
+
+        for (sender,target), count in counts.items():
+
+            key = (ip_to_int(sender),ip_to_int(target))
+            ind = slots.get(key)
+            self.requests += count
+
+            if ind is not None:
+                offset = SLOT_OFFSET+ind*SLOT.size
+                SLOT.pack_into(buf,offset,key[0],key[1],
+                    SLOT.unpack_from(buf,offset)[2]+count,
+                    self.target_flags.get(key[1],0))
+                continue
+
+            if self.used >= self.capacity:
+                self.overflow += count
+                continue
+
+            ind = slots[key] = self.used
+            self.targets.setdefault(key[1],[]).append(ind)
+            SLOT.pack_into(buf,SLOT_OFFSET+ind*SLOT.size,key[0],key[1],
+                count,self.target_flags.get(key[1],0))
+            self.used += 1
+
+        self.end()
+
+    def add_records(self,records):
+        '''Count each `(sender,sender_mac,target)` record. Senders
+        are resolved by their requests, as they are when written to
+        the database.
+        '''
+
+        self.add_counts(Counter((sender,target)
+            for sender, shw, target in records))
+
+        senders = {sender for sender, shw, target in records if shw
+            if self.target_flags.get(ip_to_int(sender)) !=
+                FLAG_ARP_RESOLVED}
+
+        if senders:
+            self.set_target_flags(dict.fromkeys(senders,FLAG_ARP_RESOLVED))
+
+    def set_target_flags(self,targets):
+        '''Set the flags of each pair requesting the targets of
+        `targets`, mapping IP addresses to flags.
+        '''
+
+        buf = self.shm.buf
+
+        self.begin()
+
+        for target, flags in targets.items():
+
+            target = ip_to_int(target)
+            self.target_flags[target] = flags
+
+            for ind in self.targets.get(target,[]):
+                offset = SLOT_OFFSET+ind*SLOT.size
+                sender, target, count, old = SLOT.unpack_from(buf,offset)
+                SLOT.pack_into(buf,offset,sender,target,count,flags)
+
+        self.end()
+
+    def publish(self,count=0,status=''):
+        '''Store the status drawn above the table. Accepts the
+        arguments of a redraw, while the requests drawn are those
+        counted by the counters.
+        '''
+
+        status = status.encode()[:STATUS_SIZE]
+
+        self.begin()
+        self.shm.buf[HEADER.size:HEADER.size+status.__len__()] = status
+        STATUS_LENGTH.pack_into(self.shm.buf,SEQUENCE.size+COUNTS.size,
+            status.__len__())
+        self.end()
+
+    # ======
+    # READER
+    # ======
+
+    def snapshot(self):
+        '''Return the requests counted, requests beyond the capacity,
+        the status and a list of `(sender,target,count,flags)` tuples
+        for each pair, where addresses are integer values.
+        '''
+
+        buf = self.shm.buf
+
+        for attempt in range(READ_ATTEMPTS):
+
+            sequence, capacity, used, requests, overflow, length = \
+                HEADER.unpack_from(buf,0)
+
+            status = bytes(buf[HEADER.size:HEADER.size+length])
+            slots = bytes(buf[SLOT_OFFSET:SLOT_OFFSET+used*SLOT.size])
+
+            if not sequence % 2 and \
+                    SEQUENCE.unpack_from(buf,0)[0] == sequence:
+                break
+
+            sleep(READ_RETRY_DELAY)
+
+        return (requests,overflow,status.decode(errors='replace'),
+            list(SLOT.iter_unpack(slots)))
+
+    def close(self):
+
+        self.shm.close()
+
+        if self.owner: self.shm.unlink()
+
+def attach_shared_memory(name):
+    '''Attach the shared memory block `name` without registering it
+    with the resource tracker, which would otherwise unlink it when
+    the reader exits. Processes started by the writer share its
+    tracker instead, which already tracks the block and must not
+    forget it.
+    '''
+
+    try:
+        return shared_memory.SharedMemory(name,track=False)
+    except TypeError:
+        pass
+
+    from multiprocessing import resource_tracker
+
+    shared = resource_tracker._resource_tracker._fd is not None
+
+    shm = shared_memory.SharedMemory(name)
+    if not shared: resource_tracker.unregister(shm._name,'shared_memory')
+
+    return shm
+
+def get_live_table(counters,color_profile=None,columns=COL_ORDER,
+        display_false=False,force_sender=False,stale_only=False,
+        limit=None,arp_resolve=False):
+    '''Return the requests counted, requests beyond the capacity, the
+    status and the table of pairs drawn from `counters`, formatted as
+    by `get_output_table`.
+    '''
+
+    # Imported here since the output module loads the database layer
+    from Eavesarp.output import build_snac
+
+    requests, overflow, status, slots = counters.snapshot()
+
+    if stale_only:
+        slots = [slot for slot in slots if slot[3] & FLAG_STALE]
+
+    if not slots:
+        return requests, overflow, status, \
+            '- No accepted ARP requests captured\n' \
+            '- If this is unexpected, check your whitelist/blacklist ' \
+            'configuration'
+
+    # Ordered as by `get_transactions`
+    key = lambda slot: (-slot[2],slot[0],slot[1])
+    if limit: slots = nsmallest(limit,slots,key=key)
+    else: slots = sorted(slots,key=key)
+
+    stale = [int_to_ip(target) for sender, target, count, flags in slots
+        if flags & FLAG_STALE]
+
+    if not color_profile or not color_profile.stale_emoji:
+        stale_char = True
+    else:
+        stale_char = color_profile.stale_emoji
+
+    columns = [col for col in columns if col in LIVE_COLUMNS]
+    if arp_resolve and not 'stale' in columns: columns.append('stale')
+
+    rowdict = {}
+    for sender, target, count, flags in slots:
+
+        sender, target = int_to_ip(sender), int_to_ip(target)
+        new_sender = sender not in rowdict
+
+        row = []
+        for col in columns:
+
+            if col == 'snac':
+                row.append(build_snac(target,stale,color_profile,
+                    display_false) if new_sender or force_sender else '')
+            elif col == 'sender':
+                row.append(sender if new_sender or force_sender else '')
+            elif col == 'target':
+                row.append(target)
+            elif col == 'arp_count':
+                row.append(str(count))
+            elif flags & FLAG_STALE:
+                row.append(stale_char)
+            elif not flags & FLAG_ARP_RESOLVED:
+                row.append('[UNCONFIRMED]')
+            else:
+                row.append(False if display_false else '')
+
+        rowdict.setdefault(sender,[]).append(row)
+
+    table = TableFormatter([COL_MAP[col] for col in columns],color_profile)
+
+    for counter, irows in enumerate(rowdict.values(),1):
+
+        # Color odd rows slightly darker
+        if color_profile: style = ('even','odd')[counter % 2]
+        else: style = None
+
+        for r in irows: table.add_row(r,style)
+
+    return requests, overflow, status, table.format()
+
+def render_live(counters,stopped,frequency,**kwargs):
+    '''Redraw the table of `counters` `frequency` times per second
+    until `stopped`, a `multiprocessing.Event`, is set. Run in a
+    renderer process, which leaves interrupts to the capture.
+    '''
+
+    signal.signal(signal.SIGINT,signal.SIG_IGN)
+
+    lcount = 0
+
+    while True:
+
+        done = stopped.wait(1/frequency)
+
+        requests, overflow, status, ptable = get_live_table(counters,
+            **kwargs)
+
+        # Clear the previous table from the screen
+        if lcount: stdout.write('\033[F\033[K'*lcount)
+
+        counted = f'Requests counted: {requests}'
+        if overflow: counted += f' ({overflow} beyond the live capacity)'
+
+        print(counted)
+        print(f'{status}\n')
+        print(ptable)
+        stdout.flush()
+
+        lcount = ptable.split('\n').__len__()+ \
+            status.split('\n').__len__()+2
+
+        if done: break
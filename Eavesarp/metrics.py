@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+'''
+Runtime metrics of a capture.
+
+`CaptureMetrics` counts the requests read from each source and the
+work of the capture loop: database flushes, resolutions and redraws.
+Rates are computed over the samples of the final `RATE_WINDOW`
+seconds. Metrics are summarized by a status line drawn above the
+output table and can be exported in the Prometheus text format by a
+`MetricsExporter`, either to a file, e.g. one read by the textfile
+collector of node_exporter, or from a local HTTP endpoint.
+'''
+
+from collections import Counter, deque
+from pathlib import Path
+from time import monotonic
+import asyncio
+import os
+
+# Seconds of samples from which rates are computed
+RATE_WINDOW = 5
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Summary:
+    '''Count, sum, maximum and most recent value of an observed
+    quantity, such as the duration of each flush.
+    '''
+
+    def __init__(self):
+
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self.last = 0
+
+    def observe(self,value):
+
+        self.count += 1
+        self.sum += value
+        self.last = value
+        if value > self.max: self.max = value
+
+class CaptureMetrics:
+    '''Metrics of a capture reading from `sources`. Queue depths and
+    drops are read from the sources when sampled, while the capture
+    loop records everything else as it works.
+    '''
+
+    def __init__(self,sources=()):
+
+        # Stopped sources are kept to report their totals
+        self.sources = list(sources)
+
+        # Requests by interface
+        self.seen = Counter()
+        self.filtered = Counter()
+
+        self.flush_seconds = Summary()
+        self.flush_requests = Summary()
+        self.render_seconds = Summary()
+
+        # Completed resolutions by (kind,result), where result is
+        # "resolved" or "failed", and resolutions in progress by kind
+        self.resolutions = Counter()
+        self.backlog = {'arp':0,'dns':0}
+
+        self.samples = deque()
+
+    def add_requests(self,interface,seen,filtered):
+
+        self.seen[interface] += seen
+        self.filtered[interface] += filtered
+
+    def add_resolution(self,kind,resolved):
+
+        self.resolutions[(kind,('failed','resolved')[bool(resolved)])] += 1
+
+    # ===========
+    # SOURCE STATE
+    # ===========
+
+    def queue_depth(self):
+
+        return sum(source.queue.qsize() for source in self.sources)
+
+    def queue_drops(self):
+
+        return {source.interface:source.dropped for source in self.sources}
+
+    def kernel_drops(self):
+        '''Return the number of packets dropped by the kernel for each
+        interface whose source reports them.
+        '''
+
+        drops = {}
+        for source in self.sources:
+            dropped = source.kernel_drops()
+            if dropped is not None: drops[source.interface] = dropped
+
+        return drops
+
+    # =====
+    # RATES
+    # =====
+
+    def sample(self):
+        '''Record the totals used to compute rates.
+        '''
+
+        now = monotonic()
+        seen = sum(self.seen.values())
+        filtered = sum(self.filtered.values())
+
+        self.samples.append((now,seen,seen-filtered,filtered,
+            sum(self.resolutions.values())))
+
+        # One sample older than the window is kept as its start
+        while self.samples.__len__() > 2 and \
+                self.samples[1][0] <= now-RATE_WINDOW:
+            self.samples.popleft()
+
+    def rates(self):
+        '''Return the number of requests seen, accepted and filtered,
+        and of resolutions completed, per second.
+        '''
+
+        if self.samples.__len__() < 2: return (0,0,0,0)
+
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = last[0]-first[0]
+
+        return tuple((b-a)/elapsed if elapsed else 0
+            for a,b in zip(first[1:],last[1:]))
+
+    # ======
+    # OUTPUT
+    # ======
+
+    def status(self):
+        '''Return lines summarizing the metrics, beneath the status of
+        the redraw scheduler.
+        '''
+
+        seen, accepted, filtered, resolutions = self.rates()
+
+        kernel_drops = self.kernel_drops()
+        kernel_drops = sum(kernel_drops.values()) if kernel_drops else 'n/a'
+
+        return f'Requests/s: {seen:.0f} seen, {accepted:.0f} accepted, ' \
+            f'{filtered:.0f} filtered | Queued: {self.queue_depth()}\n' \
+            f'Drops: {kernel_drops} kernel, ' \
+            f'{sum(self.queue_drops().values())} queue | ' \
+            f'Flush: {self.flush_seconds.last*1000:.0f}ms x ' \
+            f'{self.flush_requests.last} | ' \
+            f'Resolving: {sum(self.backlog.values())} ' \
+            f'({resolutions:.1f}/s) | ' \
+            f'Render: {self.render_seconds.last*1000:.0f}ms'
+
+    def prometheus(self):
+        '''Return the metrics in the Prometheus text format.
+        '''
+
+        lines = []
+
+        def metric(name,kind,description,values):
+
+            lines.append(f'# HELP eavesarp_{name} {description}')
+            lines.append(f'# TYPE eavesarp_{name} {kind}')
+
+            for labels, value in values:
+                labels = ','.join(f'{k}="{v}"' for k,v in labels.items())
+                if labels: labels = '{'+labels+'}'
+                lines.append(f'eavesarp_{name}{labels} {value}')
+
+        def by_interface(counts):
+
+            return [(dict(interface=interface),count)
+                for interface,count in sorted(counts.items())]
+
+        def summary(name,description,summary):
+
+            metric(name,'summary',description,[])
+            lines.append(f'eavesarp_{name}_sum {summary.sum}')
+            lines.append(f'eavesarp_{name}_count {summary.count}')
+
+        metric('requests_seen_total','counter',
+            'ARP requests read from capture sources.',
+            by_interface(self.seen))
+        metric('requests_filtered_total','counter',
+            'ARP requests rejected by whitelists and blacklists.',
+            by_interface(self.filtered))
+        metric('kernel_drops_total','counter',
+            'Packets dropped by the kernel before they were captured.',
+            by_interface(self.kernel_drops()))
+        metric('queue_drops_total','counter',
+            'Requests dropped because the queue of a source was full.',
+            by_interface(self.queue_drops()))
+        metric('queue_depth','gauge',
+            'Requests queued by sources awaiting a flush.',
+            [({},self.queue_depth())])
+
+        summary('flush_seconds','Duration of database flushes.',
+            self.flush_seconds)
+        summary('flush_requests','Requests written per database flush.',
+            self.flush_requests)
+        summary('render_seconds','Duration of output table redraws.',
+            self.render_seconds)
+
+        metric('resolutions_total','counter',
+            'Completed ARP and DNS resolutions.',
+            [(dict(kind=kind,result=result),count) for (kind,result),count
+                in sorted(self.resolutions.items())])
+        metric('resolution_backlog','gauge',
+            'Resolutions submitted that have not been written.',
+            [(dict(kind=kind),count) for kind,count
+                in sorted(self.backlog.items())])
+
+        return '\n'.join(lines)+'\n'
+
+class MetricsExporter:
+    '''Export `metrics` in the Prometheus text format to the file at
+    `path` every `interval` seconds, and from an HTTP endpoint
+    listening on `port` of the loopback interface.
+    '''
+
+    def __init__(self,metrics,path=None,port=None,interval=10):
+
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+
+        self.server = None
+        self.task = None
+
+    async def start(self):
+
+        if self.port:
+            self.server = await asyncio.start_server(self.serve,
+                '127.0.0.1',self.port)
+
+        if self.path:
+            self.task = asyncio.ensure_future(self.write_periodically())
+
+    async def write_periodically(self):
+
+        while True:
+            self.write()
+            await asyncio.sleep(self.interval)
+
+    def write(self):
+        '''Write the metrics to a temporary file that replaces the
+        previous file, so that it is never read partially written.
+        '''
+
+        self.metrics.sample()
+
+        temp = Path(f'{self.path}.tmp')
+        temp.write_text(self.metrics.prometheus())
+        os.replace(temp,self.path)
+
+    async def serve(self,reader,writer):
+
+        try:
+
+            # The request is read but every path returns the metrics
+            await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),5)
+
+            self.metrics.sample()
+            body = self.metrics.prometheus().encode()
+
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: '+CONTENT_TYPE.encode()+b'\r\n'
+                b'Content-Length: '+str(body.__len__()).encode()+b'\r\n'
+                b'Connection: close\r\n\r\n'+body)
+            await writer.drain()
+
+        except (asyncio.TimeoutError,asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError,ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    async def close(self):
+
+        if self.task:
+            self.task.cancel()
+            self.write()
+
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
@@ -1,6 +1,45 @@
 #!/usr/bin/env python3
 
 import netifaces
+from socket import inet_aton, inet_ntoa
+from struct import pack, unpack
+from hashlib import sha256
+
+def ip_to_int(value):
+    '''Convert a dotted IPv4 address to its integer value.
+    '''
+
+    return unpack('!I',inet_aton(value))[0]
+
+def int_to_ip(value):
+    '''Convert an integer to a dotted IPv4 address.
+    '''
+
+    return inet_ntoa(pack('!I',value))
+
+def hash_file(path,length=None,hasher=None,start=0,chunk_size=1<<20):
+    '''Return a SHA256 hash object updated with the content of a
+    file from `start` up to `length` bytes. Supply `hasher` to
+    continue a hash that was computed up to `start`.
+    '''
+
+    hasher = hasher or sha256()
+
+    with open(path,'rb') as infile:
+
+        infile.seek(start)
+        remaining = length-start if length is not None else None
+
+        while remaining is None or remaining > 0:
+
+            chunk = infile.read(chunk_size if remaining is None
+                    else min(chunk_size,remaining))
+            if not chunk: break
+
+            hasher.update(chunk)
+            if remaining is not None: remaining -= chunk.__len__()
+
+    return hasher
 
 def unpack_arp(arp):
     '''Validate a packet while returning the target and sender
@@ -34,3 +73,17 @@ def get_interfaces(require_ip=False):
         interfaces[iface] = (hwaddr,ips,)
 
     return interfaces
+
+def get_interface_table(require_ip=False):
+
+    from tabulate import tabulate
+
+    rows = [
+            [iface,t[0],'\n'.join(t[1])] for iface,t in
+            get_interfaces(require_ip).items()
+    ]
+
+    return tabulate(
+        rows,
+        ['Interface','MAC','IP Addresses']
+    )
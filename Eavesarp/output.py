@@ -2,108 +2,186 @@
 
 from Eavesarp.lists import *
 from Eavesarp.sql import *
-from Eavesarp.misc import get_interfaces
-from tabulate import tabulate
+from Eavesarp.columns import COL_MAP, COL_ORDER
+from Eavesarp.table import TableFormatter
 from io import StringIO
+from itertools import chain
+from time import time
 import csv
+import json
 
 # ===================
 # CONSTANTS/FUNCTIONS
 # ===================
 
-COL_MAP = {
-    'arp_count':'ARP#',
-    'sender':'Sender',
-    'sender_mac':'Sender MAC',
-    'target':'Target',
-    'target_mac':'Target MAC',
-    'stale':'Stale',
-    'sender_ptr':'Sender PTR',
-    'target_ptr':'Target PTR',
-    'target_forward':'Target PTR Forward',
-    'mitm_op':'MITM',
-    'snac':'SNAC',
-}
-
-COL_ORDER = [
-    'snac',
-    'sender',
-    'target',
-    'arp_count',
-    'stale'
-]
-
-def validate_columns(output_columns):
-
-    vals = COL_MAP.keys()
-    bad = [v for v in output_columns if not v in vals]
-
-    if bad:
-
-        print('- Invalid column values provided: ',','.join(bad))
-        print('- Valid values: ',','.join(vals))
-        print('Exiting!')
-        exit()
-
-    return
-
-def get_interface_table(require_ip=False):
-    
-    rows = [
-            [iface,t[0],'\n'.join(t[1])] for iface,t in
-            get_interfaces(require_ip).items()
-    ]
-    
-
-    return tabulate(
-        rows,
-        ['Interface','MAC','IP Addresses']
-    )
+EXPORT_FORMATS = ['csv','ndjson']
 
+# Transactions read by each query of the output table
+OUTPUT_PAGE_SIZE = 1000
 
-def get_output_csv(db_session,order_by=desc,sender_lists=None,
-        target_lists=None):
+def build_export_row(row,snac_sender_ids):
+    '''Build a dictionary of output column values from a flat
+    transaction row returned by `select_transaction_rows`. Values
+    are identical to those produced by the `Transaction.build_*`
+    methods when sender values and false values are forced.
+    '''
+
+    stale = bool(row.target_arp_resolve_attempted and not row.target_mac)
+
+    if stale: target_mac = '[STALE TARGET]'
+    elif row.target_mac: target_mac = row.target_mac
+    elif not row.target_arp_resolve_attempted: target_mac = '[UNRESOLVED]'
+    else: target_mac = None
+
+    if stale: stale_value = True
+    elif not row.target_arp_resolve_attempted: stale_value = '[UNCONFIRMED]'
+    else: stale_value = False
+
+    if stale and row.target_forward and row.target_forward != row.target:
+        mitm_op = f'T-IP:{row.target} != PTR-FWD:{row.target_forward}'
+    else:
+        mitm_op = False
+
+    return {
+        'arp_count':str(row.count),
+        'sender':row.sender,
+        'sender_mac':row.sender_mac,
+        'target':row.target,
+        'target_mac':target_mac,
+        'stale':stale_value,
+        'sender_ptr':row.sender_ptr,
+        'target_ptr':row.target_ptr,
+        'target_forward':row.target_forward or '',
+        'mitm_op':mitm_op,
+        'snac':row.sender_id in snac_sender_ids,
+    }
+
+def iter_export_rows(db_session,order_by=desc,sender_lists=None,
+        target_lists=None,limit=None,after=None,stale_only=False,
+        since=None,keys=False):
+    '''Generator that yields a dictionary of output column values
+    for each accepted transaction. Rows are streamed from the
+    database cursor, so memory use is constant regardless of the
+    number of transactions. When `since` is supplied, only the
+    requests since then are counted (see `select_window_counts`).
+
+    When `keys` is set, `(row,key)` tuples are yielded instead, where
+    `key` is the keyset pagination cursor of the transaction (see
+    `transaction_key`).
+    '''
 
-    # ==========================
-    # HANDLE SENDER/TARGET LISTS
-    # ==========================
-    
     sender_lists = sender_lists or Lists()
     target_lists = target_lists or Lists()
 
-    # ===============
-    # PREPARE COLUMNS
-    # ===============
+    snac_sender_ids = get_snac_sender_ids(db_session)
+
+    result = db_session.connection() \
+            .execution_options(stream_results=True) \
+            .execute(select_transaction_rows(order_by,after,stale_only,
+                since))
+
+    accepted = 0
+    for row in result:
+
+        if limit and accepted >= limit:
+            break
+
+        if not filter_lists(sender_lists,target_lists,row.sender,
+                row.target):
+            continue
+
+        accepted += 1
+
+        if keys:
+            yield build_export_row(row,snac_sender_ids), \
+                (row.count,row.sender_int,row.target_int)
+        else:
+            yield build_export_row(row,snac_sender_ids)
+
+    result.close()
+
+def write_output(db_session,outfile,export_format='csv',order_by=desc,
+        sender_lists=None,target_lists=None,limit=None,after=None,
+        stale_only=False,since=None,return_cursor=False):
+    '''Stream transactions to `outfile`, a writable text file
+    object, in CSV or NDJSON format. Returns the number of rows
+    written, or a `(count,cursor)` tuple when `return_cursor` is
+    set, where `cursor` is that of the last row written and is
+    passed as `after` to write the next page, or None when no rows
+    were written.
+    '''
+
+    if not export_format in EXPORT_FORMATS:
+        raise ValueError(f'Invalid export format: {export_format}')
 
     columns = list(COL_MAP.keys())
 
-    # ====================
-    # GET ALL TRANSACTIONS
-    # ====================
+    cursor = None
 
-    transactions = get_transactions(db_session,order_by)
+    def rows():
 
-    # =============================
-    # WRITE CSVS TO STRINGIO OBJECT
-    # =============================
+        nonlocal cursor
 
-    outfile = StringIO()
-    writer = csv.writer(outfile)
-    writer.writerow(columns)
+        for row, cursor in iter_export_rows(db_session,order_by,
+                sender_lists,target_lists,limit,after,stale_only,since,
+                True):
+            yield row
+
+    count = 0
+    if export_format == 'csv':
+
+        writer = csv.writer(outfile)
+        writer.writerow(columns)
+
+        for row in rows():
+            writer.writerow(row.values())
+            count += 1
+
+    else:
+
+        for row in rows():
+            outfile.write(json.dumps(row)+'\n')
+            count += 1
+
+    if return_cursor: return count, cursor
+    return count
+
+def export_output(db_session,output_file,export_format='csv',
+        *args,**kwargs):
+    '''Stream transactions to `output_file` while reporting
+    throughput to stdout. Accepts the same arguments as
+    `write_output`.
+    '''
+
+    print(f'- Writing {export_format} output to {output_file}')
+
+    start = time()
+    with open(output_file,'w',newline='') as outfile:
+        count = write_output(db_session,outfile,export_format,
+                *args,**kwargs)
+    elapsed = time()-start
 
-    #if 'snac' in columns: snacs = get_snacs(db_session)
-    #else: snacs = []
+    rate = count/elapsed if elapsed else count
+    print(f'- Wrote {count} rows in {elapsed:.2f}s ({rate:.0f} rows/s)')
 
-    # Write all transactions
-    for t in transactions:
+    return count
 
-        writer.writerow(
-            [t.bfh('build_'+col,new_sender=True,display_false=True) for col in columns]
-        )
+def get_output_csv(db_session,order_by=desc,sender_lists=None,
+        target_lists=None,limit=None,after=None,stale_only=False,
+        since=None,return_cursor=False):
+    '''Return a StringIO object containing CSV output. Use
+    `write_output` to avoid holding the output in memory. When
+    `return_cursor` is set, a `(output,cursor)` tuple is returned
+    instead, as by `write_output`.
+    '''
 
+    outfile = StringIO()
+    count, cursor = write_output(db_session,outfile,'csv',order_by,
+            sender_lists,target_lists,limit,after,stale_only,since,True)
     outfile.seek(0)
 
     # Return the output
+    if return_cursor: return outfile, cursor
     return outfile
 
 def get_stale_ips(db_session):
@@ -144,22 +222,62 @@ def build_snac(target,stale_ips,color_profile,display_false=True):
 
     return snac
 
+def get_columns(columns=COL_ORDER,arp_resolve=False,dns_resolve=False):
+    '''Return the output columns, adding the PTR/stale columns to the
+    default columns when ARP/DNS resolution is enabled.
+    '''
+
+    if columns != COL_ORDER: return columns
+
+    columns = list(columns)
+
+    if arp_resolve and not 'stale' in columns:
+        columns.append('stale')
+
+    if dns_resolve:
+        for col in ['sender_ptr','target_ptr','mitm_op']:
+            if not col in columns: columns.append(col)
+
+    return columns
+
 def get_output_table(db_session,order_by=desc,sender_lists=None,
         target_lists=None,color_profile=None,dns_resolve=True,
         arp_resolve=False,columns=COL_ORDER,display_false=False,
-        force_sender=False,stale_only=False):
+        force_sender=False,stale_only=False,limit=None,after=None,
+        since=None,return_cursor=False):
     '''Extract transaction records from the database and return
     them formatted as a table.
+
+    When `limit` is supplied, only the top `limit` accepted
+    transactions are formatted. Transactions are read from the
+    database in pages via keyset pagination, starting after the
+    `after` cursor (see `transaction_key`), so that the first screen
+    can be drawn without loading the full table.
+
+    When `since` is supplied, only transactions requested since then,
+    in seconds since the epoch, are formatted with the number of
+    requests in that window, read from their history.
+
+    When `return_cursor` is set, a `(table,cursor)` tuple is returned
+    instead, where `cursor` is that of the last transaction formatted
+    and is passed as `after` to format the next page, or None when
+    none were formatted.
     '''
 
     sender_lists = sender_lists or Lists()
     target_lists = target_lists or Lists()
 
-    transactions = get_transactions(db_session,order_by)
+    transactions = iter_transactions(db_session,order_by,
+            page_size=limit or OUTPUT_PAGE_SIZE,after=after,
+            stale_only=stale_only,since=since)
+
+    # Peek at the first transaction to determine if any exist
+    first = next(transactions,None)
 
-    if not transactions:
+    if not first:
         output = '- No accepted ARP requests captured\n' \
         '- If this is unexpected, check your whitelist/blacklist configuration'
+        if return_cursor: return output, None
         return output
 
     # ==============================
@@ -183,30 +301,16 @@ def get_output_table(db_session,order_by=desc,sender_lists=None,
     if 'snac' in columns: stale = get_stale_ips(db_session)
     else: stale = []
 
-    # =====================================================
-    # ADD PTR/STALE COLUMNS WHEN ARP/DNS RESOLVE IS ENABLED
-    # =====================================================
-
-    if arp_resolve and not 'stale' in columns \
-            and columns == COL_ORDER:
-        columns.append('stale')
-
-    if dns_resolve and columns == COL_ORDER:
-        if not 'sender_ptr' in columns:
-            columns.append('sender_ptr')
-        if not 'target_ptr' in columns:
-            columns.append('target_ptr')
-        if not 'mitm_op' in columns:
-            columns.append('mitm_op')
+    columns = get_columns(columns,arp_resolve,dns_resolve)
 
     # Organize all the records by sender IP
     rowdict = {}
-    for t in transactions:
-
-        if stale_only and not t.stale_target():
-            continue
+    accepted = 0
+    last = None
+    for t in chain([first],transactions):
 
-        smac = t.sender.mac_address
+        if limit and accepted >= limit:
+            break
 
         sender = t.sender.value
         target = t.target.value
@@ -266,30 +370,23 @@ def get_output_table(db_session,order_by=desc,sender_lists=None,
         if new_sender: rowdict[sender] = [row]
         else: rowdict[sender].append(row)
 
-    # Restructure dictionary into a list of rows
-    rows = []
+        accepted += 1
+        last = t
+
+    # Format the rows of each sender as a table
+    table = TableFormatter([COL_MAP[col] for col in columns],color_profile)
     counter = 0
 
     for sender,irows in rowdict.items():
         counter += 1
 
         # Color odd rows slightly darker
-        if color_profile:
-
-            if counter % 2:
-                rows += [color_profile.style_odd([v for v in r]) for r in irows]
-            else:
-                rows += [color_profile.style_even(r) for r in irows]
-
-        # Just add the rows otherwise
-        else: rows += irows
-
-    headers = [COL_MAP[col] for col in columns]
+        if color_profile: style = ('even','odd')[counter % 2]
+        else: style = None
 
-    # Color the headers
-    if color_profile: headers = color_profile.style_header(headers)
+        for r in irows: table.add_row(r,style)
 
     # Return the output as a table
-    return tabulate(
-            rows,
-            headers=headers)
+    if return_cursor:
+        return table.format(), last and transaction_key(last)
+    return table.format()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+'''
+Time-partitioned capture databases.
+
+A partitioned capture writes its requests to a sequence of partition
+databases instead of a single file. The database output file becomes
+a catalog, recording the path, lifetime, number of requests and size
+of each partition in its `partition` table, while the partitions are
+written alongside it and named after it and the UTC time they were
+created, e.g. `eavesarp-20240131T000000.db`. Partitions are never
+written again once a new partition is created, so they can be copied
+off a sensor as a capture continues. A capture that is restarted
+resumes the latest partition unless it's due to be replaced.
+
+A new partition is created once the `period` of the current one
+ends, periods being aligned to the epoch so that daily partitions
+begin at midnight UTC, or once the current one exceeds `max_size`
+MiB. Each partition begins with the IPs and PTR records of the
+previous one, retaining their ids, MAC addresses and resolution
+state, so addresses are not resolved again. Transactions and their
+history are not carried over.
+
+Partitions are queried in aggregate through `Eavesarp.federate`, and
+those closed before the start of a time window are pruned, since
+they hold no requests within it. Closed partitions are aggregated
+once each time the partitions are refreshed, while the partition
+being written is queried live.
+'''
+
+from Eavesarp.sql import create_db, Partition, IP, PTR
+from Eavesarp.federate import (create_federated_connection,
+        create_views, federated_session)
+from datetime import datetime, timezone
+from pathlib import Path
+import sqlite3
+
+def read_partitions(dbfile,since=None):
+    '''Return the paths of the partitions cataloged by a database
+    file, oldest first, or None when it's not a catalog, including
+    when it's missing or not a SQLite database. When `since` is set,
+    partitions closed before it are pruned. Partitions that no longer
+    exist are skipped.
+    '''
+
+    pth = Path(dbfile)
+    if not pth.is_file(): return None
+
+    try:
+
+        connection = sqlite3.connect(pth.resolve().as_uri()+'?mode=ro',
+                uri=True)
+
+        try:
+
+            if not connection.execute("SELECT 1 FROM sqlite_master "
+                    "WHERE type='table' AND name='partition'").fetchone():
+                return None
+
+            rows = connection.execute('SELECT path, end_time '
+                'FROM partition ORDER BY start_time').fetchall()
+
+        finally:
+
+            connection.close()
+
+    except sqlite3.DatabaseError:
+
+        return None
+
+    if not rows: return None
+
+    paths = []
+    for path, end_time in rows:
+
+        if since is not None and end_time is not None and \
+                end_time < since:
+            continue
+
+        path = pth.parent / path
+        if not path.is_file():
+            print(f'- Partition not found: {path}')
+            continue
+
+        paths.append(path)
+
+    return paths
+
+def expand_partitions(dbfiles,since=None):
+    '''Return `dbfiles` with each catalog replaced by the paths of
+    its partitions, pruned by `since`.
+    '''
+
+    expanded = []
+    for dbfile in dbfiles:
+        partitions = read_partitions(dbfile,since)
+        expanded += [dbfile] if partitions is None else partitions
+
+    return expanded
+
+def can_catalog(dbfile):
+    '''Determine if a database file can be used as a catalog, i.e. it
+    doesn't exist, is already a catalog or holds no transactions.
+    Files that are not SQLite databases can't.
+    '''
+
+    pth = Path(dbfile)
+    if not pth.exists() or read_partitions(pth) is not None:
+        return True
+
+    if not pth.is_file(): return False
+
+    try:
+
+        connection = sqlite3.connect(pth.resolve().as_uri()+'?mode=ro',
+                uri=True)
+
+        try:
+            return not connection.execute('SELECT 1 FROM sqlite_master '
+                "WHERE type='table' AND name='transaction'").fetchone() \
+                or not connection.execute('SELECT 1 FROM "transaction" '
+                    'LIMIT 1').fetchone()
+        finally:
+            connection.close()
+
+    except sqlite3.DatabaseError:
+
+        return False
+
+class PartitionCatalog:
+    '''Write a capture to partitions of the database file `dbfile`,
+    which catalogs them, creating a new partition every `period`
+    seconds or once a partition exceeds `max_size` MiB.
+
+    `session` queries the partitions in aggregate, pruning those
+    closed more than `window` seconds before they were last
+    refreshed.
+    '''
+
+    def __init__(self,dbfile,period=None,max_size=None,window=None):
+
+        self.path = Path(dbfile)
+        self.period = period
+        self.max_size = max_size
+        self.window = window
+
+        self.db_session = create_db(dbfile)
+        self.partition = None
+        self.connection = self.session = None
+
+    def partition_file(self,partition):
+
+        return self.path.parent / partition.path
+
+    def new_path(self,start):
+        '''Return a path for a partition created at `start`, relative
+        to the catalog.
+        '''
+
+        stamp = datetime.fromtimestamp(start,timezone.utc) \
+            .strftime('%Y%m%dT%H%M%S')
+        path = f'{self.path.stem}-{stamp}{self.path.suffix}'
+
+        # Partitions created within a second of one another
+        ind = 1
+        while (self.path.parent / path).exists():
+            path = f'{self.path.stem}-{stamp}-{ind}{self.path.suffix}'
+            ind += 1
+
+        return path
+
+    def due(self,now):
+        '''Determine if the current partition should be closed.
+        '''
+
+        partition = self.partition
+
+        if self.period and now >= \
+                (partition.start_time//self.period+1)*self.period:
+            return True
+
+        if self.max_size:
+            pth = self.partition_file(partition)
+            if pth.exists() and pth.stat().st_size >= self.max_size<<20:
+                return True
+
+        return False
+
+    def open(self,now):
+        '''Return a session of the partition to write, resuming the
+        latest partition when it's not due to be closed.
+        '''
+
+        self.partition = self.db_session.query(Partition) \
+            .order_by(Partition.start_time.desc()).first()
+
+        if self.partition and \
+                self.partition_file(self.partition).is_file() and \
+                not self.due(now):
+
+            self.partition.end_time = None
+            self.db_session.commit()
+            db_session = create_db(self.partition_file(self.partition))
+
+        else:
+
+            previous = self.partition
+            db_session = self.create(now)
+            if previous: self.seed(previous)
+
+        self.refresh(now)
+
+        return db_session
+
+    def create(self,now):
+        '''Create and catalog a new partition, returning its session.
+        '''
+
+        self.partition = Partition(path=self.new_path(now),
+            start_time=now,requests=0)
+        db_session = create_db(self.partition_file(self.partition))
+
+        self.db_session.add(self.partition)
+        self.db_session.commit()
+
+        return db_session
+
+    def seed(self,previous):
+        '''Copy the IPs and PTR records of the `previous` partition to
+        the current one.
+        '''
+
+        pth = self.partition_file(previous)
+        if not pth.is_file(): return
+
+        connection = sqlite3.connect(self.partition_file(self.partition))
+
+        try:
+
+            connection.execute('ATTACH DATABASE ? AS previous',
+                (pth.resolve().as_uri()+'?mode=ro',))
+
+            for table in [IP.__table__,PTR.__table__]:
+                columns = ', '.join(column.name for column in table.columns)
+                connection.execute(f'INSERT INTO {table.name} ({columns}) '
+                    f'SELECT {columns} FROM previous.{table.name}')
+
+            connection.commit()
+            connection.execute('DETACH DATABASE previous')
+
+        finally:
+
+            connection.close()
+
+    def add_requests(self,count):
+
+        self.partition.requests += count
+
+    def close(self,db_session,now):
+        '''Close the session of the current partition and record the
+        time it was closed.
+        '''
+
+        db_session.close()
+
+        self.partition.end_time = now
+        self.partition.size = self.partition_file(self.partition) \
+            .stat().st_size
+        self.db_session.commit()
+
+    def rotate(self,db_session,now):
+        '''Close the current partition, returning the session of a new
+        partition seeded from it.
+        '''
+
+        self.close(db_session,now)
+
+        previous = self.partition
+        db_session = self.create(now)
+        self.seed(previous)
+        self.refresh(now)
+
+        return db_session
+
+    def expire(self,before):
+        '''Remove partitions closed before `before`, returning the
+        number removed.
+        '''
+
+        expired = self.db_session.query(Partition) \
+            .filter(Partition.end_time != None) \
+            .filter(Partition.end_time < before).all()
+
+        for partition in expired:
+            pth = self.partition_file(partition)
+            if pth.exists(): pth.unlink()
+            self.db_session.delete(partition)
+
+        self.db_session.commit()
+
+        return expired.__len__()
+
+    def refresh(self,now):
+        '''Recreate the tables and views of `session` over the
+        partitions that may hold requests within the window, querying
+        the partition being written live.
+        '''
+
+        paths = read_partitions(self.path,
+            now-self.window if self.window else None)
+
+        if self.session is None:
+            self.connection = create_federated_connection(paths,1,True)
+            self.session = federated_session(self.connection)
+        else:
+            self.session.close()
+            create_views(self.connection,paths,1,True)
+
+    def describe(self):
+
+        limits = []
+
+        if self.period: limits.append(f'every {self.period:g}s')
+        if self.max_size: limits.append(f'at {self.max_size} MiB')
+
+        return f'{" or ".join(limits)}, cataloged in {self.path}'
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+
+from socket import inet_ntoa
+from struct import pack, unpack, unpack_from
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+from itertools import chain
+import bz2
+import gzip
+import lzma
+
+# ===================
+# CONSTANTS/FUNCTIONS
+# ===================
+
+# Magic values mapped to (byte order, nanosecond timestamps)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1':('<',False),
+    b'\xa1\xb2\xc3\xd4':('>',False),
+    b'\x4d\x3c\xb2\xa1':('<',True),
+    b'\xa1\xb2\x3c\x4d':('>',True),
+}
+
+GLOBAL_HEADER_LENGTH = 24
+RECORD_HEADER_LENGTH = 16
+
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+# pcapng block types
+SECTION_HEADER_BLOCK = 0x0a0d0d0a
+INTERFACE_DESCRIPTION_BLOCK = 1
+OBSOLETE_PACKET_BLOCK = 2
+SIMPLE_PACKET_BLOCK = 3
+ENHANCED_PACKET_BLOCK = 6
+
+# pcapng interface description option holding timestamp resolution
+IF_TSRESOL = 9
+
+# Read-ahead configuration for compressed captures
+READ_AHEAD_CHUNK_SIZE = 1<<20
+READ_AHEAD_DEPTH = 8
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+# Offset of the ethertype within the link layer header
+ETHERTYPE_OFFSETS = {
+    LINKTYPE_ETHERNET:12,
+    LINKTYPE_LINUX_SLL:14,
+    LINKTYPE_LINUX_SLL2:0,
+}
+
+# Offset of the payload relative to the ethertype when it differs
+# from the length of the ethertype itself
+PAYLOAD_OFFSETS = {
+    LINKTYPE_LINUX_SLL2:20,
+}
+
+ETHERTYPE_ARP = 0x0806
+ETHERTYPE_IPV4 = 0x0800
+VLAN_ETHERTYPES = (0x8100,0x88a8,0x9100)
+
+ARP_LENGTH = 28
+ARP_REQUEST = 1
+
+class PcapError(Exception):
+    pass
+
+class PcapReader:
+    '''Read records from a classic pcap file object opened in
+    binary mode.
+
+    `offset` tracks the position immediately following the last
+    complete record. When a partial record is encountered at the
+    end of a seekable file, i.e. one that is still being written,
+    the file is rewound to `offset` so that reading can resume once
+    the record is complete.
+    '''
+
+    def __init__(self,infile,offset=None):
+
+        self.infile = infile
+
+        header = infile.read(GLOBAL_HEADER_LENGTH)
+        if header.__len__() < GLOBAL_HEADER_LENGTH or \
+                header[:4] not in PCAP_MAGICS:
+            raise PcapError('Not a pcap file')
+
+        self.byte_order, self.nanosecond = PCAP_MAGICS[header[:4]]
+        self.linktype = unpack(self.byte_order+'I',header[20:])[0] \
+                & 0x0fffffff
+        self.record_header = self.byte_order+'IIII'
+        self.offset = GLOBAL_HEADER_LENGTH
+
+        if offset and offset > GLOBAL_HEADER_LENGTH:
+            infile.seek(offset)
+            self.offset = offset
+
+    def rewind(self):
+        '''Return to the end of the last complete record.
+        '''
+
+        if self.infile.seekable():
+            self.infile.seek(self.offset)
+
+    def records(self):
+        '''Generator yielding a `(timestamp, linktype, data)` tuple for
+        each complete record.
+        '''
+
+        read = self.infile.read
+        record_header = self.record_header
+        linktype = self.linktype
+        divisor = 1e9 if self.nanosecond else 1e6
+
+        while True:
+
+            header = read(RECORD_HEADER_LENGTH)
+            if header.__len__() < RECORD_HEADER_LENGTH:
+                self.rewind()
+                return
+
+            ts_sec, ts_frac, caplen, origlen = unpack(record_header,header)
+
+            data = read(caplen)
+            if data.__len__() < caplen:
+                self.rewind()
+                return
+
+            self.offset += RECORD_HEADER_LENGTH+caplen
+
+            yield ts_sec+ts_frac/divisor, linktype, data
+
+class PcapngReader:
+    '''Read packets from a pcapng file object opened in binary mode.
+    Section header and interface description blocks are tracked to
+    determine the byte order, link type and timestamp resolution of
+    each packet. Blocks other than packet blocks are skipped.
+
+    `offset` behaves identically to that of `PcapReader`. Blocks
+    preceding `offset` are scanned, skipping packet data, to recover
+    the interfaces described before it.
+    '''
+
+    def __init__(self,infile,offset=None):
+
+        self.infile = infile
+        self.byte_order = '<'
+        self.interfaces = []
+        self.offset = 0
+
+        # Read the first section header
+        block = self.read_block()
+        if not block or block[0] != SECTION_HEADER_BLOCK:
+            raise PcapError('Not a pcapng file')
+
+        if offset and offset > self.offset:
+            while self.offset < offset and self.read_block(True): pass
+
+    @property
+    def linktype(self):
+
+        return self.interfaces[0][0] if self.interfaces else None
+
+    def rewind(self):
+
+        if self.infile.seekable():
+            self.infile.seek(self.offset)
+
+    def read_block(self,skip_packets=False):
+        '''Read the next block and return a `(type, body)` tuple. The
+        body of packet blocks is not read when `skip_packets` is set.
+        `None` is returned when the block is incomplete.
+        '''
+
+        read = self.infile.read
+
+        header = read(8)
+        if header.__len__() < 8:
+            self.rewind()
+            return None
+
+        if header[:4] == PCAPNG_MAGIC:
+
+            # The byte order of a section is determined by the
+            # byte order magic that follows the block length
+            bom = read(4)
+            if bom.__len__() < 4:
+                self.rewind()
+                return None
+
+            self.byte_order = '<' if unpack('<I',bom)[0] == \
+                    PCAPNG_BYTE_ORDER_MAGIC else '>'
+            self.interfaces = []
+            header += bom
+
+        block_type, length = unpack(self.byte_order+'II',header[:8])
+
+        if length < 12 or length % 4:
+            raise PcapError(f'Invalid pcapng block length: {length}')
+
+        remaining = length-header.__len__()
+
+        if skip_packets and block_type in (ENHANCED_PACKET_BLOCK,
+                SIMPLE_PACKET_BLOCK,OBSOLETE_PACKET_BLOCK) and \
+                self.infile.seekable():
+            self.infile.seek(remaining,1)
+            body = b''
+        else:
+            body = read(remaining)
+            if body.__len__() < remaining:
+                self.rewind()
+                return None
+
+        self.offset += length
+
+        if block_type == SECTION_HEADER_BLOCK: body = header[8:]+body
+        elif block_type == INTERFACE_DESCRIPTION_BLOCK:
+            self.add_interface(body)
+
+        return block_type, body
+
+    def add_interface(self,body):
+        '''Parse an interface description block and record the link
+        type and timestamp divisor of the interface.
+        '''
+
+        linktype = unpack_from(self.byte_order+'H',body)[0]
+        divisor = 1e6
+
+        # Options follow the link type, reserved field and snaplen
+        offset = 8
+        while offset+4 <= body.__len__()-4:
+
+            code, length = unpack_from(self.byte_order+'HH',body,offset)
+            if code == 0: break
+
+            if code == IF_TSRESOL and length >= 1:
+                resolution = body[offset+4]
+                if resolution & 0x80:
+                    divisor = float(2**(resolution & 0x7f))
+                else:
+                    divisor = float(10**resolution)
+
+            offset += 4+length+(-length % 4)
+
+        self.interfaces.append((linktype,divisor))
+
+    def records(self):
+        '''Generator yielding a `(timestamp, linktype, data)` tuple for
+        each complete packet.
+        '''
+
+        while True:
+
+            block = self.read_block()
+            if not block: return
+
+            block_type, body = block
+            byte_order = self.byte_order
+
+            if block_type == ENHANCED_PACKET_BLOCK:
+
+                interface, ts_high, ts_low, caplen = \
+                        unpack_from(byte_order+'IIII',body)
+                data = body[20:20+caplen]
+
+            elif block_type == SIMPLE_PACKET_BLOCK:
+
+                interface, ts_high, ts_low = 0, 0, 0
+                origlen = unpack_from(byte_order+'I',body)[0]
+                data = body[4:4+origlen]
+
+            elif block_type == OBSOLETE_PACKET_BLOCK:
+
+                interface, drops, ts_high, ts_low, caplen = \
+                        unpack_from(byte_order+'HHIII',body)
+                data = body[20:20+caplen]
+
+            else:
+
+                continue
+
+            if interface >= self.interfaces.__len__():
+                continue
+
+            linktype, divisor = self.interfaces[interface]
+
+            yield ((ts_high<<32)|ts_low)/divisor, linktype, data
+
+class ReadAheadReader:
+    '''Wrap a file object such that chunks are read by a background
+    thread while previously read chunks are consumed, allowing the
+    decompression of a compressed capture to overlap with parsing.
+    Decompressors release the GIL, so the threads execute
+    concurrently. Closing the reader stops the thread before its next
+    read, leaving the rest of the stream unread.
+    '''
+
+    def __init__(self,infile,chunk_size=READ_AHEAD_CHUNK_SIZE,
+            depth=READ_AHEAD_DEPTH):
+
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.queue = Queue(depth)
+        self.buffer = bytearray()
+        self.position = 0
+        self.eof = False
+        self.error = None
+        self.stopped = Event()
+
+        self.thread = Thread(target=self.fill,daemon=True)
+        self.thread.start()
+
+    def put(self,chunk):
+        '''Queue a chunk, returning False when the reader is closed
+        before there's room for it.
+        '''
+
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(chunk,timeout=.1)
+                return True
+            except Full:
+                pass
+
+        return False
+
+    def fill(self):
+
+        try:
+
+            while not self.stopped.is_set():
+                chunk = self.infile.read(self.chunk_size)
+                if not self.put(chunk) or not chunk: break
+
+        except Exception as e:
+
+            self.error = e
+            self.put(b'')
+
+    def buffered(self,size):
+        '''Buffer chunks until `size` bytes are available or the end
+        of the stream is reached.
+        '''
+
+        while self.buffer.__len__()-self.position < size and not self.eof:
+
+            chunk = self.queue.get()
+
+            if not chunk:
+                self.eof = True
+                if self.error: raise self.error
+                break
+
+            # Drop consumed bytes before growing the buffer
+            if self.position:
+                del self.buffer[:self.position]
+                self.position = 0
+
+            self.buffer += chunk
+
+    def peek(self,size):
+
+        self.buffered(size)
+        return bytes(self.buffer[self.position:self.position+size])
+
+    def read(self,size):
+
+        self.buffered(size)
+        data = bytes(self.buffer[self.position:self.position+size])
+        self.position += data.__len__()
+
+        return data
+
+    def seekable(self):
+
+        return False
+
+    def close(self):
+
+        self.eof = True
+        self.stopped.set()
+
+        # Unblock the background thread, which stops before reading
+        # another chunk
+        while True:
+            try: self.queue.get_nowait()
+            except Empty: break
+
+        self.thread.join()
+        self.infile.close()
+
+def open_zstd(path):
+    '''Open a zstd compressed file for streaming decompression. The
+    optional zstandard package is required.
+    '''
+
+    try:
+        import zstandard
+    except ImportError:
+        raise PcapError('The zstandard package is required to read '
+            'zstd compressed captures: pip install zstandard')
+
+    return zstandard.ZstdDecompressor().stream_reader(open(path,'rb'),
+            closefd=True)
+
+# Compression magic values mapped to (name, opener)
+COMPRESSION_MAGICS = {
+    b'\x1f\x8b':('gzip',gzip.open),
+    b'\xfd7zXZ\x00':('xz',lzma.open),
+    b'BZh':('bz2',bz2.open),
+    b'\x28\xb5\x2f\xfd':('zstd',open_zstd),
+}
+
+def open_capture(path,offset=None):
+    '''Open a capture file and return a reader for its format, i.e.
+    `PcapReader` or `PcapngReader`. Compressed captures (gzip, xz,
+    bz2 and zstd) are decompressed in chunks by a `ReadAheadReader`
+    while they are parsed, without writing the decompressed capture
+    to disk. The `compression` attribute of
+    the reader is set to the name of the compression or `None`.
+
+    Offsets are positions within the decompressed capture, so
+    `offset` is supported only for uncompressed captures.
+    '''
+
+    infile = open(path,'rb')
+    magic = infile.read(6)
+    infile.seek(0)
+
+    compression = None
+    for prefix,(name,opener) in COMPRESSION_MAGICS.items():
+
+        if magic.startswith(prefix):
+
+            infile.close()
+            compression = name
+            infile = ReadAheadReader(opener(path))
+            break
+
+    try:
+
+        if compression: magic = infile.peek(4)[:4]
+
+        if magic[:4] == PCAPNG_MAGIC:
+            reader = PcapngReader(infile,offset)
+        else:
+            reader = PcapReader(infile,offset)
+
+    except:
+
+        infile.close()
+        raise
+
+    reader.compression = compression
+
+    return reader
+
+def open_stream(infile):
+    '''Return a `PcapReader` or `PcapngReader` for a capture being
+    streamed through a pipe, e.g. the standard output of tcpdump or
+    dumpcap. `infile` must be a buffered binary stream.
+    '''
+
+    if infile.peek(4)[:4] == PCAPNG_MAGIC:
+        return PcapngReader(infile)
+    else:
+        return PcapReader(infile)
+
+def write_pcap(path,records,snaplen=65535):
+    '''Write `(timestamp,linktype,data)` records to a classic pcap
+    file. The link type of the first record is used for the file.
+    '''
+
+    records = iter(records)
+    first = next(records,None)
+
+    with open(path,'wb') as outfile:
+
+        outfile.write(pack('<IHHiIII',0xa1b2c3d4,2,4,0,0,snaplen,
+            first[1] if first else LINKTYPE_ETHERNET))
+
+        if not first: return
+
+        for timestamp, linktype, data in chain([first],records):
+            seconds = int(timestamp)
+            outfile.write(pack('<IIII',seconds,
+                min(round((timestamp-seconds)*1e6),999999),
+                data.__len__(),data.__len__())+data)
+
+def parse_arp(data,linktype=LINKTYPE_ETHERNET):
+    '''Parse a frame and return a `(sender,sender_mac,target)` tuple
+    when it contains an ARP WHO-HAS request for an IPv4 address.
+    `None` is returned otherwise.
+    '''
+
+    offset = ETHERTYPE_OFFSETS.get(linktype)
+    if offset is None or data.__len__() < offset+2:
+        return None
+
+    ethertype = unpack_from('!H',data,offset)[0]
+    payload = offset+PAYLOAD_OFFSETS.get(linktype,2)
+
+    # Skip VLAN tags
+    while ethertype in VLAN_ETHERTYPES and data.__len__() >= payload+4:
+        ethertype = unpack_from('!H',data,payload+2)[0]
+        payload += 4
+
+    if ethertype != ETHERTYPE_ARP or \
+            data.__len__() < payload+ARP_LENGTH:
+        return None
+
+    htype, ptype, hlen, plen, op = unpack_from('!HHBBH',data,payload)
+
+    if op != ARP_REQUEST or ptype != ETHERTYPE_IPV4 or \
+            hlen != 6 or plen != 4:
+        return None
+
+    return (inet_ntoa(data[payload+14:payload+18]),
+            data[payload+8:payload+14].hex(':'),
+            inet_ntoa(data[payload+24:payload+28]))
+
+def iter_arp_requests(reader,timestamps=False):
+    '''Generator yielding a `(sender,sender_mac,target)` tuple for
+    each ARP WHO-HAS request read by a `PcapReader` or
+    `PcapngReader`, preceded by the timestamp of its record when
+    `timestamps` is set.
+    '''
+
+    if timestamps:
+
+        for timestamp, linktype, data in reader.records():
+            arp = parse_arp(data,linktype)
+            if arp: yield (timestamp,)+arp
+
+        return
+
+    for timestamp, linktype, data in reader.records():
+        arp = parse_arp(data,linktype)
+        if arp: yield arp
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+'''
+Profiling of the analyze and capture subcommands.
+
+While a `Profiler` runs, the main thread is profiled by cProfile
+and allocations are traced by tracemalloc. Work is also grouped in
+spans by subsystem:
+
+- ingest: reading requests from pcap files, SQLite files and
+  capture sources
+- filter: applying whitelists and blacklists to captured requests
+- db: writing requests and resolutions to the database
+- resolve: ARP and DNS resolution, including resolutions run in
+  background threads
+- render: drawing the output table and writing exports
+
+Spans record their duration and the peak memory traced while they
+run on the main thread. Once stopped, the profile is written to
+`<prefix>.pstats`, collapsed stacks to `<prefix>.collapsed`, which
+flamegraph.pl and speedscope accept, and a summary of the spans and
+hotspots to `<prefix>.txt`.
+
+`span` is a no-op unless a profiler is running, so spans are left in
+place around batches of work.
+'''
+
+from Eavesarp.table import TableFormatter
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from pathlib import Path
+import threading
+import tracemalloc
+import cProfile
+import pstats
+
+SUBSYSTEMS = ['ingest','filter','db','resolve','render']
+
+# Number of functions listed as hotspots
+TOP_FUNCTIONS = 15
+
+# Stacks are expanded to this depth, and smaller branches in
+# microseconds are dropped
+MAX_DEPTH = 64
+MIN_BRANCH = 1
+
+# The running profiler, if any
+PROFILER = None
+
+def span(name):
+    '''Return a context manager timing the enclosed work as part of
+    the subsystem `name`.
+    '''
+
+    if PROFILER is None: return nullcontext()
+    return PROFILER.span(name)
+
+def traced(name,func):
+    '''Return `func` wrapped in a span, e.g. to time work submitted
+    to a thread pool, or `func` itself when not profiling.
+    '''
+
+    if PROFILER is None: return func
+
+    def wrapper(*args,**kwargs):
+        with span(name):
+            return func(*args,**kwargs)
+
+    return wrapper
+
+class SpanStats:
+
+    def __init__(self):
+
+        self.calls = 0
+        self.seconds = 0
+        self.self_seconds = 0
+        self.peak = None
+
+class Profiler:
+    '''Profile the main thread and time spans until `stop` is called,
+    writing the results to files beginning with `prefix`.
+    '''
+
+    def __init__(self,prefix):
+
+        self.prefix = prefix
+        self.profile = cProfile.Profile()
+        self.spans = {name:SpanStats() for name in SUBSYSTEMS}
+        self.lock = threading.Lock()
+
+        # Open spans of each thread
+        self.local = threading.local()
+
+        self.seconds = 0
+        self.peak = 0
+
+    def start(self):
+
+        tracemalloc.start()
+        self.started = perf_counter()
+        self.profile.enable()
+
+    def stop(self):
+
+        self.profile.disable()
+        self.seconds = perf_counter()-self.started
+        self.peak = tracemalloc.get_traced_memory()[1]
+
+        for stats in self.spans.values():
+            if stats.peak is not None:
+                self.peak = max(self.peak,stats.peak)
+
+        tracemalloc.stop()
+
+    @contextmanager
+    def span(self,name):
+
+        stack = self.local.__dict__.setdefault('stack',[])
+
+        # The peak of tracemalloc is shared by every thread, so it's
+        # only reset for spans of the main thread
+        main = threading.current_thread() is threading.main_thread()
+
+        # Open spans are [peak,child_seconds] lists. The peak of the
+        # enclosing span is carried over before resetting it.
+        if main:
+            if stack:
+                stack[-1][0] = max(stack[-1][0],
+                    tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        entry = [0,0]
+        stack.append(entry)
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+
+            seconds = perf_counter()-start
+            stack.pop()
+
+            if stack: stack[-1][1] += seconds
+
+            peak = None
+            if main:
+                peak = max(entry[0],tracemalloc.get_traced_memory()[1])
+                if stack: stack[-1][0] = max(stack[-1][0],peak)
+
+            with self.lock:
+
+                stats = self.spans.setdefault(name,SpanStats())
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.self_seconds += seconds-entry[1]
+
+                if peak is not None:
+                    stats.peak = max(stats.peak or 0,peak)
+
+    # ======
+    # OUTPUT
+    # ======
+
+    def write(self):
+        '''Write the profile, collapsed stacks and summary, returning
+        the summary.
+        '''
+
+        stats = pstats.Stats(self.profile)
+        stats.dump_stats(f'{self.prefix}.pstats')
+
+        with open(f'{self.prefix}.collapsed','w') as outfile:
+            for stack, microseconds in collapse_stacks(stats.stats):
+                outfile.write(f'{";".join(stack)} {microseconds}\n')
+
+        summary = self.summary(stats)
+        Path(f'{self.prefix}.txt').write_text(summary+'\n')
+
+        return summary
+
+    def summary(self,stats):
+
+        lines = [f'Profile: {self.seconds:.3f}s, peak memory '
+            f'{self.peak/(1<<20):.1f} MiB',
+            '']
+
+        table = TableFormatter(['Span','Calls','Seconds','Self',
+            'Peak MiB'])
+        for name, span in self.spans.items():
+            if not span.calls: continue
+            table.add_row([name,span.calls,f'{span.seconds:.3f}',
+                f'{span.self_seconds:.3f}',
+                f'{span.peak/(1<<20):.1f}' if span.peak is not None
+                    else '-'])
+
+        if table.rows: lines += [table.format(),'']
+
+        table = TableFormatter(['Function','Calls','Self','Cumulative'])
+        for func, (cc,nc,tt,ct,callers) in sorted(stats.stats.items(),
+                key=lambda item: item[1][2],reverse=True)[:TOP_FUNCTIONS]:
+            table.add_row([label(func),nc,f'{tt:.3f}',f'{ct:.3f}'])
+
+        lines += [table.format(),'',
+            f'- Profile written to {self.prefix}.pstats, collapsed stacks '
+            f'to {self.prefix}.collapsed']
+
+        return '\n'.join(lines)
+
+def label(func):
+    '''Return a frame label, e.g. "handle_counts (eavesarp.py:67)".
+    '''
+
+    filename, line, name = func
+
+    # Built-in functions have no file
+    if filename == '~': return name
+
+    return f'{name} ({Path(filename).name}:{line})'
+
+def collapse_stacks(stats):
+    '''Generator yielding `(stack,microseconds)` tuples of the self
+    time of each function by stack, as expected by flamegraph.pl.
+
+    cProfile records calls between pairs of functions rather than
+    full stacks, so the time of functions called from more than one
+    place is apportioned to each stack by the share of time spent
+    in it by each caller.
+    '''
+
+    callees = {}
+    for func, (cc,nc,tt,ct,callers) in stats.items():
+        for caller, (ccc,cnc,ctt,cct) in callers.items():
+            callees.setdefault(caller,[]).append((func,cct))
+
+    # Functions called by no profiled function, e.g. the function
+    # that enabled the profile
+    roots = [func for func, (cc,nc,tt,ct,callers) in stats.items()
+        if not [caller for caller in callers if caller != func]]
+
+    def expand(func,seconds,stack):
+
+        cc, nc, tt, ct, callers = stats[func]
+        ratio = seconds/ct if ct else 0
+        stack = stack+[label(func)]
+
+        microseconds = round(tt*ratio*1e6)
+        if microseconds >= MIN_BRANCH: yield stack, microseconds
+
+        if stack.__len__() >= MAX_DEPTH: return
+
+        for callee, callee_seconds in callees.get(func,[]):
+
+            # Recursion is collapsed into the first call
+            if label(callee) in stack: continue
+
+            callee_seconds *= ratio
+            if callee_seconds*1e6 >= MIN_BRANCH:
+                yield from expand(callee,callee_seconds,stack)
+
+    for root in roots:
+        yield from expand(root,stats[root][3],[])
+
+@contextmanager
+def profiling(prefix):
+    '''Profile the enclosed work when `prefix` is set, printing the
+    summary once it's done.
+    '''
+
+    global PROFILER
+
+    if not prefix:
+        yield
+        return
+
+    PROFILER = Profiler(prefix)
+    PROFILER.start()
+
+    try:
+        yield
+    finally:
+
+        profiler, PROFILER = PROFILER, None
+        profiler.stop()
+
+        print('\n'+profiler.write())
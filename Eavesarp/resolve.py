@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
 from Eavesarp.sql import *
-from scapy.all import ARP,sr
-from dns import reversename, resolver
 
 def reverse_dns_resolve(ip):
     '''Attempt reverse name resolution on an IP address. Returns
     `None` upon exception, which occurs when an address without a
     PTR record is requested.
     '''
-    
+
+    from dns import reversename, resolver
+
     try:
 
         rev_name = reversename.from_address(ip)
@@ -31,7 +31,7 @@ def reverse_dns_resolve_ips(db_file):
 
     sess = create_db(db_file)
     ips = sess.query(IP) \
-        .filter(IP.reverse_dns_attempted != True) \
+        .filter(IP.reverse_dns_attempted == False) \
         .all()
 
     for ip in ips:
@@ -52,8 +52,13 @@ def arp_resolve(interface,target,verbose=0,retry=0,timeout=1):
     the MAC address for the target if successful, None otherwise.
     '''
 
-    results, unanswered = sr(
-        ARP(
+    # scapy is loaded only when ARP resolution is performed
+    from scapy.all import ARP,Ether,srp
+
+    # Sent at layer 2 so that the request leaves through the
+    # interface regardless of the routing table
+    results, unanswered = srp(
+        Ether(dst='ff:ff:ff:ff:ff:ff')/ARP(
             op=1,
             pdst=target,
         ),
@@ -68,15 +73,26 @@ def arp_resolve(interface,target,verbose=0,retry=0,timeout=1):
     else:
         return None
 
-def arp_resolve_ips(interface,db_file,verbose=0,retry=0,timeout=1):
+def arp_resolve_ips(interfaces,db_file,verbose=0,retry=0,timeout=1):
+    '''Attempt ARP resolution of each IP not yet resolved. Requests
+    are sent from the interface on which the IP was observed, or from
+    the first of `interfaces` for IPs not captured on an interface.
+    '''
+
+    if isinstance(interfaces,str): interfaces = [interfaces]
 
     sess = create_db(db_file)
     to_resolve = sess.query(IP) \
-                    .filter(IP.arp_resolve_attempted != True) \
+                    .filter(IP.arp_resolve_attempted == False) \
                     .all()
 
+    ip_interfaces = get_ip_interfaces(sess)
+
     for ip in to_resolve:
 
+        interface = ip_interfaces.get(ip.id)
+        if interface not in interfaces: interface = interfaces[0]
+
         hwaddr = arp_resolve(interface,ip.value,verbose,retry,timeout)
 
         if hwaddr:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+'''
+Wall clock scheduling of output table redraws.
+
+Changes are coalesced into frames drawn no more than `max_fps`
+times per second. Each frame is timed, and the interval between
+frames is doubled while frames take longer than the render budget,
+then halved as they become cheaper again, so that large tables
+cannot monopolize the capture.
+'''
+
+from contextlib import contextmanager
+from time import monotonic
+
+# Slowest rate that backing off can reach, in seconds per frame
+MAX_INTERVAL = 10.0
+
+class RedrawScheduler:
+    '''Determine when a frame is due. `request` marks that a change
+    is awaiting a frame, `delay` returns the seconds until the frame
+    is due and `frame` times the drawing of a frame.
+
+    `budget` is the number of seconds a frame may take before the
+    scheduler backs off.
+    '''
+
+    def __init__(self,max_fps=5,budget=0.1,max_interval=MAX_INTERVAL):
+
+        self.min_interval = 1/max_fps
+        self.max_interval = max(max_interval,self.min_interval)
+        self.interval = self.min_interval
+        self.budget = budget
+
+        self.pending = False
+        self.last_frame = None
+        self.render_time = 0
+
+    def request(self):
+
+        self.pending = True
+
+    def delay(self):
+        '''Return the seconds until the next frame is due, or None
+        when no change is awaiting a frame.
+        '''
+
+        if not self.pending: return None
+        if self.last_frame is None: return 0
+
+        return max(0,self.last_frame+self.interval-monotonic())
+
+    def due(self):
+
+        return self.delay() == 0
+
+    @contextmanager
+    def frame(self):
+
+        self.pending = False
+        start = monotonic()
+
+        try:
+            yield
+        finally:
+            self.last_frame = start
+            self.render_time = monotonic()-start
+            self.adapt()
+
+    def adapt(self):
+
+        if self.render_time > self.budget:
+            self.interval = min(self.interval*2,self.max_interval)
+        elif self.render_time < self.budget/2:
+            self.interval = max(self.interval/2,self.min_interval)
+
+    @property
+    def backing_off(self):
+
+        return self.interval > self.min_interval
+
+    def status(self):
+        '''Return a line describing the previous frame and the current
+        redraw rate.
+        '''
+
+        status = f'Redraw: {self.render_time*1000:.0f}ms of ' \
+            f'{self.budget*1000:.0f}ms budget, ' \
+            f'{1/self.interval:.1f} fps max'
+
+        if self.backing_off: status += ' (backing off)'
+
+        return status
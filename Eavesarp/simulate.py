@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+'''
+Simulated network for capturing without privileges.
+
+A `SimulatedSource` replaces the sniffer of an interface, queueing
+the ARP requests of a capture file, or of `SyntheticTraffic`, at a
+fixed rate. A `SimulatedResponder` answers the ARP and reverse DNS
+resolution of the capture on behalf of a set of live hosts. Together
+they run the full capture loop, including resolution and drawing,
+deterministically and without root or a network interface.
+
+Synthetic hosts are numbered from 10.0.0.1. A `stale_ratio` of the
+hosts never send requests and never answer ARP resolution, leaving
+them stale. Requests are spread across `pairs` distinct sender/target
+pairs, either uniformly or following a Zipf distribution where a few
+pairs account for most requests. Traffic is generated from `seed`,
+so the same arguments always produce the same requests.
+'''
+
+from Eavesarp.misc import int_to_ip
+from Eavesarp.pcap import (open_capture, parse_arp, write_pcap,
+        LINKTYPE_ETHERNET, ETHERTYPE_ARP, ARP_REQUEST)
+from Eavesarp.sniffer import CaptureSource
+from itertools import accumulate
+from threading import Event
+from struct import pack
+from time import monotonic, sleep
+import random
+
+DISTRIBUTIONS = ['uniform','zipf']
+
+# First host address, 10.0.0.1
+FIRST_HOST = 0x0a000001
+
+BROADCAST = b'\xff'*6
+
+# Domain of the PTR records answered for synthetic hosts
+DOMAIN = 'eavesarp.test'
+
+class SyntheticTraffic:
+    '''Generate `packets` ARP requests between `pairs` sender/target
+    pairs. `pairs` defaults to a tenth of `packets`, and `hosts` to
+    twice the square root of `pairs`, which leaves room to draw the
+    pairs at random.
+    '''
+
+    def __init__(self,packets,pairs=None,hosts=None,stale_ratio=0.1,
+            distribution='zipf',zipf_exponent=1.0,seed=0):
+
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f'Unknown distribution: {distribution}')
+
+        self.packets = packets
+        self.pairs = min(pairs or max(packets//10,1),packets)
+        self.hosts = hosts or max(int((self.pairs*4)**0.5),4)
+        self.stale_ratio = stale_ratio
+        self.distribution = distribution
+        self.zipf_exponent = zipf_exponent
+        self.seed = seed
+
+        # Stale hosts are only ever targets
+        self.stale_hosts = min(int(self.hosts*stale_ratio),self.hosts-1)
+        senders = self.hosts-self.stale_hosts
+
+        if self.pairs > senders*(self.hosts-1):
+            raise ValueError(f'{self.hosts} hosts cannot form '
+                f'{self.pairs} pairs')
+
+        self.addresses = [int_to_ip(FIRST_HOST+ind)
+            for ind in range(self.hosts)]
+        self.macs = [':'.join(f'{b:02x}' for b in
+            pack('!HI',0x0200,FIRST_HOST+ind))
+            for ind in range(self.hosts)]
+
+    def draw_pairs(self,rand):
+        '''Return a list of distinct `(sender,target)` host indexes.
+        '''
+
+        pairs = set()
+        while pairs.__len__() < self.pairs:
+
+            sender = rand.randrange(self.stale_hosts,self.hosts)
+            target = rand.randrange(self.hosts)
+
+            if sender != target: pairs.add((sender,target))
+
+        # Sorted before shuffling since set order is not seeded
+        pairs = sorted(pairs)
+        rand.shuffle(pairs)
+
+        return pairs
+
+    def iter_pairs(self):
+        '''Generator yielding the `(sender,target)` host indexes of
+        each request. Each pair is requested at least once.
+        '''
+
+        rand = random.Random(self.seed)
+        pairs = self.draw_pairs(rand)
+
+        if self.distribution == 'zipf':
+            weights = [1/rank**self.zipf_exponent
+                for rank in range(1,pairs.__len__()+1)]
+        else:
+            weights = [1]*pairs.__len__()
+
+        requests = list(range(pairs.__len__()))
+        requests += rand.choices(range(pairs.__len__()),
+            cum_weights=list(accumulate(weights)),
+            k=self.packets-pairs.__len__())
+        rand.shuffle(requests)
+
+        for ind in requests: yield pairs[ind]
+
+    def records(self):
+        '''Generator yielding `(sender,sender_mac,target)` records,
+        as accepted by `handle_records`.
+        '''
+
+        addresses, macs = self.addresses, self.macs
+
+        for sender, target in self.iter_pairs():
+            yield addresses[sender], macs[sender], addresses[target]
+
+    def frames(self):
+        '''Generator yielding a `(timestamp,linktype,data)` record
+        for each request, i.e. an Ethernet frame sent a millisecond
+        after the previous request.
+        '''
+
+        for ind, (sender, target) in enumerate(self.iter_pairs()):
+
+            mac = pack('!HI',0x0200,FIRST_HOST+sender)
+            yield (ind/1000,LINKTYPE_ETHERNET,
+                BROADCAST+mac+pack('!H',ETHERTYPE_ARP)+ \
+                pack('!HHBBH',1,0x0800,6,4,ARP_REQUEST)+ \
+                mac+pack('!I',FIRST_HOST+sender)+ \
+                b'\x00'*6+pack('!I',FIRST_HOST+target))
+
+    def write(self,path):
+        '''Write the requests to a classic pcap file.
+        '''
+
+        write_pcap(path,self.frames())
+
+    def __repr__(self):
+
+        return f'<SyntheticTraffic packets:{self.packets}, ' \
+            f'pairs:{self.pairs}, hosts:{self.hosts}, ' \
+            f'stale:{self.stale_hosts}, {self.distribution}>'
+
+def replay_capture(path):
+    '''Generator yielding the `(timestamp,linktype,data)` records of
+    a capture file, closing it once exhausted.
+    '''
+
+    reader = open_capture(path)
+
+    try:
+        yield from reader.records()
+    finally:
+        reader.infile.close()
+
+class SimulatedSource(CaptureSource):
+    '''Queue the ARP requests of `frames`, an iterable of
+    `(timestamp,linktype,data)` records such as those returned by
+    `replay_capture` and `SyntheticTraffic.frames`, at `rate`
+    requests per second, or as fast as possible when `rate` is 0.
+
+    The MAC address of each sender is recorded in `hosts` when it's
+    supplied, allowing a `SimulatedResponder` to answer for the hosts
+    of a replayed capture.
+    '''
+
+    def __init__(self,interface,frames,rate=0,keep_frames=False,
+            hosts=None,max_queue=0):
+
+        super().__init__(interface,keep_frames,max_queue)
+        self.frames = frames
+        self.rate = rate
+        self.hosts = hosts
+        self.stopped = Event()
+
+    def read(self):
+
+        put, keep_frames, hosts = self.put, self.keep_frames, self.hosts
+        start = monotonic()
+
+        for ind, frame in enumerate(self.frames):
+
+            if self.stopped.is_set(): break
+
+            # Frames are not delayed by less than a millisecond, which
+            # sleeping cannot do precisely
+            if self.rate:
+                delay = start+ind/self.rate-monotonic()
+                if delay > 0.001 and self.stopped.wait(delay): break
+
+            record = parse_arp(frame[2],frame[1])
+            if not record: continue
+
+            if hosts is not None: hosts[record[0]] = record[1]
+            put(record,frame if keep_frames else None)
+
+    def describe_exit(self):
+
+        return self.error or \
+            f'Simulated capture finished on {self.interface}'
+
+    def stop(self,timeout=5):
+
+        self.stopped.set()
+        super().stop(timeout)
+
+class SimulatedResponder:
+    '''Answer resolution on behalf of simulated hosts. `hosts` maps
+    the IP of each live host to its MAC address and `ptrs` maps IPs
+    to `(ptr,forward_ip)` tuples, as returned by
+    `reverse_dns_resolve`.
+
+    Live hosts answer ARP resolution after `latency` seconds, while
+    resolution of other hosts fails after `timeout` seconds, as it
+    does when no reply is received.
+    '''
+
+    def __init__(self,hosts=None,ptrs=None,latency=0.001,timeout=1):
+
+        self.hosts = hosts if hosts is not None else {}
+        self.ptrs = ptrs or {}
+        self.latency = latency
+        self.timeout = timeout
+
+    @classmethod
+    def from_traffic(cls,traffic,**kwargs):
+        '''Return a responder answering for the live hosts of
+        `traffic`. Every host has a PTR record, which resolves to the
+        first live host for stale hosts, making each a MITM candidate.
+        '''
+
+        live = range(traffic.stale_hosts,traffic.hosts)
+        hosts = {traffic.addresses[ind]:traffic.macs[ind] for ind in live}
+
+        ptrs = {}
+        for ind, address in enumerate(traffic.addresses):
+            forward_ip = address if ind in live else \
+                traffic.addresses[traffic.stale_hosts]
+            ptrs[address] = (f'host{ind}.{DOMAIN}.',forward_ip)
+
+        return cls(hosts,ptrs,**kwargs)
+
+    def arp_resolve(self,interface,target,*args,**kwargs):
+
+        mac = self.hosts.get(target)
+        sleep(self.latency if mac else self.timeout)
+
+        return mac
+
+    def reverse_dns_resolve(self,ip):
+
+        sleep(self.latency)
+
+        return self.ptrs.get(ip,(None,None))
+
+def simulate_capture(interfaces,simulation,rate=0,seed=0,
+        keep_frames=False,max_queue=0):
+    '''Return a `SimulatedSource` for each of `interfaces` and a
+    `SimulatedResponder` answering for their hosts. `simulation` is
+    either a number of synthetic requests to generate on each
+    interface, from `seed` onward, or the path to a capture file that
+    each source replays.
+    '''
+
+    if isinstance(simulation,int):
+
+        traffic = [SyntheticTraffic(simulation,seed=seed+ind)
+            for ind in range(interfaces.__len__())]
+
+        # Hosts are numbered identically regardless of the seed
+        responder = SimulatedResponder.from_traffic(traffic[0])
+
+        sources = [SimulatedSource(interface,t.frames(),rate,keep_frames,
+            max_queue=max_queue) for interface,t in zip(interfaces,traffic)]
+
+    else:
+
+        responder = SimulatedResponder()
+
+        sources = [SimulatedSource(interface,replay_capture(simulation),
+            rate,keep_frames,responder.hosts,max_queue)
+            for interface in interfaces]
+
+    return sources, responder
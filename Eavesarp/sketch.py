@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+'''
+Approximate counting of ARP requests by sender/target pair.
+
+Continuous monitoring sees an unbounded number of one-off pairs,
+while only the pairs requested most often and those requesting stale
+targets are of interest. An `ApproximateCounter` counts every pair in
+a `CountMinSketch` of fixed size and follows the `top_k` pairs with
+the largest estimates in a `HeavyHitters` structure. When flushed,
+only heavy hitters and pairs whose targets are known to be stale are
+written to the database as transactions. Every address is still
+written as an IP, so targets continue to be resolved.
+
+Estimates never undercount a pair. With probability `1-failure`,
+they overcount it by at most `error` times the total number of
+requests counted. Conservative updates, which only raise the counters
+of a pair that hold its estimate, keep overcounts well below this
+bound in practice.
+
+Pairs requesting a stale target are tracked once the target is
+known to be stale, after which every request of the pair is written.
+Since the pairs requesting a target aren't kept, those counted before
+the target was found stale are recovered by estimating the pair of
+each sender seen with the target. Only pairs estimated above the
+error bound are tracked, as lesser estimates may be entirely due to
+other pairs. Others are tracked from their next request.
+'''
+
+from Eavesarp.sql import IP, write_ips, write_pair_counts
+from Eavesarp.misc import ip_to_int, int_to_ip
+from heapq import heapify, heappush, heappop
+from collections import Counter
+from itertools import islice
+from math import ceil, e, log
+from array import array
+import random
+
+# Default maximum overcount as a fraction of requests counted, and
+# the probability of exceeding it
+DEFAULT_ERROR = 0.00001
+DEFAULT_FAILURE = 0.01
+
+# Default number of heavy hitters
+DEFAULT_TOP_K = 1000
+
+# Mersenne prime modulus of the row hashes
+PRIME = (1<<61)-1
+
+# Records counted by pair before they're added to the sketch
+BATCH_RECORDS = 65536
+
+class CountMinSketch:
+    '''Count integer keys in `depth` rows of `width` counters,
+    where the width is `e/error` and the depth is `ln(1/failure)`.
+    Each key is counted in one counter of each row, chosen by a hash
+    of the key drawn for the row from `seed`, and is estimated by the
+    smallest of its counters.
+    '''
+
+    def __init__(self,error=DEFAULT_ERROR,failure=DEFAULT_FAILURE,
+            seed=0):
+
+        self.error = error
+        self.failure = failure
+        self.width = ceil(e/error)
+        self.depth = max(ceil(log(1/failure)),1)
+
+        # Row hashes are ((a*key+b) mod PRIME) mod width
+        rand = random.Random(seed)
+        self.hashes = [(rand.randrange(1,PRIME),rand.randrange(PRIME))
+            for ind in range(self.depth)]
+        self.rows = [array('Q',bytes(8*self.width))
+            for ind in range(self.depth)]
+
+        # Total of every count added
+        self.total = 0
+
+    def indexes(self,key):
+
+        width = self.width
+        return [(a*key+b) % PRIME % width for a,b in self.hashes]
+
+    def add(self,key,count=1):
+        '''Add `count` to `key`, returning its new estimate.
+        '''
+
+        cells = list(zip(self.rows,self.indexes(key)))
+        estimate = min(row[ind] for row,ind in cells)+count
+
+        # Conservative update
+        for row, ind in cells:
+            if row[ind] < estimate: row[ind] = estimate
+
+        self.total += count
+
+        return estimate
+
+    def estimate(self,key):
+
+        return min(row[ind] for row,ind in
+            zip(self.rows,self.indexes(key)))
+
+    def bound(self):
+        '''Return the maximum overcount of an estimate, which holds
+        with probability `1-failure`.
+        '''
+
+        return ceil(self.error*self.total)
+
+    @property
+    def size(self):
+        '''Bytes held by the counters.
+        '''
+
+        return self.width*self.depth*8
+
+class HeavyHitters:
+    '''Follow the `k` keys offered with the largest estimates.
+    `counts` maps each key to its latest estimate, while a heap of
+    `(estimate,key)` entries orders them. Entries are replaced lazily
+    as estimates grow, and the heap is rebuilt once it holds several
+    times `k` entries.
+    '''
+
+    def __init__(self,k=DEFAULT_TOP_K):
+
+        self.k = k
+        self.counts = {}
+        self.heap = []
+
+    def offer(self,key,estimate):
+
+        counts, heap = self.counts, self.heap
+
+        if key in counts or counts.__len__() < self.k:
+            counts[key] = estimate
+            heappush(heap,(estimate,key))
+
+        else:
+
+            # Discard entries superseded by a larger estimate
+            while counts.get(heap[0][1]) != heap[0][0]: heappop(heap)
+
+            if estimate <= heap[0][0]: return
+
+            del counts[heappop(heap)[1]]
+            counts[key] = estimate
+            heappush(heap,(estimate,key))
+
+        if heap.__len__() > 4*self.k:
+            self.heap = [(count,key) for key,count in counts.items()]
+            heapify(self.heap)
+
+    def __contains__(self,key):
+
+        return key in self.counts
+
+    def __len__(self):
+
+        return self.counts.__len__()
+
+class ApproximateCounter:
+    '''Count `(sender,sender_mac,target)` records approximately,
+    writing only the `top_k` heavy hitters and pairs requesting stale
+    targets to the database. See the module documentation for the
+    meaning of `error` and `failure`.
+
+    The counter accepts the records of `PairAggregator.update` and
+    the arrays of `PairAggregator.update_arrays` without their
+    timestamps and buckets, since no history is recorded, and is
+    flushed in the same way, but retains its counts between flushes.
+    Each flush writes the growth of each estimate since the pair was
+    last written, so counts accumulate in the database across flushes
+    and runs.
+
+    Memory is fixed by the sketch and `top_k`, aside from the
+    addresses seen, the pairs requesting stale targets and the
+    estimate last written for each pair.
+    '''
+
+    def __init__(self,top_k=DEFAULT_TOP_K,error=DEFAULT_ERROR,
+            failure=DEFAULT_FAILURE):
+
+        self.sketch = CountMinSketch(error,failure)
+        self.heavy = HeavyHitters(top_k)
+
+        # Stale target values and the pairs requesting them
+        self.stale = set()
+        self.tracked = set()
+
+        # Estimate last written for each pair
+        self.written = {}
+
+        # Integer values of the addresses seen and MAC addresses of
+        # senders, and those that have not been written
+        self.addresses = {}
+        self.macs = {}
+        self.new_addresses = {}
+        self.new_macs = {}
+
+        # Requests counted since the last flush
+        self.requests = 0
+
+    def value(self,address):
+        '''Return the integer value of `address`, noting new
+        addresses to be written.
+        '''
+
+        int_value = self.addresses.get(address)
+
+        if int_value is None:
+            int_value = self.addresses[address] = ip_to_int(address)
+            self.new_addresses[int_value] = address
+
+        return int_value
+
+    def sketch_key(self,key):
+
+        return self.value(key[0])<<32 | self.value(key[1])
+
+    def add(self,sender,target,count,mac=None):
+
+        key = (sender,target)
+        self.heavy.offer(key,self.sketch.add(self.sketch_key(key),count))
+
+        if target in self.stale: self.tracked.add(key)
+
+        if mac and self.macs.get(sender) != mac:
+            self.macs[sender] = self.new_macs[sender] = mac
+
+        self.requests += count
+
+    def update(self,records):
+        '''Count each `(sender,sender_mac,target)` record of
+        `records`. Records are counted by pair in batches, so that
+        each pair of a batch is added to the sketch once.
+        '''
+
+        records = iter(records)
+
+        while True:
+
+            counts, macs = Counter(), {}
+            for sender, shw, target in islice(records,BATCH_RECORDS):
+                counts[(sender,target)] += 1
+                macs[sender] = shw
+
+            if not counts: break
+            self.update_counts(counts,macs)
+
+    def update_counts(self,counts,macs):
+        '''Add `counts`, mapping `(sender,target)` tuples to numbers
+        of requests, and `macs`, mapping senders to MAC addresses.
+        '''
+
+        add = self.add
+        for (sender,target), count in counts.items():
+            add(sender,target,count,macs.get(sender))
+
+    def update_arrays(self,senders,targets,counts,buckets,macs):
+        '''Add the counts of pairs from arrays of equal length, as
+        yielded by `Eavesarp.vectorized.scan_chunks` without buckets:
+        the integer values of `senders` and `targets` and the number
+        of requests `counts`. `macs` maps the integer values of
+        senders to the integer values of their MAC addresses.
+        '''
+
+        # Each address is decoded once, as pairs share few addresses
+        senders, targets = senders.tolist(), targets.tolist()
+        ips = {value:int_to_ip(value)
+            for value in set(senders).union(targets)}
+
+        add = self.add
+        for sender, target, count in zip(senders,targets,counts.tolist()):
+            mac = macs.get(sender)
+            add(ips[sender],ips[target],count,
+                mac.to_bytes(6,'big').hex(':') if mac is not None else None)
+
+    def refresh(self,db_session):
+        '''Load the values of stale targets from the database. Pairs
+        requesting them are tracked from their next request.
+        '''
+
+        self.stale = {value for value, in db_session.query(IP.value) \
+            .filter(IP.arp_resolve_attempted==True) \
+            .filter(IP.mac_address==None)}
+
+    def collect(self,db_session):
+        '''Write the new addresses and MAC addresses and commit, then
+        return the pairs to be written as `counts`, mapping
+        `(sender,target)` tuples to the growth of their estimates
+        since last written, and `macs`, mapping their senders to MAC
+        addresses, as accepted by `handle_counts`.
+        '''
+
+        db_session.flush()
+        write_ips(self.new_addresses,
+            {self.addresses[sender]:mac
+                for sender,mac in self.new_macs.items()},
+            db_session)
+        db_session.commit()
+
+        self.new_addresses.clear()
+        self.new_macs.clear()
+
+        # Heavy hitters requesting stale targets continue to be
+        # written after they're displaced
+        previous = self.stale
+        self.refresh(db_session)
+        stale = self.stale
+        self.tracked.update(key for key in self.heavy.counts
+            if key[1] in stale)
+
+        # Pairs requesting targets newly found stale
+        bound = self.sketch.bound()
+        for target in stale-previous:
+
+            if target not in self.addresses: continue
+
+            for sender in self.macs:
+                key = (sender,target)
+                if sender != target and \
+                        self.sketch.estimate(self.sketch_key(key)) > bound:
+                    self.tracked.add(key)
+
+        counts = {}
+        for key in self.tracked.union(self.heavy.counts):
+
+            estimate = self.sketch.estimate(self.sketch_key(key))
+            increment = estimate-self.written.get(key,0)
+
+            if increment > 0:
+                counts[key] = increment
+                self.written[key] = estimate
+
+        return counts, {sender:self.macs.get(sender)
+            for sender,target in counts}
+
+    def flush(self,db_session):
+        '''Write the heavy hitters and pairs requesting stale targets
+        to the database and commit, returning the number of requests
+        counted since the previous flush.
+        '''
+
+        counts, macs = self.collect(db_session)
+
+        write_pair_counts(((sender,target,count,macs.get(sender))
+            for (sender,target),count in counts.items()),db_session)
+        db_session.commit()
+
+        requests, self.requests = self.requests, 0
+
+        return requests
+
+    def describe(self):
+
+        return f'top {self.heavy.k} pairs, counts within ' \
+            f'+{self.sketch.bound()} requests at ' \
+            f'{1-self.sketch.failure:.0%} confidence'
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+'''
+Sources of ARP requests for the capture command.
+
+Each source reads requests from a single interface in a background
+thread and queues them for the capture loop, which remains the only
+writer to the database regardless of the number of interfaces.
+'''
+
+from Eavesarp.validators import validate_packet
+from Eavesarp.misc import unpack_arp
+from threading import Thread, Event
+from queue import Queue, Empty, Full
+from struct import unpack
+
+# Options of Linux packet sockets, which the socket module lacks
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+class CaptureSource:
+    '''Base class for sources that queue a `(record,frame)` tuple for
+    each ARP request captured on `interface`, where `record` is a
+    `(sender,sender_mac,target)` tuple and `frame` is the captured
+    frame when `keep_frames` is set.
+
+    Subclasses implement `read`, which is run in a background thread
+    by `start`, and queue requests through `put`. When set, `notify`
+    is called from that thread once requests are queued following a
+    call to `get`, and when the source stops.
+
+    At most `max_queue` requests are queued, or any number when 0.
+    Requests that do not fit are counted by `dropped`.
+    '''
+
+    def __init__(self,interface,keep_frames=False,max_queue=0):
+
+        self.interface = interface
+        self.keep_frames = keep_frames
+        self.queue = Queue(max_queue)
+        self.dropped = 0
+        self.thread = None
+        self.error = None
+        self.notify = None
+        self.notified = False
+        self.exited = False
+
+    def start(self,*args):
+
+        self.thread = Thread(target=self.run,args=args,daemon=True)
+        self.thread.start()
+
+    def run(self,*args):
+
+        try:
+            self.read(*args)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            # Set before notifying since the thread remains alive
+            self.exited = True
+            if self.notify: self.notify()
+
+    def put(self,record,frame=None):
+
+        try:
+            self.queue.put_nowait((record,frame))
+        except Full:
+            self.dropped += 1
+            return
+
+        # Notify once per batch rather than for each request
+        if self.notify and not self.notified:
+            self.notified = True
+            self.notify()
+
+    def read(self,*args):
+
+        raise NotImplementedError
+
+    @property
+    def running(self):
+
+        return self.thread is not None and not self.exited
+
+    def get(self):
+        '''Return each queued `(record,frame)` tuple.
+        '''
+
+        items = []
+        self.notified = False
+
+        try:
+            while True: items.append(self.queue.get_nowait())
+        except Empty:
+            pass
+
+        return items
+
+    def kernel_drops(self):
+        '''Return the number of packets dropped by the kernel, or None
+        when the source cannot determine it.
+        '''
+
+        return None
+
+    def describe_exit(self):
+        '''Return a description of why the source stopped.
+        '''
+
+        return self.error or f'Capture stopped on {self.interface}'
+
+    def stop(self,timeout=5):
+
+        if self.thread: self.thread.join(timeout)
+
+class ScapySniffer(CaptureSource):
+    '''Sniff ARP requests from an interface with Scapy.
+
+    The listening socket is opened once and sniffed for `timeout`
+    seconds at a time, allowing the thread to be stopped without
+    missing packets between calls to `sniff`.
+    '''
+
+    def __init__(self,interface,keep_frames=False,timeout=1,
+            max_queue=0):
+
+        super().__init__(interface,keep_frames,max_queue)
+        self.timeout = timeout
+        self.stopped = Event()
+        self.sock = None
+        self.drops = 0
+
+    def handle(self,packet):
+
+        self.put(unpack_arp(validate_packet(packet)),
+            packet if self.keep_frames else None)
+
+    def read(self):
+
+        # Loaded here so that only scapy captures import it
+        from scapy.all import conf, sniff
+
+        sock = self.sock = conf.L2listen(iface=self.interface)
+
+        try:
+
+            while not self.stopped.is_set():
+
+                sniff(opened_socket=sock,
+                    store=False,
+                    lfilter=lambda pkt: validate_packet(pkt,False),
+                    prn=self.handle,
+                    timeout=self.timeout)
+
+        finally:
+
+            sock.close()
+
+    def kernel_drops(self):
+
+        # Counters of packet sockets are reset as they're read, so
+        # they're accumulated until the socket is closed
+        try:
+            packets, drops = unpack('II',self.sock.ins.getsockopt(
+                SOL_PACKET,PACKET_STATISTICS,8))
+            self.drops += drops
+        except (AttributeError,OSError):
+            pass
+
+        return self.drops
+
+    def stop(self,timeout=5):
+
+        self.stopped.set()
+        super().stop(timeout)
@@ -1,13 +1,49 @@
 #!/usr/bin/env python3
 
-from sqlalchemy import (Column, Integer, String, DateTime, ForeignKey,
-        func, text, ForeignKeyConstraint, UniqueConstraint,
-        create_engine, asc, desc, Boolean)
-from sqlalchemy.orm import (relationship, backref, sessionmaker,
-        close_all_sessions)
+from sqlalchemy import (Column, Integer, String, ForeignKey, func,
+        ForeignKeyConstraint, create_engine, asc, desc, Boolean, and_,
+        or_, select, distinct, Index, Float, bindparam, tuple_)
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.dialects.sqlite import dialect as sqlite_dialect
+from sqlalchemy.orm import (relationship, sessionmaker, aliased,
+        contains_eager, query_expression, with_expression)
 from sqlalchemy.ext.declarative import declarative_base
+from Eavesarp.misc import ip_to_int, int_to_ip
+from itertools import islice
 from pathlib import Path
 from os import remove
+import sqlite3
+
+# Version of the schema created by this module. Stored in the
+# `user_version` pragma of each database file.
+SCHEMA_VERSION = 7
+
+# Periods of history buckets in seconds: minutes, hours and days
+HISTORY_PERIODS = [60,3600,86400]
+
+# Age in seconds after which the buckets of a period are rolled up
+# into buckets of the next period
+ROLLUP_AGE = {60:2*3600,3600:2*86400}
+
+def default_int_value(context):
+    '''Derive the integer value of an IP from its dotted value
+    when inserting a new record.
+    '''
+
+    return ip_to_int(context.current_parameters['value'])
+
+@compiles(CreateTable,'sqlite')
+def create_sqlite_table(element,compiler,**kw):
+    '''Create tables flagged by `without_rowid` in their `info` as
+    WITHOUT ROWID tables, which SQLAlchemy doesn't support itself.
+    '''
+
+    statement = compiler.visit_create_table(element,**kw)
+    if element.element.info.get('without_rowid'):
+        statement = statement.rstrip()+' WITHOUT ROWID'
+
+    return statement
 
 Base = declarative_base()
 class IP(Base):
@@ -18,6 +54,11 @@ class IP(Base):
     id = Column(Integer, primary_key=True)
     value = Column(String, nullable=False, unique=True,
             doc='IP address value')
+    int_value = Column(Integer, nullable=False, unique=True, index=True,
+            default=default_int_value,
+            doc='''Integer value of the IP address. Used for lookups
+            and ordering, while `value` is retained for display.
+            ''')
     ptr = relationship('PTR', back_populates='ip')
     arp_resolve_attempted = Column(Boolean, nullable=False, default=False,
         doc='''Determines if an ARP request has been made for this host
@@ -35,6 +76,14 @@ class IP(Base):
           back_populates='target',
           primaryjoin='and_(Transaction.target_ip_id==IP.id)')
 
+    __table_args__ = (
+        # Resolver backlogs and stale target lookups
+        Index('ix_ip_arp_resolve_attempted_mac_address',
+            'arp_resolve_attempted','mac_address'),
+        Index('ix_ip_reverse_dns_attempted','reverse_dns_attempted'),
+        Index('ix_ip_mac_address','mac_address'),
+    )
+
     def __eq__(self,val):
         '''Override to allow string comparison.
         '''
@@ -69,6 +118,10 @@ class Transaction(Base):
     sender_ip_id = Column(Integer,nullable=False)
     target_ip_id = Column(Integer,nullable=False)
     count = Column(Integer,default=1)
+    first_seen = Column(Float, nullable=True,
+            doc='Time of the first request in seconds since the epoch')
+    last_seen = Column(Float, nullable=True,
+            doc='Time of the latest request in seconds since the epoch')
     sender = relationship('IP',
          back_populates='sender_transactions',
          primaryjoin='and_(Transaction.sender_ip_id==IP.id)')
@@ -80,6 +133,22 @@ class Transaction(Base):
         [IP.id,IP.id],
     )
 
+    __table_args__ = (
+        # Sender/target lookups made for each captured request
+        Index('ix_transaction_sender_target','sender_ip_id',
+            'target_ip_id',unique=True),
+        # SNAC lookups, i.e. senders of stale targets
+        Index('ix_transaction_target_sender','target_ip_id',
+            'sender_ip_id'),
+        # Top-N output ordering
+        Index('ix_transaction_count','count'),
+        # Expiration of pairs no longer seen
+        Index('ix_transaction_last_seen','last_seen'),
+    )
+
+    # Requests within a time window, loaded by queries given `since`
+    window_count = query_expression()
+
     def build_target(self,*args,**kwargs):
         return self.target.value
 
@@ -101,9 +170,11 @@ class Transaction(Base):
                 return ''
 
     def build_count(self,*args,**kwargs):
-        '''Return the count of ARP requests as a string value.
+        '''Return the count of ARP requests as a string value, which
+        is the count within the time window when one was queried.
         '''
 
+        if self.window_count is not None: return str(self.window_count)
         return str(self.count)
 
     def build_arp_count(self,*args,**kwargs):
@@ -232,9 +303,307 @@ class Transaction(Base):
 
     bfh = build_from_handle
 
+class InterfaceCount(Base):
+    '''Interface count model. Records the number of requests of
+    each transaction captured on each interface.
+    '''
+
+    __tablename__ = 'interface_count'
+    id = Column(Integer, primary_key=True)
+    transaction_id = Column(Integer, ForeignKey('transaction.id'),
+            nullable=False)
+    interface = Column(String, nullable=False,
+            doc='Name of the capture interface')
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        Index('ix_interface_count_transaction_interface',
+            'transaction_id','interface',unique=True),
+    )
+
+class TransactionHistory(Base):
+    '''Transaction history model. Records the requests of each
+    transaction within buckets of time. Requests are counted in
+    minute buckets, which are rolled up into hourly and then daily
+    buckets as they age (see `roll_up_history`), so a request is
+    counted by exactly one bucket.
+
+    Buckets are keyed by their transaction, period and start and are
+    stored without a rowid, clustering the buckets of a transaction
+    and sparing a separate index of the key, which makes the table
+    about 40% smaller.
+    '''
+
+    __tablename__ = 'transaction_history'
+    transaction_id = Column(Integer, ForeignKey('transaction.id'),
+            primary_key=True)
+    period = Column(Integer, primary_key=True,
+            doc='Length of the bucket in seconds')
+    bucket = Column(Integer, primary_key=True,
+            doc='Start of the bucket in seconds since the epoch')
+    count = Column(Integer, default=0)
+
+    __table_args__ = (
+        # Window queries and rollups
+        Index('ix_transaction_history_period_bucket','period','bucket'),
+        {'info':{'without_rowid':True}},
+    )
+
+class Ingest(Base):
+    '''Ingest manifest model. Records each input file imported by
+    the analyze command, allowing later runs to skip unchanged files
+    and import only the new records of pcap files that have grown.
+    '''
+
+    __tablename__ = 'ingest'
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False, unique=True,
+            doc='Absolute path to the input file')
+    file_type = Column(String, nullable=False,
+            doc='Type of input file: pcap or sqlite')
+    size = Column(Integer, nullable=False,
+            doc='Size of the file when ingested')
+    mtime = Column(Float, nullable=False,
+            doc='Modification time of the file when ingested')
+    sha256 = Column(String, nullable=False,
+            doc='''SHA256 hash of the ingested content, i.e. the bytes
+            preceding `offset` for uncompressed captures or the full
+            file for SQLite files and compressed captures.
+            ''')
+    offset = Column(Integer, nullable=True,
+            doc='''Byte offset following the last complete record
+            ingested from an uncompressed capture.
+            ''')
+
+class Partition(Base):
+    '''Partition model. Catalogs the databases written by a
+    partitioned capture (see `Eavesarp.partition`).
+    '''
+
+    __tablename__ = 'partition'
+    id = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False, unique=True,
+            doc='Path to the partition database, relative to the catalog')
+    start_time = Column(Float, nullable=False,
+            doc='Time the partition was created')
+    end_time = Column(Float, nullable=True,
+            doc='''Time the partition was closed, or NULL while it's
+            being written
+            ''')
+    requests = Column(Integer, default=0,
+            doc='Number of requests written to the partition')
+    size = Column(Integer, default=0,
+            doc='Size of the partition in bytes when closed')
+
+def get_schema_version(cursor):
+    '''Return the schema version stored in a database.
+    '''
+
+    return cursor.execute('PRAGMA user_version').fetchone()[0]
+
+def set_schema_version(cursor,version):
+
+    cursor.execute(f'PRAGMA user_version = {int(version)}')
+
+def create_indexes(cursor,tables,names=None):
+    '''Create each index defined on the tables, or only those named
+    in `names` when set.
+    '''
+
+    for table in tables:
+        for index in table.indexes:
+            if names is not None and index.name not in names: continue
+            cursor.execute(str(CreateIndex(index).compile(
+                dialect=sqlite_dialect())))
+
+def create_tables(cursor,tables):
+    '''Create each table and its indexes.
+    '''
+
+    for table in tables:
+        cursor.execute(str(CreateTable(table).compile(
+            dialect=sqlite_dialect())))
+
+    create_indexes(cursor,tables)
+
+# Indexes created by version 2. Those added by later versions are
+# created by their own migrations, as they may index columns that
+# don't exist yet.
+V2_INDEXES = [
+    'ix_ip_int_value',
+    'ix_ip_arp_resolve_attempted_mac_address',
+    'ix_ip_reverse_dns_attempted',
+    'ix_ip_mac_address',
+    'ix_transaction_sender_target',
+    'ix_transaction_target_sender',
+    'ix_transaction_count',
+]
+
+def migrate_v2(cursor):
+    '''Migrate a version 1 database to version 2:
+
+    - add the integer value column to IPs and populate it
+    - merge any duplicate sender/target transactions, which would
+    otherwise violate the new unique index
+    - create indexes
+    '''
+
+    cursor.execute('ALTER TABLE ip ADD COLUMN int_value INTEGER '
+            'NOT NULL DEFAULT 0')
+
+    cursor.executemany('UPDATE ip SET int_value = ? WHERE id = ?',
+        [(ip_to_int(v),i) for i,v in
+            cursor.execute('SELECT id, value FROM ip').fetchall()])
+
+    cursor.execute('''
+        UPDATE "transaction" SET count = (
+            SELECT SUM(t.count) FROM "transaction" t
+            WHERE t.sender_ip_id = "transaction".sender_ip_id
+                AND t.target_ip_id = "transaction".target_ip_id)
+        WHERE id IN (
+            SELECT MIN(id) FROM "transaction"
+            GROUP BY sender_ip_id, target_ip_id HAVING COUNT(*) > 1)
+        ''')
+
+    cursor.execute('''
+        DELETE FROM "transaction" WHERE id NOT IN (
+            SELECT MIN(id) FROM "transaction"
+            GROUP BY sender_ip_id, target_ip_id)
+        ''')
+
+    create_indexes(cursor,[IP.__table__,Transaction.__table__],
+        V2_INDEXES)
+
+def migrate_v3(cursor):
+    '''Migrate a version 2 database to version 3:
+
+    - create the ingest manifest table
+    '''
+
+    create_tables(cursor,[Ingest.__table__])
+
+def migrate_v4(cursor):
+    '''Migrate a version 3 database to version 4:
+
+    - create the interface count table
+    '''
+
+    create_tables(cursor,[InterfaceCount.__table__])
+
+def migrate_v5(cursor):
+    '''Migrate a version 4 database to version 5:
+
+    - add the first and last seen columns to transactions
+    - create the transaction history table
+    '''
+
+    for column in ['first_seen','last_seen']:
+        cursor.execute(f'ALTER TABLE "transaction" ADD COLUMN {column} '
+            'FLOAT')
+
+    create_indexes(cursor,[Transaction.__table__],
+        ['ix_transaction_last_seen'])
+
+    create_tables(cursor,[TransactionHistory.__table__])
+
+def migrate_v6(cursor):
+    '''Migrate a version 5 database to version 6:
+
+    - create the partition catalog table
+    '''
+
+    create_tables(cursor,[Partition.__table__])
+
+def migrate_v7(cursor):
+    '''Migrate a version 6 database to version 7:
+
+    - rebuild the transaction history table keyed by transaction,
+    period and bucket without a rowid
+    '''
+
+    for name in ['ix_transaction_history_transaction_bucket',
+            'ix_transaction_history_period_bucket']:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+    cursor.execute('ALTER TABLE transaction_history '
+        'RENAME TO transaction_history_v6')
+    create_tables(cursor,[TransactionHistory.__table__])
+
+    cursor.execute('INSERT INTO transaction_history (transaction_id, '
+        'period, bucket, count) SELECT transaction_id, period, bucket, '
+        'count FROM transaction_history_v6 '
+        'ORDER BY transaction_id, period, bucket')
+    cursor.execute('DROP TABLE transaction_history_v6')
+
+# Functions that migrate a database from the prior version to the
+# version of the key.
+MIGRATIONS = {
+    2:migrate_v2,
+    3:migrate_v3,
+    4:migrate_v4,
+    5:migrate_v5,
+    6:migrate_v6,
+    7:migrate_v7,
+}
+
+def migrate_db(engine):
+    '''Migrate the schema of an existing database to
+    `SCHEMA_VERSION`. Each migration is applied in a distinct
+    transaction, so an interrupted migration leaves the database
+    at the prior version.
+    '''
+
+    connection = engine.raw_connection()
+
+    # Manage transactions explicitly so DDL is included in them
+    isolation_level = connection.connection.isolation_level
+    connection.connection.isolation_level = None
+    cursor = connection.cursor()
+
+    try:
+
+        version = get_schema_version(cursor)
+
+        # Databases created prior to schema versioning have no
+        # user_version but do have tables
+        if version == 0:
+
+            if not cursor.execute("SELECT 1 FROM sqlite_master "
+                    "WHERE type='table' AND name='ip'").fetchone():
+                Base.metadata.create_all(engine)
+                set_schema_version(cursor,SCHEMA_VERSION)
+                return
+
+            version = 1
+
+        if version > SCHEMA_VERSION:
+            raise Exception(
+                f'Database schema version {version} is newer than '
+                f'the supported version: {SCHEMA_VERSION}')
+
+        while version < SCHEMA_VERSION:
+
+            version += 1
+
+            cursor.execute('BEGIN')
+            try:
+                MIGRATIONS[version](cursor)
+                set_schema_version(cursor,version)
+                cursor.execute('COMMIT')
+            except:
+                cursor.execute('ROLLBACK')
+                raise
+
+    finally:
+
+        cursor.close()
+        connection.connection.isolation_level = isolation_level
+        connection.close()
+
 def create_db(dbfile,overwrite=False):
     '''Initialize the database file and return a session
-    object.
+    object. Pre-existing database files created by older versions
+    of eavesarp are migrated to the current schema.
     '''
 
     engine = create_engine(f'sqlite:///{dbfile}')
@@ -250,26 +619,324 @@ def create_db(dbfile,overwrite=False):
     # Don't clobber pre-existing database files
     if not Path(dbfile).exists() or overwrite:
         Base.metadata.create_all(engine)
+        with engine.connect() as connection:
+            connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    else:
+        migrate_db(engine)
 
     return Session()
 
-def get_transactions(db_session,order_by=desc):
+# ==================
+# READ-ONLY SOURCES
+# ==================
+
+'''
+Databases imported by an analysis are read without being migrated,
+leaving them unmodified. Columns and tables added by later versions
+of the schema are read as NULL values, or no rows, when a source
+predates them.
+'''
+
+SOURCE_TRANSACTION_SELECT = '''
+SELECT t.id, t.count, {first_seen}, {last_seen},
+    sender.value, sender.arp_resolve_attempted,
+    sender.reverse_dns_attempted, sender.mac_address,
+    sender_ptr.value, sender_ptr.forward_ip,
+    target.value, target.arp_resolve_attempted,
+    target.reverse_dns_attempted, target.mac_address,
+    target_ptr.value, target_ptr.forward_ip
+FROM "transaction" AS t
+JOIN ip AS sender ON sender.id = t.sender_ip_id
+JOIN ip AS target ON target.id = t.target_ip_id
+LEFT JOIN ptr AS sender_ptr ON sender_ptr.ip_id = sender.id
+LEFT JOIN ptr AS target_ptr ON target_ptr.ip_id = target.id
+ORDER BY t.id
+'''
+
+def connect_readonly(dbfile):
+    '''Return a read-only sqlite3 connection to an existing database
+    file, which is neither created nor migrated.
+    '''
+
+    pth = Path(dbfile)
+    if not pth.is_file():
+        raise Exception(f'File not found: {dbfile}')
+
+    return sqlite3.connect(pth.resolve().as_uri()+'?mode=ro',uri=True)
+
+def get_table_columns(connection,table):
+    '''Return the names of the columns of a table, which are empty
+    when the table doesn't exist.
+    '''
+
+    return {row[1] for row in
+        connection.execute(f'PRAGMA table_info("{table}")')}
+
+def read_source_transactions(connection):
+    '''Return the rows of `SOURCE_TRANSACTION_SELECT` read from a
+    read-only connection.
+    '''
+
+    columns = get_table_columns(connection,'transaction')
+
+    return connection.execute(SOURCE_TRANSACTION_SELECT.format(
+        first_seen='t.first_seen' if 'first_seen' in columns else 'NULL',
+        last_seen='t.last_seen' if 'last_seen' in columns else 'NULL'))
+
+def read_source_rows(connection,table,columns):
+    '''Return a dictionary mapping transaction ids to lists of tuples
+    of `columns` read from a table, which is empty when the table
+    doesn't exist.
+    '''
+
+    rows = {}
+    if not get_table_columns(connection,table): return rows
+
+    for row in connection.execute(
+            f'SELECT transaction_id, {", ".join(columns)} FROM {table}'):
+        rows.setdefault(row[0],[]).append(row[1:])
+
+    return rows
+
+def transaction_key(transaction):
+    '''Return the keyset pagination cursor for a transaction, i.e.
+    the `(count, sender, target)` tuple it is ordered by. Addresses
+    are represented by their integer values.
+    '''
+
+    count = transaction.window_count
+    if count is None: count = transaction.count
+
+    return (count, transaction.sender.int_value,
+            transaction.target.int_value)
+
+def select_window_counts(since):
+    '''Return a select of the `(transaction_id,count)` of each
+    transaction requested since `since`, in seconds since the epoch,
+    summing the buckets of its history. Buckets beginning before
+    `since` that end after it are counted in full.
+    '''
+
+    ht = TransactionHistory.__table__
+
+    return select([ht.c.transaction_id,
+            func.sum(ht.c.count).label('count')]) \
+        .where(or_(*[and_(ht.c.period==period,ht.c.bucket > since-period)
+            for period in HISTORY_PERIODS])) \
+        .group_by(ht.c.transaction_id) \
+        .alias('window')
+
+def get_transactions(db_session,order_by=desc,limit=None,after=None,
+        stale_only=False,since=None):
+    '''Return transactions ordered by count and then numerically by
+    the sender and target addresses.
+
+    - `limit` - maximum number of transactions to return, allowing
+    for top-N queries
+    - `after` - cursor returned by `transaction_key` for the final
+    transaction of the previous page. Only transactions ordered after
+    the cursor are returned (keyset pagination).
+    - `stale_only` - return only transactions with a stale target
+    - `since` - return only transactions requested since this time,
+    in seconds since the epoch, counting the requests of its window
+    (see `select_window_counts`) as their `window_count`
+
+    Sender/target IPs and their PTR records are loaded in the same
+    query to avoid issuing a query per row while building output.
+    '''
+
+    sender = aliased(IP)
+    target = aliased(IP)
+
+    query = db_session.query(Transaction) \
+            .join(sender,Transaction.sender) \
+            .join(target,Transaction.target) \
+            .options(
+                contains_eager(Transaction.sender,alias=sender) \
+                    .selectinload(IP.ptr),
+                contains_eager(Transaction.target,alias=target) \
+                    .selectinload(IP.ptr))
+
+    if stale_only:
+        query = query.filter(target.arp_resolve_attempted==True,
+                target.mac_address==None)
+
+    count_column = Transaction.count
+
+    # Loaded transactions are refreshed with the count of the window
+    if since is not None:
+        window = select_window_counts(since)
+        query = query.join(window,window.c.transaction_id==Transaction.id) \
+            .options(with_expression(Transaction.window_count,
+                window.c.count)) \
+            .populate_existing()
+        count_column = window.c.count
+
+    # =================
+    # APPLY THE CURSOR
+    # =================
+
+    '''
+    Rows are ordered by count (per `order_by`) and then ascending by
+    sender and target, so the next page starts with any row that has
+    a "lesser" count or an identical count with a greater sender or
+    sender/target combination.
+    '''
+
+    if after:
+
+        count, sender_value, target_value = after
+
+        if order_by == asc: count_after = count_column > count
+        else: count_after = count_column < count
+
+        query = query.filter(
+            or_(
+                count_after,
+                and_(
+                    count_column == count,
+                    or_(
+                        sender.int_value > sender_value,
+                        and_(
+                            sender.int_value == sender_value,
+                            target.int_value > target_value
+                        )
+                    )
+                )
+            )
+        )
+
+    query = query.order_by(order_by(count_column),
+            asc(sender.int_value),
+            asc(target.int_value))
+
+    if limit: query = query.limit(limit)
+
+    return query.all()
+
+def iter_transactions(db_session,order_by=desc,page_size=1000,after=None,
+        stale_only=False,since=None):
+    '''Generator that pages through transactions using keyset
+    pagination, yielding each transaction. Only `page_size` rows are
+    fetched per query.
+    '''
+
+    while True:
+
+        transactions = get_transactions(db_session,order_by,
+                limit=page_size,after=after,stale_only=stale_only,
+                since=since)
+
+        for t in transactions: yield t
+
+        if transactions.__len__() < page_size: break
+
+        after = transaction_key(transactions[-1])
+
+def select_transaction_rows(order_by=desc,after=None,stale_only=False,
+        since=None):
+    '''Return a Core select statement producing one flat row per
+    transaction, including the sender/target IP attributes and PTR
+    values required to build output columns. Ordering, the `after`
+    cursor and `since` behave identically to `get_transactions`.
+
+    Results of the statement are meant to be iterated directly,
+    avoiding the construction of ORM objects for large exports.
+    '''
+
+    tt = Transaction.__table__
+    sender = IP.__table__.alias('sender')
+    target = IP.__table__.alias('target')
+    sender_ptr = PTR.__table__.alias('sender_ptr')
+    target_ptr = PTR.__table__.alias('target_ptr')
 
-    # Getting all transaction objects
-    return db_session.query(Transaction) \
-            .order_by(desc(Transaction.count)) \
-            .all()
+    source = tt.join(sender,tt.c.sender_ip_id==sender.c.id) \
+        .join(target,tt.c.target_ip_id==target.c.id)
+    count_column = tt.c.count
+
+    if since is not None:
+        window = select_window_counts(since)
+        source = source.join(window,window.c.transaction_id==tt.c.id)
+        count_column = window.c.count
+
+    query = select([
+            count_column.label('count'),
+            tt.c.sender_ip_id.label('sender_id'),
+            sender.c.value.label('sender'),
+            sender.c.int_value.label('sender_int'),
+            sender.c.mac_address.label('sender_mac'),
+            target.c.value.label('target'),
+            target.c.int_value.label('target_int'),
+            target.c.mac_address.label('target_mac'),
+            target.c.arp_resolve_attempted \
+                .label('target_arp_resolve_attempted'),
+            sender_ptr.c.value.label('sender_ptr'),
+            target_ptr.c.value.label('target_ptr'),
+            target_ptr.c.forward_ip.label('target_forward')]) \
+        .select_from(
+            source.outerjoin(sender_ptr,sender_ptr.c.ip_id==sender.c.id) \
+                .outerjoin(target_ptr,target_ptr.c.ip_id==target.c.id))
+
+    if stale_only:
+        query = query.where(and_(target.c.arp_resolve_attempted==True,
+                target.c.mac_address==None))
+
+    if after:
+
+        count, sender_value, target_value = after
+
+        if order_by == asc: count_after = count_column > count
+        else: count_after = count_column < count
+
+        query = query.where(
+            or_(
+                count_after,
+                and_(
+                    count_column == count,
+                    or_(
+                        sender.c.int_value > sender_value,
+                        and_(
+                            sender.c.int_value == sender_value,
+                            target.c.int_value > target_value
+                        )
+                    )
+                )
+            )
+        )
+
+    return query.order_by(order_by(count_column),
+            asc(sender.c.int_value),
+            asc(target.c.int_value))
+
+def get_snac_sender_ids(db_session):
+    '''Return a set of IP ids for senders that have requested at
+    least one stale target, i.e. senders with a SNAC.
+    '''
+
+    tt = Transaction.__table__
+    it = IP.__table__
+
+    query = select([distinct(tt.c.sender_ip_id)]) \
+            .select_from(tt.join(it,tt.c.target_ip_id==it.c.id)) \
+            .where(and_(it.c.arp_resolve_attempted==True,
+                it.c.mac_address==None))
+
+    return set(r[0] for r in db_session.execute(query))
 
 def get_or_create_ip(value, db_session, ptr=None, mac_address=None,
-        arp_resolve_attempted=False, reverse_dns_attempted=False):
+        arp_resolve_attempted=False, reverse_dns_attempted=False,
+        commit=True):
     '''Get or create an IP object from the SQLite database. Also
     handles:
 
     - Reverse Name Resolution
     - ARP resolution
+
+    Changes are only flushed when `commit` is False, allowing
+    callers to commit a batch of changes at once.
     '''
 
-    ip = db_session.query(IP).filter(IP.value==value).first()
+    ip = db_session.query(IP).filter(IP.int_value==ip_to_int(value)).first()
 
     if not ip:
 
@@ -282,13 +949,14 @@ def get_or_create_ip(value, db_session, ptr=None, mac_address=None,
             ip.reverse_dns_attempted = True
 
         db_session.add(ip)
-        db_session.commit()
+        if commit: db_session.commit()
+        else: db_session.flush()
 
     elif ip and mac_address and ip.mac_address != mac_address:
 
         ip.mac_address = mac_address
         ip.arp_resolve_attempted = True
-        db_session.commit()
+        if commit: db_session.commit()
 
     return ip
 
@@ -304,3 +972,513 @@ def get_or_create_ptr(value,ip_id,db_session,forward_ip=None):
         db_session.commit()
 
     return ptr
+
+def update_interface_counts(counts,interface,db_session,
+        batch_size=500):
+    '''Add requests captured on an interface to transactions.
+    `counts` maps transaction ids to the number of requests. Existing
+    records are loaded in batches of `batch_size` ids, keeping within
+    the SQLite variable limit. Changes are not committed.
+    '''
+
+    ids = list(counts)
+
+    for offset in range(0,ids.__len__(),batch_size):
+
+        batch = ids[offset:offset+batch_size]
+
+        existing = {ic.transaction_id:ic for ic in
+            db_session.query(InterfaceCount).filter(
+                InterfaceCount.interface==interface,
+                InterfaceCount.transaction_id.in_(batch))}
+
+        for transaction_id in batch:
+
+            interface_count = existing.get(transaction_id)
+
+            if not interface_count:
+                interface_count = InterfaceCount(
+                        transaction_id=transaction_id,
+                        interface=interface,
+                        count=0)
+                db_session.add(interface_count)
+
+            interface_count.count += counts[transaction_id]
+
+def write_ips(ips,macs,db_session,attempts=None):
+    '''Create IPs without loading ORM objects. `ips` maps integer
+    values to dotted values and `macs` maps the integer values of
+    senders to their MAC addresses. IPs are inserted unless they
+    exist, after which the MAC address of existing senders is updated
+    when it changed. `attempts` optionally maps integer values to
+    the `(arp_resolve_attempted,reverse_dns_attempted)` flags of new
+    IPs. Changes are not committed.
+    '''
+
+    attempts = attempts or {}
+
+    it = IP.__table__
+
+    insert_ips = it.insert().prefix_with('OR IGNORE')
+    update_macs = it.update() \
+        .where(and_(it.c.int_value==bindparam('ip'),
+            or_(it.c.mac_address==None,
+                it.c.mac_address!=bindparam('mac')))) \
+        .values(mac_address=bindparam('mac'),arp_resolve_attempted=True)
+
+    if ips:
+        db_session.execute(insert_ips,
+            [dict(value=value,int_value=int_value,
+                mac_address=macs.get(int_value),
+                arp_resolve_attempted=int_value in macs or
+                    attempts.get(int_value,(False,False))[0],
+                reverse_dns_attempted=
+                    attempts.get(int_value,(False,False))[1])
+                for int_value,value in ips.items()])
+
+    if macs:
+        db_session.execute(update_macs,
+            [dict(ip=int_value,mac=mac)
+                for int_value,mac in macs.items()])
+
+def write_pair_counts(pairs,db_session,chunk_size=10000,timestamp=None):
+    '''Add request counts to the database without loading ORM
+    objects. `pairs` is an iterable of `(sender,target,count,mac)`
+    tuples, where `mac` is the MAC address of the sender, and is
+    written as by `write_pair_values`.
+
+    Returns the number of requests written.
+    '''
+
+    return write_pair_values(((ip_to_int(sender),ip_to_int(target),
+        count,mac,()) for sender,target,count,mac in pairs),db_session,
+        chunk_size,timestamp)
+
+# Adds requests to the count of a pair identified by the ids of its
+# addresses, creating the transaction as needed
+PAIR_COUNT_UPSERT = '''
+INSERT INTO "transaction" (sender_ip_id, target_ip_id, count,
+    first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (sender_ip_id, target_ip_id)
+DO UPDATE SET count = count + excluded.count,
+    first_seen = coalesce(first_seen, excluded.first_seen),
+    last_seen = coalesce(excluded.last_seen, last_seen)
+'''
+
+# Adds requests to a history bucket of a transaction, creating the
+# bucket as needed
+HISTORY_UPSERT = '''
+INSERT INTO transaction_history (transaction_id, period, bucket, count)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (transaction_id, period, bucket)
+DO UPDATE SET count = count + excluded.count
+'''
+
+# Values looked up by each query of `get_ip_ids` and
+# `get_transaction_ids`
+IP_ID_BATCH = 500
+
+def get_ip_ids(values,cursor,ids):
+    '''Add the id of each IP of `values`, its integer values, that
+    is not in `ids` to `ids`, mapping integer values to ids.
+    '''
+
+    values = [value for value in values if value not in ids]
+
+    for offset in range(0,values.__len__(),IP_ID_BATCH):
+        batch = values[offset:offset+IP_ID_BATCH]
+        ids.update(cursor.execute('SELECT int_value, id FROM ip '
+            f'WHERE int_value IN ({", ".join("?"*batch.__len__())})',
+            batch))
+
+def get_transaction_ids(senders,cursor):
+    '''Return a dictionary mapping the `(sender_ip_id,target_ip_id)`
+    tuple of each transaction of `senders`, a list of IP ids, to the
+    id of the transaction.
+    '''
+
+    ids = {}
+
+    for offset in range(0,senders.__len__(),IP_ID_BATCH):
+        batch = senders[offset:offset+IP_ID_BATCH]
+        for sender, target, transaction_id in cursor.execute(
+                'SELECT sender_ip_id, target_ip_id, id FROM "transaction" '
+                f'WHERE sender_ip_id IN ({", ".join("?"*batch.__len__())})',
+                batch):
+            ids[(sender,target)] = transaction_id
+
+    return ids
+
+def write_pair_values(pairs,db_session,chunk_size=10000,timestamp=None):
+    '''Add request counts to the database without loading ORM
+    objects. `pairs` is an iterable of `(sender,target,count,mac,
+    history)` tuples, where `sender` and `target` are the integer
+    values of the addresses, `mac` is the MAC address of the sender
+    and `history` is a sequence of `(period,bucket,count)` tuples
+    added to the history buckets of the pair, and is written
+    `chunk_size` pairs at a time. IPs, transactions and buckets are
+    created as needed, as `get_or_create_ip` would create IPs, and
+    transactions and buckets are written through the DBAPI cursor.
+
+    When the requests were received at `timestamp`, in seconds since
+    the epoch, it's recorded as the time each pair was last seen and,
+    for new pairs, first seen.
+
+    Changes are not committed. Since the ORM is bypassed, objects
+    loaded by `db_session` are expired.
+
+    Returns the number of requests written.
+    '''
+
+    # Pending changes are written before the ORM is bypassed
+    db_session.flush()
+    cursor = db_session.connection().connection.cursor()
+
+    # Dotted values and ids of the IPs written, by integer value
+    names, ids = {}, {}
+
+    requests = 0
+    pairs = iter(pairs)
+
+    try:
+
+        while True:
+
+            chunk = list(islice(pairs,chunk_size))
+            if not chunk: break
+
+            # Dotted and MAC address values by integer value. Targets
+            # that are also senders take the MAC address of the sender.
+            ips, macs = {}, {}
+
+            for sender, target, count, mac, history in chunk:
+
+                for value in (sender,target):
+                    if value not in ips:
+                        name = names.get(value)
+                        if name is None:
+                            name = names[value] = int_to_ip(value)
+                        ips[value] = name
+
+                if mac: macs[sender] = mac
+                requests += count
+
+            write_ips({value:name for value,name in ips.items()
+                if value not in ids},macs,db_session)
+            get_ip_ids(ips,cursor,ids)
+
+            cursor.executemany(PAIR_COUNT_UPSERT,
+                [(ids[sender],ids[target],count,timestamp,timestamp)
+                    for sender,target,count,mac,history in chunk])
+
+            history = [(ids[sender],ids[target],history)
+                for sender,target,count,mac,history in chunk if history]
+            if not history: continue
+
+            transaction_ids = get_transaction_ids(
+                list({sender for sender,target,buckets in history}),cursor)
+
+            cursor.executemany(HISTORY_UPSERT,
+                [(transaction_ids[(sender,target)],period,bucket,count)
+                    for sender,target,buckets in history
+                    for period,bucket,count in buckets])
+
+    finally:
+
+        cursor.close()
+
+    db_session.expire_all()
+
+    return requests
+
+# Adds the requests of a source transaction to the transaction of
+# the same pair, keeping the earliest and latest times seen
+SOURCE_TRANSACTION_UPSERT = '''
+INSERT INTO "transaction" (sender_ip_id, target_ip_id, count,
+    first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (sender_ip_id, target_ip_id)
+DO UPDATE SET count = count + excluded.count,
+    first_seen = coalesce(min(first_seen, excluded.first_seen),
+        first_seen, excluded.first_seen),
+    last_seen = coalesce(max(last_seen, excluded.last_seen),
+        last_seen, excluded.last_seen)
+'''
+
+# Adds requests captured on an interface to a transaction
+INTERFACE_COUNT_UPSERT = '''
+INSERT INTO interface_count (transaction_id, interface, count)
+VALUES (?, ?, ?)
+ON CONFLICT (transaction_id, interface)
+DO UPDATE SET count = count + excluded.count
+'''
+
+# PTR records are kept when the IP or name already has one
+PTR_INSERT = '''
+INSERT OR IGNORE INTO ptr (ip_id, forward_ip, value) VALUES (?, ?, ?)
+'''
+
+def write_source_transactions(rows,history,interface_counts,
+        db_session):
+    '''Add transactions read from a source database without loading
+    ORM objects. `rows` are rows of `SOURCE_TRANSACTION_SELECT`, while
+    `history` and `interface_counts` map the ids of source
+    transactions to their `(period,bucket,count)` and
+    `(interface,count)` tuples, as read by `read_source_rows`.
+
+    IPs are created as `get_or_create_ip` would create them and take
+    the latest MAC address of the rows. Counts, history buckets and
+    interface counts are added to those of existing transactions,
+    keeping the earliest and latest times seen.
+
+    Changes are not committed. Since the ORM is bypassed, objects
+    loaded by `db_session` are expired.
+    '''
+
+    # Pending changes are written before the ORM is bypassed
+    db_session.flush()
+    cursor = db_session.connection().connection.cursor()
+
+    ips, macs, attempts, ptrs, pairs = {}, {}, {}, [], []
+
+    try:
+
+        for row in rows:
+
+            pair = []
+            for offset in [4,10]:
+
+                value, arp_resolve_attempted, reverse_dns_attempted, \
+                    mac_address, ptr, forward_ip = row[offset:offset+6]
+
+                int_value = ip_to_int(value)
+                if int_value not in ips:
+                    ips[int_value] = value
+                    attempts[int_value] = (bool(arp_resolve_attempted),
+                        bool(reverse_dns_attempted))
+
+                if mac_address: macs[int_value] = mac_address
+                if ptr: ptrs.append((int_value,forward_ip,ptr))
+                pair.append(int_value)
+
+            pairs.append(pair)
+
+        write_ips(ips,macs,db_session,attempts)
+
+        ids = {}
+        get_ip_ids(ips,cursor,ids)
+
+        cursor.executemany(PTR_INSERT,[(ids[int_value],forward_ip,ptr)
+            for int_value,forward_ip,ptr in ptrs])
+
+        pairs = [(ids[sender],ids[target]) for sender,target in pairs]
+        cursor.executemany(SOURCE_TRANSACTION_UPSERT,
+            [pair+tuple(row[1:4]) for pair,row in zip(pairs,rows)])
+
+        transaction_ids = get_transaction_ids(
+            list({sender for sender,target in pairs}),cursor)
+        transaction_ids = [(row[0],transaction_ids[pair])
+            for pair,row in zip(pairs,rows)]
+
+        cursor.executemany(HISTORY_UPSERT,
+            [(transaction_id,period,bucket,count)
+                for tid,transaction_id in transaction_ids
+                for period,bucket,count in history.get(tid,[])])
+
+        cursor.executemany(INTERFACE_COUNT_UPSERT,
+            [(transaction_id,interface,count)
+                for tid,transaction_id in transaction_ids
+                for interface,count in interface_counts.get(tid,[])])
+
+    finally:
+
+        cursor.close()
+
+    db_session.expire_all()
+
+def add_history(rows,db_session):
+    '''Add requests to history buckets without loading ORM objects.
+    `rows` is a list of `(transaction_id,period,bucket,increment)`
+    tuples, where `increment` is added to the count of the bucket.
+    Buckets are created as needed. Changes are not committed.
+    '''
+
+    ht = TransactionHistory.__table__
+
+    if not rows: return
+
+    # Buckets are created with a count of 0 unless they exist, after
+    # which every count is incremented
+    db_session.execute(ht.insert().prefix_with('OR IGNORE'),
+        [dict(transaction_id=transaction_id,period=period,bucket=bucket,
+            count=0) for transaction_id,period,bucket,increment in rows])
+
+    db_session.execute(ht.update()
+        .where(and_(ht.c.transaction_id==bindparam('transaction'),
+            ht.c.period==bindparam('bucket_period'),
+            ht.c.bucket==bindparam('bucket_start')))
+        .values(count=ht.c.count+bindparam('increment')),
+        [dict(transaction=transaction_id,bucket_period=period,
+            bucket_start=bucket,increment=increment)
+            for transaction_id,period,bucket,increment in rows])
+
+def record_history(counts,timestamp,db_session):
+    '''Add requests received at `timestamp`, in seconds since the
+    epoch, to the minute buckets of each transaction. `counts` maps
+    transaction ids to the number of requests. Changes are not
+    committed.
+    '''
+
+    period = HISTORY_PERIODS[0]
+    bucket = int(timestamp//period*period)
+
+    add_history([(transaction_id,period,bucket,count)
+        for transaction_id,count in counts.items()],db_session)
+
+def roll_up_history(db_session,now,retention=None):
+    '''Roll up the buckets of each period older than its
+    `ROLLUP_AGE` into buckets of the next period, e.g. minute buckets
+    into hourly buckets. Only whole buckets of the next period are
+    rolled up, so a bucket is never rolled up more than once. Days
+    begin at midnight UTC.
+
+    When `retention` is set, buckets and transactions last seen more
+    than `retention` seconds before `now` are deleted. Transactions
+    without a time last seen, e.g. those imported from pcap files,
+    are kept. Changes are committed.
+
+    Returns the number of transactions deleted.
+    '''
+
+    ht = TransactionHistory.__table__
+    db_session.flush()
+
+    for period, next_period in zip(HISTORY_PERIODS,HISTORY_PERIODS[1:]):
+
+        cutoff = int((now-ROLLUP_AGE[period])//next_period*next_period)
+        aged = and_(ht.c.period==period,ht.c.bucket < cutoff)
+        bucket = (ht.c.bucket-ht.c.bucket % next_period).label('bucket')
+
+        add_history([(transaction_id,next_period,bucket,count)
+            for transaction_id,bucket,count in db_session.execute(
+                select([ht.c.transaction_id,bucket,func.sum(ht.c.count)])
+                    .where(aged)
+                    .group_by(ht.c.transaction_id,bucket))],
+            db_session)
+
+        db_session.execute(ht.delete().where(aged))
+
+    deleted = 0
+    if retention:
+        deleted = expire_transactions(db_session,now-retention)
+
+    db_session.commit()
+
+    return deleted
+
+def expire_transactions(db_session,before):
+    '''Delete history buckets ending before `before`, in seconds
+    since the epoch, and transactions last seen before it along with
+    their interface counts and history. Changes are not committed.
+
+    Returns the number of transactions deleted.
+    '''
+
+    tt = Transaction.__table__
+    ht = TransactionHistory.__table__
+    ict = InterfaceCount.__table__
+
+    db_session.execute(ht.delete().where(or_(*[
+        and_(ht.c.period==period,ht.c.bucket <= before-period)
+        for period in HISTORY_PERIODS])))
+
+    expired = select([tt.c.id]).where(tt.c.last_seen < before)
+
+    db_session.execute(ht.delete().where(ht.c.transaction_id.in_(expired)))
+    db_session.execute(ict.delete() \
+        .where(ict.c.transaction_id.in_(expired)))
+    deleted = db_session.execute(tt.delete() \
+        .where(tt.c.last_seen < before)).rowcount
+
+    db_session.expire_all()
+
+    return deleted
+
+def get_pair_transactions(pairs,db_session,batch_size=400):
+    '''Return a dictionary mapping the `(sender,target)` values of
+    `pairs` to `(transaction,sender,target)` tuples, where `sender`
+    and `target` are IP objects. Transactions are loaded in batches
+    of `batch_size` pairs, keeping within the SQLite variable limit.
+    '''
+
+    sender, target = aliased(IP), aliased(IP)
+    pairs = list(pairs)
+    transactions = {}
+
+    for offset in range(0,pairs.__len__(),batch_size):
+
+        batch = pairs[offset:offset+batch_size]
+
+        query = db_session.query(Transaction,sender,target) \
+            .join(sender,Transaction.sender_ip_id==sender.id) \
+            .join(target,Transaction.target_ip_id==target.id) \
+            .filter(tuple_(sender.int_value,target.int_value).in_(
+                [(ip_to_int(s),ip_to_int(t)) for s,t in batch]))
+
+        for transaction, s, t in query:
+            transactions[(s.value,t.value)] = (transaction,s,t)
+
+    return transactions
+
+def get_ip_interfaces(db_session):
+    '''Return a dictionary mapping IP ids to the interface on which
+    most requests involving the address were captured. Requests for
+    an address take precedence over requests sent by it.
+    '''
+
+    tt = Transaction.__table__
+    ct = InterfaceCount.__table__
+
+    interfaces = {}
+
+    for column in [tt.c.sender_ip_id,tt.c.target_ip_id]:
+
+        query = select([column,ct.c.interface,func.sum(ct.c.count)]) \
+                .select_from(ct.join(tt,ct.c.transaction_id==tt.c.id)) \
+                .group_by(column,ct.c.interface) \
+                .order_by(func.sum(ct.c.count))
+
+        # Ascending order leaves the busiest interface of each IP
+        interfaces.update(
+            {ip_id:interface for ip_id,interface,count in
+                db_session.execute(query)}
+        )
+
+    return interfaces
+
+def get_ingest(path,db_session):
+    '''Return the manifest record for an input file path.
+    '''
+
+    return db_session.query(Ingest).filter(Ingest.path==path).first()
+
+def update_ingest(path,file_type,size,mtime,sha256,db_session,
+        offset=None):
+    '''Create or update the manifest record for an input file.
+    '''
+
+    ingest = get_ingest(path,db_session)
+
+    if not ingest:
+        ingest = Ingest(path=path,file_type=file_type)
+        db_session.add(ingest)
+
+    ingest.size = size
+    ingest.mtime = mtime
+    ingest.sha256 = sha256
+    ingest.offset = offset
+
+    db_session.commit()
+
+    return ingest
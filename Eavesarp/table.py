@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+'''
+Table formatting for eavesarp output.
+
+Tables are laid out identically to tabulate's default "simple"
+format. Column types, which determine alignment, and column widths
+are tracked as each row is added. Style prefixes and suffixes are
+precomputed per color profile instead of styling each cell with
+`colored.stylize`, and each row is built with a single join without
+scanning the styled strings again.
+'''
+
+import re
+
+try:
+    import wcwidth
+except ImportError:
+    wcwidth = None
+
+# Control sequences emitted by colored, which are not visible
+ANSI_CODES = re.compile(r'\x1b\[[\x30-\x3f]*[\x20-\x2f]*[\x40-\x7e]')
+
+# Minimum padding between the header of a column and the column
+# to its right
+MIN_PADDING = 2
+
+COLUMN_SEPARATOR = '  '
+
+# Column types, from least to most generic
+NONE, BOOL, INT, FLOAT, STR = range(5)
+
+def visible_width(text):
+    '''Return the number of terminal cells occupied by text, which
+    counts wide characters, such as emojis, twice when the optional
+    wcwidth package is installed.
+    '''
+
+    text = ANSI_CODES.sub('',text)
+
+    if wcwidth is not None: return wcwidth.wcswidth(text)
+    return text.__len__()
+
+def is_convertible(conversion,value):
+
+    try:
+        conversion(value)
+        return True
+    except (ValueError,TypeError):
+        return False
+
+def value_type(value):
+    '''Return the type of a value, deducing the type of strings from
+    their content. Empty values do not affect the type of a column.
+    '''
+
+    if isinstance(value,str):
+
+        value = ANSI_CODES.sub('',value)
+
+        if not value: return NONE
+        if value in ('True','False'): return BOOL
+        if is_convertible(int,value): return INT
+
+        if is_convertible(float,value):
+
+            number = float(value)
+
+            # Overflows such as 1e999 are not numbers
+            if number not in (float('inf'),float('-inf')) and \
+                    number == number:
+                return FLOAT
+            if value.lower() in ('inf','-inf','nan'): return FLOAT
+
+        return STR
+
+    if value is None: return NONE
+    if isinstance(value,bool): return BOOL
+    if isinstance(value,int): return INT
+    if isinstance(value,float): return FLOAT
+
+    return STR
+
+class TableFormatter:
+    '''Format rows as a table. Rows are supplied to `add_row`,
+    optionally with the name of a style from the color profile:
+    "even" or "odd". `format` returns the table.
+    '''
+
+    def __init__(self,headers,color_profile=None):
+
+        self.headers = [str(header) for header in headers]
+        self.styles = color_profile.styles if color_profile else {}
+
+        # Styled cell values and their visible widths
+        self.rows = []
+        self.row_widths = []
+
+        self.types = [BOOL]*self.headers.__len__()
+        self.widths = [0]*self.headers.__len__()
+
+        # Values of string columns are stripped of surrounding
+        # whitespace, but numeric values are not
+        self.unstripped = False
+
+    def add_row(self,values,style=None):
+
+        prefix, suffix = self.styles.get(style,('',''))
+        types, widths = self.types, self.widths
+
+        cells, cell_widths = [], []
+
+        for ind, value in enumerate(values):
+
+            # Styled values are strings, including None values, which
+            # are otherwise left empty
+            if style:
+                cell = f'{prefix}{value}{suffix}'
+                vtype = value_type(cell)
+            else:
+                cell = '' if value is None else f'{value}'
+                vtype = value_type(value)
+
+            if vtype > types[ind]: types[ind] = vtype
+
+            width = visible_width(cell)
+            if width > widths[ind]: widths[ind] = width
+
+            if not self.unstripped and cell.strip() != cell:
+                self.unstripped = True
+
+            cells.append(cell)
+            cell_widths.append(width)
+
+        self.rows.append(cells)
+        self.row_widths.append(cell_widths)
+
+    # =================
+    # SLOWER ALIGNMENTS
+    # =================
+
+    '''
+    eavesarp values seldom require either of the following, so they
+    are applied to the affected columns only when formatting.
+    '''
+
+    def format_floats(self,ind):
+        '''Format the values of a float column with the "g" format
+        and align them at the decimal point.
+        '''
+
+        for cells in self.rows:
+
+            raw = ANSI_CODES.sub('',cells[ind])
+
+            # Includes boolean values, which are left as they are
+            try:
+                cells[ind] = cells[ind].replace(raw,format(float(raw),'g'))
+            except ValueError:
+                pass
+
+        decimals = [after_point(ANSI_CODES.sub('',cells[ind]))
+            for cells in self.rows]
+        maximum = max(decimals)
+
+        self.widths[ind] = 0
+        for cells, cell_widths, point in zip(self.rows,self.row_widths,
+                decimals):
+
+            cells[ind] += ' '*(maximum-point)
+            cell_widths[ind] = visible_width(cells[ind])
+            self.widths[ind] = max(self.widths[ind],cell_widths[ind])
+
+    def strip_values(self,ind):
+
+        self.widths[ind] = 0
+        for cells, cell_widths in zip(self.rows,self.row_widths):
+
+            cells[ind] = cells[ind].strip()
+            cell_widths[ind] = visible_width(cells[ind])
+            self.widths[ind] = max(self.widths[ind],cell_widths[ind])
+
+    # ==========
+    # FORMATTING
+    # ==========
+
+    def format(self):
+
+        prefix, suffix = self.styles.get('header',('',''))
+        headers = [f'{prefix}{header}{suffix}' for header in self.headers]
+        header_widths = [visible_width(header) for header in headers]
+
+        numeric = [vtype in (INT,FLOAT) for vtype in self.types]
+
+        for ind, vtype in enumerate(self.types):
+            if vtype == FLOAT: self.format_floats(ind)
+            elif self.unstripped and not numeric[ind]: self.strip_values(ind)
+
+        widths = [max(width,header_width+MIN_PADDING)
+            for width,header_width in zip(self.widths,header_widths)]
+
+        lines = [
+            pad_row(headers,header_widths,widths,numeric),
+            COLUMN_SEPARATOR.join(['-'*width for width in widths]).rstrip()
+        ]
+
+        for cells, cell_widths in zip(self.rows,self.row_widths):
+            lines.append(pad_row(cells,cell_widths,widths,numeric))
+
+        return '\n'.join(lines)
+
+def pad_row(cells,cell_widths,widths,numeric):
+    '''Join the cells of a row, right aligning numeric columns and
+    left aligning the others.
+    '''
+
+    return COLUMN_SEPARATOR.join([
+        ' '*(width-cell_width)+cell if right else
+            cell+' '*(width-cell_width)
+        for cell,cell_width,width,right in
+            zip(cells,cell_widths,widths,numeric)
+    ]).rstrip()
+
+def after_point(value):
+    '''Return the number of characters following the decimal point
+    or exponent of a number, or -1 when it has neither.
+    '''
+
+    if value_type(value) != FLOAT: return -1
+
+    pos = value.rfind('.')
+    if pos < 0: pos = value.lower().rfind('e')
+
+    return value.__len__()-pos-1 if pos >= 0 else -1
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 
 from re import match,compile
-from scapy.all import ARP
+from pathlib import Path
+import sqlite3
 
 # Regexp to validate ipv4 structure
 ipv4_re = compile('^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$')
 
+# Regexp to validate durations, e.g. 90s, 15m, 1h or 7d
+duration_re = compile('^([0-9]+(?:\.[0-9]+)?)([smhdw]?)$')
+
+# Seconds of each duration unit
+DURATION_UNITS = {'':1,'s':1,'m':60,'h':3600,'d':86400,'w':604800}
+
 def validate_ipv4(val):
     '''Verify if a given value matches the pattern of an
     IPv4 address.
@@ -15,11 +22,46 @@ def validate_ipv4(val):
     if m: return m
     else: return False
 
+def validate_duration(val):
+    '''Return the number of seconds of a duration, e.g. "15m",
+    where the unit is one of s, m, h, d and w and defaults to
+    seconds. False is returned for invalid or zero durations.
+    '''
+
+    m = match(duration_re,val)
+    if not m: return False
+
+    seconds = float(m.group(1))*DURATION_UNITS[m.group(2)]
+    return seconds or False
+
+def validate_sqlite_file(path):
+    '''Verify if a file is a SQLite database created by eavesarp,
+    i.e. it holds transactions or catalogs partitions.
+    '''
+
+    pth = Path(path)
+    if not pth.is_file(): return False
+
+    try:
+        connection = sqlite3.connect(pth.resolve().as_uri()+'?mode=ro',
+                uri=True)
+        try:
+            return connection.execute("SELECT 1 FROM sqlite_master "
+                "WHERE type='table' AND name IN ('transaction',"
+                "'partition')").fetchone() is not None
+        finally:
+            connection.close()
+    except sqlite3.DatabaseError:
+        return False
+
 def validate_packet(packet,unpack=True):
     '''Validate a packet to be of type ARP. Leave unpack to True and
     the returned object will be ARP instead of Boolean.
     '''
 
+    # Imported when first called, since loading scapy takes seconds
+    from scapy.all import ARP
+
     if ARP in packet:
         arp = packet.getlayer('ARP')
         if arp.op == 1:
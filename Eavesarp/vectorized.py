@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+'''
+Vectorized extraction of ARP requests from classic pcap files.
+
+The capture is memory mapped and the offset of each record is
+indexed from the record headers. Since the captured length of each
+record locates the next, runs of records of equal length, as ARP
+requests typically are, are speculated and confirmed by gathering
+their headers at once, while records of varying length are visited
+one at a time. Link layer and ARP fields are then gathered for a
+chunk of records at a time through NumPy fancy indexing, and
+sender/target pairs are counted with `np.unique` before anything is
+written to the database. Pairs may also be counted by the bucket of
+time their records were received in.
+
+Counts are handed to an aggregator as arrays of the integer values
+of addresses, which are written to the database without converting
+them to dotted values and back.
+
+NumPy is an optional dependency: pip install numpy
+'''
+
+from Eavesarp.pcap import (PCAP_MAGICS, GLOBAL_HEADER_LENGTH,
+        RECORD_HEADER_LENGTH, ETHERTYPE_OFFSETS, PAYLOAD_OFFSETS,
+        ETHERTYPE_ARP, ETHERTYPE_IPV4, VLAN_ETHERTYPES, ARP_LENGTH,
+        ARP_REQUEST, PcapError)
+from array import array
+from struct import Struct, unpack
+from pathlib import Path
+from importlib.util import find_spec
+from contextlib import contextmanager
+import mmap
+
+# Imported by load_numpy when the numpy parse engine is used
+np = None
+
+# Maximum number of records gathered at once, bounding the memory
+# consumed by intermediate arrays
+CHUNK_RECORDS = 1<<20
+
+# Records speculated to share the length of the first record of a
+# run. Doubled each time a run is confirmed in full.
+SPECULATE_RECORDS = 64
+
+# Runs shorter than MIN_RUN records are followed by SCALAR_RECORDS
+# records visited one at a time
+MIN_RUN = 8
+SCALAR_RECORDS = 64
+
+def numpy_available():
+    '''Return True when the optional numpy package is installed.
+    '''
+
+    return find_spec('numpy') is not None
+
+def load_numpy():
+    '''Import numpy, returning False when it is not installed.
+    '''
+
+    global np
+
+    if np is None:
+
+        try:
+            import numpy as np
+        except ImportError:
+            return False
+
+    return True
+
+def index_records(buf,byte_order,start,end,chunk_records=CHUNK_RECORDS):
+    '''Generator yielding `(offsets,caplens)` arrays for chunks of
+    complete records between `start` and `end`. The offset following
+    the final complete record is returned when exhausted.
+    '''
+
+    arr = np.frombuffer(buf,dtype=np.uint8)
+    unpack_caplen = Struct(byte_order+'I').unpack_from
+
+    offset, speculate, exhausted = start, SPECULATE_RECORDS, False
+
+    while not exhausted:
+
+        offsets, caplens, indexed = [], [], 0
+
+        while indexed < chunk_records:
+
+            if offset+RECORD_HEADER_LENGTH > end:
+                exhausted = True
+                break
+
+            caplen = unpack_caplen(buf,offset+8)[0]
+            stride = RECORD_HEADER_LENGTH+caplen
+            count = min(speculate,chunk_records-indexed,(end-offset)//stride)
+
+            # The record is incomplete
+            if not count:
+                exhausted = True
+                break
+
+            # Records following at the same stride are confirmed by
+            # their captured lengths, up to the first that differs
+            run = offset+stride*np.arange(count,dtype=np.int64)
+            differ = np.flatnonzero(
+                gather_uint32(arr,run+8,byte_order) != caplen)
+            accepted = int(differ[0]) if differ.size else count
+
+            offsets.append(run[:accepted])
+            caplens.append(np.full(accepted,caplen,dtype=np.int64))
+            offset += accepted*stride
+            indexed += accepted
+
+            if accepted == count:
+                speculate = min(speculate*2,chunk_records)
+                continue
+
+            speculate = SPECULATE_RECORDS
+            if accepted >= MIN_RUN: continue
+
+            # Visit records of varying length one at a time
+            run_offsets, run_caplens = array('q'), array('q')
+
+            for i in range(min(SCALAR_RECORDS,chunk_records-indexed)):
+
+                if offset+RECORD_HEADER_LENGTH > end: break
+
+                caplen = unpack_caplen(buf,offset+8)[0]
+                following = offset+RECORD_HEADER_LENGTH+caplen
+                if following > end: break
+
+                run_offsets.append(offset)
+                run_caplens.append(caplen)
+                offset = following
+
+            offsets.append(np.frombuffer(run_offsets,dtype=np.int64))
+            caplens.append(np.frombuffer(run_caplens,dtype=np.int64))
+            indexed += run_offsets.__len__()
+
+        if indexed:
+            yield np.concatenate(offsets), np.concatenate(caplens)
+
+    return offset
+
+def gather_uint16(arr,positions,valid):
+    '''Return the big endian unsigned short at each position. Invalid
+    positions are read from the start of the buffer instead.
+    '''
+
+    positions = np.where(valid,positions,0)
+
+    return (arr[positions].astype(np.uint16) << 8) | arr[positions+1]
+
+def gather_uint32(arr,positions,byte_order):
+    '''Return the unsigned int of `byte_order` at each position.
+    '''
+
+    return np.ascontiguousarray(arr[positions[:,None]+np.arange(4)]) \
+        .view(byte_order+'u4')[:,0]
+
+def extract_requests(arr,offsets,caplens,linktype):
+    '''Return `(senders,sender_macs,targets,records)` integer arrays
+    for the ARP WHO-HAS requests within a chunk of records, where
+    `records` is the index of the record of each request.
+    '''
+
+    ethertype_offset = ETHERTYPE_OFFSETS[linktype]
+
+    data = offsets+RECORD_HEADER_LENGTH
+    end = data+caplens
+    valid = caplens >= ethertype_offset+2
+
+    ethertype = gather_uint16(arr,data+ethertype_offset,valid)
+    payload = data+ethertype_offset+PAYLOAD_OFFSETS.get(linktype,2)
+
+    # Skip VLAN tags
+    vlan = valid & np.isin(ethertype,VLAN_ETHERTYPES)
+    while True:
+
+        vlan &= payload+4 <= end
+        if not vlan.any(): break
+
+        ethertype = np.where(vlan,gather_uint16(arr,payload+2,vlan),
+                ethertype)
+        payload = np.where(vlan,payload+4,payload)
+        vlan &= np.isin(ethertype,VLAN_ETHERTYPES)
+
+    records = np.flatnonzero(valid & (ethertype == ETHERTYPE_ARP) &
+            (payload+ARP_LENGTH <= end))
+    payload = payload[records]
+
+    # Gather the ARP header of each frame into a row
+    arp = arr[payload[:,None]+np.arange(ARP_LENGTH)]
+
+    requests = (arp[:,2] == ETHERTYPE_IPV4 >> 8) & \
+        (arp[:,3] == ETHERTYPE_IPV4 & 0xff) & \
+        (arp[:,4] == 6) & (arp[:,5] == 4) & \
+        (arp[:,6] == 0) & (arp[:,7] == ARP_REQUEST)
+    arp, records = arp[requests], records[requests]
+
+    macs = np.zeros((arp.shape[0],8),dtype=np.uint8)
+    macs[:,2:] = arp[:,8:14]
+
+    return (np.ascontiguousarray(arp[:,14:18]).view('>u4')[:,0],
+            macs.view('>u8')[:,0],
+            np.ascontiguousarray(arp[:,24:28]).view('>u4')[:,0],
+            records)
+
+def count_buckets(keys,seconds,period):
+    '''Count packed sender/target `keys` by the bucket of `period`
+    seconds they were received in, given the `seconds` each was
+    received, returning `(keys,buckets,counts)` arrays.
+    '''
+
+    pairs, inverse = np.unique(keys,return_inverse=True)
+
+    # Combine the index of each pair with the bucket offset from the
+    # earliest bucket, which fits within 64 bits
+    buckets = seconds.astype(np.uint64)//np.uint64(period)
+    first = buckets.min()
+    span = int(buckets.max()-first)+1
+
+    combined, counts = np.unique(
+        inverse.ravel().astype(np.uint64)*np.uint64(span)+(buckets-first),
+        return_counts=True)
+
+    return (pairs[combined//np.uint64(span)],
+        (combined % np.uint64(span)+first)*np.uint64(period),
+        counts)
+
+def scan_chunks(buf,offset=None,bucket_period=None):
+    '''Generator yielding `(senders,targets,counts,buckets,macs)` for
+    each chunk of records in a memory mapped pcap, with NumPy arrays
+    of the integer values of the sender and target of each pair and
+    their counts, and a dictionary mapping the integer value of each
+    sender to that of the MAC address of its final request in the
+    chunk. When `bucket_period` is set, pairs are counted by buckets
+    of that many seconds and `buckets` is an array of the start of
+    the bucket of each pair, otherwise it's None. The offset following
+    the final complete record is returned when exhausted.
+    '''
+
+    header = buf[:GLOBAL_HEADER_LENGTH]
+    if header.__len__() < GLOBAL_HEADER_LENGTH or \
+            header[:4] not in PCAP_MAGICS:
+        raise PcapError('Not a pcap file')
+
+    byte_order = PCAP_MAGICS[header[:4]][0]
+    linktype = unpack(byte_order+'I',header[20:])[0] & 0x0fffffff
+
+    start = max(offset or 0,GLOBAL_HEADER_LENGTH)
+    arr = np.frombuffer(buf,dtype=np.uint8)
+
+    chunks = index_records(buf,byte_order,start,buf.__len__())
+
+    while True:
+
+        try:
+            offsets, caplens = next(chunks)
+        except StopIteration as e:
+            return e.value
+
+        if linktype not in ETHERTYPE_OFFSETS: continue
+
+        senders, sender_macs, targets, records = extract_requests(arr,
+                offsets,caplens,linktype)
+
+        # Aggregate the chunk before combining it with the others
+        keys, buckets = (senders.astype(np.uint64) << 32) | targets, None
+
+        if bucket_period and keys.size:
+            keys, buckets, counts = count_buckets(keys,
+                gather_uint32(arr,offsets[records],byte_order),
+                bucket_period)
+        else:
+            keys, counts = np.unique(keys,return_counts=True)
+            if bucket_period: buckets = np.empty(0,np.uint64)
+
+        # Retain the MAC address of the final request of each sender
+        senders, indices = np.unique(senders[::-1],return_index=True)
+
+        yield (keys >> np.uint64(32),keys & np.uint64(0xffffffff),counts,
+            buckets,dict(zip(senders.tolist(),
+                sender_macs[::-1][indices].tolist())))
+
+def aggregate_arp_requests(path,aggregator,offset=None,
+        bucket_period=None):
+    '''Add the ARP WHO-HAS requests in a classic pcap file, starting
+    at `offset` when supplied, to `aggregator` one chunk at a time
+    through its `update_arrays` method. When `bucket_period` is set,
+    requests are counted by pair and the bucket of that many seconds
+    they were received in, as accepted by `PairAggregator`, otherwise
+    by pair, as accepted by `ApproximateCounter`. Returns the offset
+    following the final complete record in the file.
+    '''
+
+    with map_capture(path) as buf:
+
+        chunks = scan_chunks(buf,offset,bucket_period)
+
+        while True:
+
+            try:
+                chunk = next(chunks)
+            except StopIteration as e:
+                return e.value
+
+            aggregator.update_arrays(*chunk)
+
+@contextmanager
+def map_capture(path):
+    '''Memory map a classic pcap file, loading numpy.
+    '''
+
+    if not load_numpy():
+        raise PcapError('The numpy package is required by the numpy '
+            'parse engine: pip install numpy')
+
+    with open(path,'rb') as infile:
+
+        if Path(path).stat().st_size < GLOBAL_HEADER_LENGTH:
+            raise PcapError('Not a pcap file')
+
+        with mmap.mmap(infile.fileno(),0,access=mmap.ACCESS_READ) as buf:
+            yield buf
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+'''
+Curses viewport for the capture output table.
+
+Rows are read from the database once per frame with the flat row
+select used by exports, then held in memory so that scrolling,
+sorting and searching never re-query the database. Only the rows
+visible on screen are formatted, and curses compares each frame
+with the previous one so that only changed cells are written to
+the terminal.
+
+Keys:
+
+- Up/Down, PgUp/PgDn, Home/End: scroll
+- s: sort by the next column, r: reverse the sort
+- /: search, Enter: apply, Esc: clear
+'''
+
+from Eavesarp.output import COL_MAP, COL_ORDER, get_columns, iter_export_rows
+from Eavesarp.misc import ip_to_int
+from sys import stdin
+from time import time
+import curses
+
+IP_COLUMNS = ['sender','target','target_forward']
+
+HELP = 'Arrows/PgUp/PgDn scroll  s sort  r reverse  / search'
+
+def sort_key(col):
+    '''Return a function producing the sort key of a row for the
+    column, ordering IP addresses and counts numerically.
+    '''
+
+    if col == 'arp_count':
+        return lambda row: int(row[col])
+
+    if col in IP_COLUMNS:
+        return lambda row: ip_to_int(row[col]) if row[col] else -1
+
+    return lambda row: str(row[col] or '')
+
+class Viewport:
+    '''Draw accepted transactions in a scrollable curses window.
+
+    `update` is called with the number of requests analyzed and
+    status lines to read the rows and draw a frame. Keys are handled
+    by `handle_input` when standard input is readable, drawing from
+    the rows held in memory. When `window` is set, only the requests
+    of the final `window` seconds are drawn.
+    '''
+
+    def __init__(self,db_session,columns=COL_ORDER,sender_lists=None,
+            target_lists=None,arp_resolve=False,dns_resolve=False,
+            display_false=False,stale_only=False,limit=None,window=None):
+
+        self.db_session = db_session
+        self.columns = get_columns(columns,arp_resolve,dns_resolve)
+        self.sender_lists = sender_lists
+        self.target_lists = target_lists
+        self.display_false = display_false
+        self.stale_only = stale_only
+        self.limit = limit
+        self.window = window
+
+        self.rows = []
+        self.visible = []
+        self.widths = [COL_MAP[col].__len__() for col in self.columns]
+
+        self.count = 0
+        self.status = ''
+        self.messages = []
+
+        # Rows are read ordered by count until a column is selected
+        self.sort_column = None
+        self.reverse = False
+
+        self.top = 0
+        self.search = ''
+        self.typing = None
+
+        self.screen = None
+        self.loop = None
+
+    # ==============
+    # CURSES SESSION
+    # ==============
+
+    def start(self,loop=None):
+        '''Initialize curses and, when `loop` is supplied, handle keys
+        as they are read by the event loop.
+        '''
+
+        self.screen = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        self.screen.keypad(True)
+        self.screen.nodelay(True)
+
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+
+        if loop: loop.add_reader(stdin.fileno(),self.handle_input)
+        self.loop = loop
+
+    def stop(self):
+        '''Restore the terminal and print messages logged while the
+        viewport was drawn.
+        '''
+
+        if not self.screen: return
+
+        if self.loop: self.loop.remove_reader(stdin.fileno())
+
+        self.screen.keypad(False)
+        curses.nocbreak()
+        curses.echo()
+        curses.endwin()
+        self.screen = None
+
+        for message in self.messages: print(message)
+
+    def log(self,message):
+
+        self.messages.append(message.strip('\n'))
+        self.draw()
+
+    # ===========
+    # ROW HANDLING
+    # ===========
+
+    def update(self,count=0,status=''):
+        '''Read the rows from the database and draw a frame.
+        '''
+
+        self.count = count
+        self.status = status
+
+        self.rows = list(iter_export_rows(self.db_session,
+            sender_lists=self.sender_lists,
+            target_lists=self.target_lists,
+            limit=self.limit,
+            stale_only=self.stale_only,
+            since=time()-self.window if self.window else None))
+
+        self.arrange()
+
+    def arrange(self):
+        '''Sort and search the rows held in memory.
+        '''
+
+        rows = self.rows
+
+        if self.sort_column:
+            rows = sorted(rows,key=sort_key(self.sort_column),
+                reverse=self.reverse)
+        elif self.reverse:
+            rows = rows[::-1]
+
+        if self.search:
+            search = self.search.lower()
+            rows = [row for row in rows
+                if any(search in self.format(row[col]).lower()
+                    for col in self.columns)]
+
+        self.visible = rows
+        self.draw()
+
+    def format(self,value):
+
+        if value is None: return ''
+        if value is False: return 'False' if self.display_false else ''
+
+        return str(value)
+
+    # =======
+    # DRAWING
+    # =======
+
+    def status_lines(self):
+
+        return self.status.split('\n')
+
+    def page_size(self):
+
+        # The count and status above the headers and one line below
+        # the rows
+        height = self.screen.getmaxyx()[0]
+        return max(height-self.status_lines().__len__()-4,1)
+
+    def draw(self):
+
+        if not self.screen: return
+
+        height, width = self.screen.getmaxyx()
+        page_size = self.page_size()
+
+        self.top = max(min(self.top,self.visible.__len__()-page_size),0)
+        rows = [[self.format(row[col]) for col in self.columns]
+            for row in self.visible[self.top:self.top+page_size]]
+
+        # Columns only widen, keeping them steady while scrolling
+        for row in rows:
+            self.widths = [max(w,v.__len__())
+                for w,v in zip(self.widths,row)]
+
+        def line(values):
+            return '  '.join([v.ljust(w)
+                for v,w in zip(values,self.widths)])
+
+        # Written over the previous frame, leaving curses to send
+        # only the changed cells to the terminal
+        self.screen.erase()
+
+        self.put(0,f'Requests analyzed: {self.count}',width)
+        for ind,status in enumerate(self.status_lines()):
+            self.put(1+ind,status,width)
+
+        # First line of the headers
+        y = 1+self.status_lines().__len__()
+
+        headers = [COL_MAP[col] for col in self.columns]
+        self.put(y,line(headers),width,curses.A_BOLD)
+        self.put(y+1,line(['-'*w for w in self.widths]),width)
+
+        if not self.visible:
+            self.put(y+2,'- No accepted ARP requests captured',width)
+
+        for ind,row in enumerate(rows):
+            self.put(y+2+ind,line(row),width,
+                curses.A_DIM if (self.top+ind) % 2 else curses.A_NORMAL)
+
+        self.put(height-1,self.footer(),width,curses.A_REVERSE)
+
+        self.screen.refresh()
+
+    def footer(self):
+
+        if self.typing is not None: return f'/{self.typing}'
+
+        first = min(self.top+1,self.visible.__len__())
+        last = min(self.top+self.page_size(),self.visible.__len__())
+
+        footer = f'Rows {first}-{last} of {self.visible.__len__()}'
+
+        if self.sort_column:
+            order = ('asc','desc')[self.reverse]
+            footer += f' | Sort: {COL_MAP[self.sort_column]} {order}'
+        elif self.reverse:
+            footer += f' | Sort: {COL_MAP["arp_count"]} asc'
+
+        if self.search: footer += f' | Search: {self.search}'
+        if self.messages: footer += f' | {self.messages[-1]}'
+
+        return f'{footer} | {HELP}'
+
+    def put(self,y,text,width,attr=curses.A_NORMAL):
+
+        # Writing the final cell of the window raises an error
+        try:
+            self.screen.addnstr(y,0,text,width-1,attr)
+        except curses.error:
+            pass
+
+    # ==========
+    # KEY INPUT
+    # ==========
+
+    def handle_input(self):
+
+        while self.screen:
+
+            key = self.screen.getch()
+            if key == -1: break
+
+            if self.typing is not None: self.handle_search_key(key)
+            else: self.handle_key(key)
+
+        self.draw()
+
+    def handle_key(self,key):
+
+        page_size = self.page_size()
+
+        if key == curses.KEY_UP: self.top -= 1
+        elif key == curses.KEY_DOWN: self.top += 1
+        elif key == curses.KEY_PPAGE: self.top -= page_size
+        elif key == curses.KEY_NPAGE: self.top += page_size
+        elif key == curses.KEY_HOME: self.top = 0
+        elif key == curses.KEY_END: self.top = self.visible.__len__()
+
+        elif key == ord('s'):
+
+            # Cycle through the columns, returning to the count order
+            if self.sort_column in self.columns:
+                ind = self.columns.index(self.sort_column)+1
+            else:
+                ind = 0
+
+            self.sort_column = self.columns[ind] \
+                if ind < self.columns.__len__() else None
+            self.arrange()
+
+        elif key == ord('r'):
+
+            self.reverse = not self.reverse
+            self.arrange()
+
+        elif key == ord('/'):
+
+            self.typing = ''
+
+    def handle_search_key(self,key):
+
+        if key in (curses.KEY_ENTER,10,13):
+
+            self.search, self.typing = self.typing, None
+            self.top = 0
+            self.arrange()
+
+        elif key == 27:
+
+            self.search, self.typing = '', None
+            self.arrange()
+
+        elif key in (curses.KEY_BACKSPACE,127,8):
+
+            self.typing = self.typing[:-1]
+
+        elif 32 <= key < 127:
+
+            self.typing += chr(key)
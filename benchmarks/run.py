@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+'''
+End to end benchmarks of eavesarp.
+
+Synthetic traffic (see Eavesarp.simulate) is generated for each
+scale, i.e. number of requests, and the main paths are timed:
+
+- filter: filtering records through sender and target Lists
+- ingest: writing records to a new database with handle_records
+- analyze_pcap: analyzing a pcap file with the python parse engine
+- analyze_pcap_numpy: the same with the numpy parse engine, when
+  numpy is installed
+- ingest_pcap: importing a pcap file to a new database with the
+  python parse engine, without drawing the output table
+- ingest_pcap_numpy: the same with the numpy parse engine
+- analyze_sqlite: analyzing the database written by ingest
+- output_table: formatting the output table of that database, with
+  ARP resolution attempted for every IP so that stale targets and
+  SNACs are drawn
+- output_csv: exporting the same database to CSV
+
+Results are written as JSON with --output. Supplying a previous
+results file with --baseline compares the timings against it, and
+the exit status is 1 when any benchmark regressed.
+
+Usage: python -m benchmarks.run --scales 10000 100000 \\
+           --output results.json --baseline benchmarks/baseline.json
+'''
+
+from Eavesarp.eavesarp import (analyze, filter_record, handle_records,
+        ingest_file)
+from Eavesarp.sql import create_db, IP
+from Eavesarp.output import COL_ORDER, get_output_table, get_output_csv
+from Eavesarp.lists import Lists
+from Eavesarp.vectorized import numpy_available
+from Eavesarp.simulate import SyntheticTraffic
+from benchmarks.synthetic import add_arguments
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from datetime import datetime
+from pathlib import Path
+from tabulate import tabulate
+from sys import exit
+import subprocess
+import argparse
+import platform
+import json
+import os
+
+# Version of the results format
+RESULTS_VERSION = 1
+
+SCALES = [10000,100000,1000000]
+
+BENCHMARKS = ['filter','ingest','analyze_pcap','analyze_pcap_numpy',
+    'ingest_pcap','ingest_pcap_numpy','analyze_sqlite','output_table',
+    'output_csv']
+
+# Benchmarks that require numpy
+NUMPY_BENCHMARKS = ['analyze_pcap_numpy','ingest_pcap_numpy']
+
+# Increase in seconds over the baseline that is considered noise,
+# regardless of the tolerance
+NOISE_FLOOR = 0.05
+
+class Scale:
+    '''Files and traffic shared by the benchmarks of a scale.
+    '''
+
+    def __init__(self,traffic,directory):
+
+        self.traffic = traffic
+        self.directory = Path(directory)
+
+        self.pcap_file = self.directory/'requests.pcap'
+        self.db_file = self.directory/'ingest.db'
+
+        traffic.write(self.pcap_file)
+        self.records = list(traffic.records())
+
+    def path(self,name):
+
+        return str(self.directory/name)
+
+# ==========
+# BENCHMARKS
+# ==========
+
+'''
+Each benchmark returns the number of items it handled. Benchmarks
+are run in the order of BENCHMARKS, and later benchmarks read the
+database written by ingest.
+'''
+
+def bench_filter(scale):
+
+    # Every tenth host is blacklisted as a sender and as a target
+    addresses = scale.traffic.addresses
+    sender_lists = Lists(black=addresses[::10])
+    target_lists = Lists(black=addresses[5::10])
+
+    for record in scale.records:
+        filter_record(record,sender_lists,target_lists)
+
+    return scale.records.__len__()
+
+def bench_ingest(scale):
+
+    db_session = create_db(str(scale.db_file),overwrite=True)
+    handle_records(scale.records,db_session)
+    db_session.close()
+
+    return scale.records.__len__()
+
+def run_analyze(scale,**kwargs):
+
+    with open(os.devnull,'w') as devnull, redirect_stdout(devnull):
+        analyze(scale.path('analyze.db'),
+            output_columns=COL_ORDER,
+            dns_resolve=False,
+            **kwargs)
+
+def bench_analyze_pcap(scale):
+
+    run_analyze(scale,pcap_files=[str(scale.pcap_file)])
+    return scale.traffic.packets
+
+def bench_analyze_pcap_numpy(scale):
+
+    run_analyze(scale,pcap_files=[str(scale.pcap_file)],
+        parse_engine='numpy')
+    return scale.traffic.packets
+
+def run_ingest_pcap(scale,parse_engine):
+
+    db_session = create_db(scale.path('pcap.db'),overwrite=True)
+    ingest_file(str(scale.pcap_file),'pcap',db_session,
+        parse_engine=parse_engine)
+    db_session.close()
+
+def bench_ingest_pcap(scale):
+
+    run_ingest_pcap(scale,'python')
+    return scale.traffic.packets
+
+def bench_ingest_pcap_numpy(scale):
+
+    run_ingest_pcap(scale,'numpy')
+    return scale.traffic.packets
+
+def bench_analyze_sqlite(scale):
+
+    run_analyze(scale,sqlite_files=[str(scale.db_file)])
+    return scale.traffic.pairs
+
+def mark_resolved(scale):
+    '''Mark ARP resolution as attempted for each IP in the ingested
+    database. Stale hosts have no MAC address and become stale.
+    '''
+
+    db_session = create_db(str(scale.db_file))
+    db_session.query(IP).update({IP.arp_resolve_attempted:True})
+    db_session.commit()
+
+    return db_session
+
+def bench_output_table(scale):
+
+    db_session = mark_resolved(scale)
+    get_output_table(db_session,arp_resolve=True,dns_resolve=False)
+    db_session.close()
+
+    return scale.traffic.pairs
+
+def bench_output_csv(scale):
+
+    db_session = create_db(str(scale.db_file))
+    get_output_csv(db_session)
+    db_session.close()
+
+    return scale.traffic.pairs
+
+# ========
+# RESULTS
+# ========
+
+def run_benchmarks(scales,names=BENCHMARKS,traffic_args=None,repeat=1,
+        log=print):
+    '''Run the benchmarks in `names` for each scale and return the
+    results as a list of dictionaries. The fastest of `repeat` runs
+    is recorded.
+    '''
+
+    traffic_args = traffic_args or {}
+    results = []
+
+    for packets in scales:
+
+        traffic = SyntheticTraffic(packets,**traffic_args)
+        log(f'- Generating {traffic}')
+
+        with TemporaryDirectory(prefix='eavesarp-bench-') as directory:
+
+            scale = Scale(traffic,directory)
+
+            # Ordered as BENCHMARKS, which later benchmarks rely on
+            for name in [n for n in BENCHMARKS if n in names]:
+
+                if name in NUMPY_BENCHMARKS and not numpy_available():
+                    log(f'- Skipping {name}: numpy is not installed')
+                    continue
+
+                seconds = None
+                for run in range(repeat):
+                    start = perf_counter()
+                    items = globals()[f'bench_{name}'](scale)
+                    elapsed = perf_counter()-start
+                    if seconds is None or elapsed < seconds:
+                        seconds = elapsed
+
+                log(f'- {name} ({packets}): {seconds:.3f}s')
+                results.append(dict(name=name,
+                    scale=packets,
+                    items=items,
+                    seconds=seconds,
+                    per_second=items/seconds if seconds else None))
+
+    return results
+
+def get_commit():
+    '''Return the abbreviated git commit of the working tree, or None
+    when it can't be determined.
+    '''
+
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],
+            cwd=Path(__file__).parent,capture_output=True,text=True,
+            check=True).stdout.strip() or None
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def build_results(results,traffic_args):
+
+    return dict(version=RESULTS_VERSION,
+        created=time(),
+        commit=get_commit(),
+        host=platform.node(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        traffic=traffic_args,
+        results=results)
+
+def describe_results(results):
+    '''Return a line describing where and when `results` were
+    recorded.
+    '''
+
+    created = results.get('created')
+    if created is not None:
+        created = datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M')
+
+    return ', '.join(f'{key}: {value}' for key, value in [
+        ('commit',results.get('commit') or 'unknown'),
+        ('host',results.get('host') or 'unknown'),
+        ('python',results.get('python')),
+        ('platform',results.get('platform')),
+        ('created',created)])
+
+def compare_results(results,baseline,tolerance=0.25):
+    '''Return table rows comparing `results` with the results of
+    `baseline` and the number of benchmarks that are more than
+    `tolerance` slower than their baseline.
+    '''
+
+    baselines = {(r['name'],r['scale']):r for r in baseline['results']}
+
+    rows, regressions = [], 0
+    for result in results:
+
+        previous = baselines.get((result['name'],result['scale']))
+        row = [result['name'],result['scale'],result['items'],
+            result['seconds'],round(result['per_second'] or 0)]
+
+        if previous:
+
+            change = result['seconds']/previous['seconds']-1
+            regressed = change > tolerance and \
+                result['seconds']-previous['seconds'] > NOISE_FLOOR
+            regressions += regressed
+
+            row += [previous['seconds'],f'{change:+.0%}',
+                'REGRESSION' if regressed else '']
+
+        else:
+
+            row += ['','','']
+
+        rows.append(row)
+
+    return rows, regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        'Benchmark eavesarp with synthetic ARP traffic')
+    parser.add_argument('--scales','-sc',
+        nargs='+',
+        type=int,
+        default=SCALES,
+        help='Numbers of requests to benchmark. Default: %(default)s')
+    parser.add_argument('--benchmarks','-b',
+        nargs='+',
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help='''Benchmarks to run. ingest writes the database read by
+        analyze_sqlite, output_table and output_csv. Default: all''')
+    parser.add_argument('--repeat','-r',
+        type=int,
+        default=1,
+        help='Runs of each benchmark, of which the fastest is '
+        'recorded. Default: %(default)s')
+    parser.add_argument('--output','-o',
+        help='File to write the results to as JSON')
+    parser.add_argument('--baseline','-bl',
+        help='Results file to compare the results against')
+    parser.add_argument('--tolerance','-t',
+        type=float,
+        default=0.25,
+        help='''Slowdown relative to the baseline that is reported as
+        a regression. Default: %(default)s''')
+    add_arguments(parser)
+
+    args = parser.parse_args()
+
+    names = set(args.benchmarks)
+    if names & {'analyze_sqlite','output_table','output_csv'}:
+        names.add('ingest')
+
+    baseline = None
+    if args.baseline:
+
+        try:
+            with open(args.baseline) as infile:
+                baseline = json.load(infile)
+        except (OSError,ValueError) as e:
+            print(f'- Failed to read baseline: {e}')
+            exit()
+
+        if baseline.get('version') != RESULTS_VERSION:
+            print('- Unsupported baseline version: '
+                f'{baseline.get("version")}')
+            exit()
+
+    traffic_args = dict(pairs=args.pairs,
+        hosts=args.hosts,
+        stale_ratio=args.stale_ratio,
+        distribution=args.distribution,
+        zipf_exponent=args.zipf_exponent,
+        seed=args.seed)
+
+    if baseline:
+        print(f'- Comparing against {args.baseline} '
+            f'({describe_results(baseline)})')
+
+    if baseline and baseline.get('traffic') != traffic_args:
+        print('- Warning: the baseline was recorded with different '
+            'traffic arguments')
+
+    results = run_benchmarks(args.scales,names,traffic_args,args.repeat)
+
+    if args.output:
+        with open(args.output,'w') as outfile:
+            json.dump(build_results(results,traffic_args),outfile,
+                indent=2)
+        print(f'- Results written to {args.output}')
+
+    rows, regressions = compare_results(results,
+        baseline or dict(results=[]),
+        args.tolerance)
+
+    print('\n'+tabulate(rows,['Benchmark','Scale','Items','Seconds',
+        'Items/s','Baseline','Change',''],floatfmt='.3f')+'\n')
+
+    if regressions:
+        print(f'- {regressions} benchmark(s) regressed by more than '
+            f'{args.tolerance:.0%}')
+        exit(1)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+'''
+Write synthetic ARP traffic, generated by
+Eavesarp.simulate.SyntheticTraffic, to pcap files.
+
+Usage: python -m benchmarks.synthetic 100000 arp.pcap
+'''
+
+from Eavesarp.simulate import SyntheticTraffic, DISTRIBUTIONS
+import argparse
+
+def add_arguments(parser):
+    '''Add the arguments accepted by SyntheticTraffic to `parser`.
+    '''
+
+    parser.add_argument('--pairs','-p',
+        type=int,
+        help='Number of sender/target pairs. Default: packets/10')
+    parser.add_argument('--hosts','-H',
+        type=int,
+        help='Number of hosts. Default: 2*sqrt(pairs)')
+    parser.add_argument('--stale-ratio','-sr',
+        type=float,
+        default=0.1,
+        help='Ratio of hosts that never send requests. Default: '
+        '%(default)s')
+    parser.add_argument('--distribution','-d',
+        choices=DISTRIBUTIONS,
+        default='zipf',
+        help='Distribution of requests across pairs. Default: '
+        '%(default)s')
+    parser.add_argument('--zipf-exponent','-ze',
+        type=float,
+        default=1.0,
+        help='Exponent of the zipf distribution. Default: %(default)s')
+    parser.add_argument('--seed','-s',
+        type=int,
+        default=0,
+        help='Random seed. Default: %(default)s')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        'Write synthetic ARP requests to a pcap file')
+    parser.add_argument('packets',
+        type=int,
+        help='Number of ARP requests')
+    parser.add_argument('pcap_file',
+        help='Output pcap file')
+    add_arguments(parser)
+
+    args = parser.parse_args()
+
+    traffic = SyntheticTraffic(args.packets,
+        pairs=args.pairs,
+        hosts=args.hosts,
+        stale_ratio=args.stale_ratio,
+        distribution=args.distribution,
+        zipf_exponent=args.zipf_exponent,
+        seed=args.seed)
+
+    traffic.write(args.pcap_file)
+    print(f'- Wrote {traffic} to {args.pcap_file}')
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 
 import argparse
-import signal
-from Eavesarp.eavesarp import *
+
+# Modules used by a single subcommand are imported when it runs, and
+# scapy only for live capture and ARP resolution, keeping --help and
+# the list subcommand fast on slow sensors
 from Eavesarp.color import ColorProfiles
-from Eavesarp.decorators import *
-from Eavesarp.validators import *
-from Eavesarp.resolve import *
-from Eavesarp.lists import *
-from Eavesarp.logo import *
-from Eavesarp.output import *
+from Eavesarp.columns import validate_columns
+from Eavesarp.lists import initialize_lists
 from Eavesarp import arguments
-from Eavesarp.misc import get_interfaces
-from sys import exit,stdout
+from Eavesarp.misc import get_interfaces, get_interface_table
+from Eavesarp.vectorized import numpy_available
+from Eavesarp.validators import validate_duration, validate_sqlite_file
+from sys import exit,stdout,stderr
+from contextlib import redirect_stdout
+from shutil import which
+from pathlib import Path
 
 
 # ====================================
@@ -49,6 +52,7 @@ if __name__ == '__main__':
     arguments.dns_resolve.add(general_group)
     arguments.color_profile.add(general_group)
     arguments.output_columns.add(general_group)
+    arguments.profile.add(general_group)
 
     # INPUT FILES
     input_group = analyze_parser.add_argument_group(
@@ -57,12 +61,54 @@ if __name__ == '__main__':
     input_group.add_argument('--pcap-files','-pfs',
         nargs='+',
         default=[],
-        help='pcap file to analyze')
+        help='''pcap or pcapng files to analyze. gzip, xz, bz2 and
+        zstd compressed captures are decompressed while they are
+        read. zstd requires the zstandard package.''')
     input_group.add_argument('--sqlite-files','-sfs',
         nargs='+',
         default=[],
         help='''SQLite files previously created by eavesarp. Useful
-        when aggregating multiple databases.
+        when aggregating multiple databases. Catalogs of partitioned
+        captures are replaced by their partitions.
+        ''')
+    input_group.add_argument('--follow','-fo',
+        action='store_true',
+        help='''Continue reading pcap files as they grow, e.g. while
+        being written by tcpdump or dumpcap, redrawing the output
+        table as new ARP requests are imported. Use CTRL^C to stop.
+        ''')
+    input_group.add_argument('--follow-interval','-fi',
+        default=1.0,
+        type=float,
+        help='''Seconds to wait between checks for new records when
+        following pcap files. Default: %(default)s
+        ''')
+    input_group.add_argument('--parse-engine','-pe',
+        default='python',
+        choices=['python','numpy'],
+        help='''Parser used to extract ARP requests from pcap files.
+        The numpy engine memory maps uncompressed pcap files and
+        parses every record at once, which is considerably faster
+        for large captures. Other capture formats are parsed by the
+        python engine. Requires the numpy package. Default:
+        %(default)s
+        ''')
+    input_group.add_argument('--memory-limit','-ml',
+        default=256,
+        type=int,
+        help='''Approximate MiB of memory used to count requests by
+        sender/target pair. Counts beyond it are spilled to sorted
+        temporary files, in the directory named by TMPDIR, and
+        merged when written to the database. Default: %(default)s
+        ''')
+    arguments.approximate.add(input_group)
+    arguments.top_k.add(input_group)
+    arguments.sketch_error.add(input_group)
+    input_group.add_argument('--federated','-fed',
+        action='store_true',
+        help='''Query the SQLite files in place through read-only
+        aggregate views instead of copying them to the database
+        output file. Not compatible with pcap files.
         ''')
 
     # OUTPUT FILES
@@ -70,10 +116,20 @@ if __name__ == '__main__':
         'Output Parameters'
     )
     arguments.stale_only.add(aog)
+    arguments.limit.add(aog)
+    arguments.window.add(aog)
     aog.add_argument('--database-output-file','-dbo',
         default='eavesarp_dump.db',
         help='File to receive aggregated output')
+    aog.add_argument('--incremental','-inc',
+        action='store_true',
+        help='''Update the database output file instead of
+        overwriting it. Input files already ingested are skipped
+        and only new records are imported from pcap files that have
+        grown since the previous analysis.
+        ''')
     arguments.csv_output_file.add(aog)
+    arguments.ndjson_output_file.add(aog)
     arguments.force_sender.add(aog)
 
     # WHITELISTS
@@ -109,23 +165,125 @@ if __name__ == '__main__':
     general_group = capture_parser.add_argument_group(
         'General Configuration Parameters',
         '''Determine the appropriate sniffer interface and
-        how frequently to redraw the output table, which occurs
-        after the capture of n number of packets.
+        how frequently to redraw the output table.
         '''
     )
 
     # Capture interfaces
-    general_group.add_argument('--interface','-i',
-        default='eth0',
-        help='''Interface to sniff from.
+    general_group.add_argument('--interfaces','--interface','-i',
+        default=['eth0'],
+        nargs='+',
+        help='''Space delimited list of interfaces to sniff from. Each
+        interface is captured concurrently and requests are counted
+        per interface. Default: %(default)s
+        ''')
+
+    general_group.add_argument('--capture-helper','-ch',
+        choices=['tcpdump','dumpcap'],
+        help='''Capture with tcpdump or dumpcap instead of Scapy. The
+        helper applies a BPF filter for ARP requests and captures
+        with a large kernel buffer, reducing drops on busy links,
+        while its pcap output is parsed by eavesarp.
+        ''')
+
+    general_group.add_argument('--capture-stream','-cs',
+        help='''Read the pcap output of a tcpdump or dumpcap
+        process started elsewhere from a named pipe, or from
+        standard input when "-", e.g. tcpdump -U -w - arp |
+        eavesarp.py capture -cs -
+        ''')
+
+    general_group.add_argument('--buffer-size','-bs',
+        default=64,
+        type=int,
+        help='''Kernel capture buffer size in MiB used by the
+        capture helper. Default: %(default)s
+        ''')
+
+    general_group.add_argument('--queue-size','-qs',
+        default=0,
+        type=int,
+        help='''Maximum number of requests each interface queues
+        while awaiting a write to the database. Requests received
+        while the queue is full are dropped and counted in the
+        status line, bounding memory when writes fall behind. 0
+        queues any number. Default: %(default)s
         ''')
 
     # Stdout Configuration
     general_group.add_argument('--redraw-frequency','-rf',
         default=5,
+        type=float,
+        help='''Maximum number of times per second to redraw the
+        screen. Packets sniffed between redraws are written and
+        drawn together. Default: %(default)s
+        ''')
+    general_group.add_argument('--render-budget','-rb',
+        default=100,
+        type=float,
+        help='''Milliseconds a redraw may take before redraws are
+        slowed, which is displayed in the status line. The rate
+        recovers as redraws become faster. Default: %(default)s
+        ''')
+    arguments.approximate.add(general_group)
+    arguments.top_k.add(general_group)
+    arguments.sketch_error.add(general_group)
+    arguments.profile.add(general_group)
+
+    simulation_group = capture_parser.add_argument_group(
+        'Simulation Parameters',
+        '''Capture simulated requests without root or a network
+        interface, e.g. to load test the capture. Interfaces are
+        used only as labels, and ARP and DNS resolution is answered
+        by simulated hosts.'''
+    )
+
+    simulation_group.add_argument('--simulate','-sim',
+        help='''Number of synthetic requests to generate on each
+        interface, or a capture file to replay. Synthetic traffic is
+        spread across a Zipf distribution of sender/target pairs, of
+        which a tenth of the hosts are stale and have PTR records
+        making them MITM candidates.
+        ''')
+
+    simulation_group.add_argument('--simulate-rate','-sir',
+        default=1000,
+        type=float,
+        help='''Requests simulated per second on each interface, or 0
+        for as fast as possible. Default: %(default)s
+        ''')
+
+    simulation_group.add_argument('--simulate-seed','-sis',
+        default=0,
         type=int,
-        help='''Redraw the screen after each N packets
-        are sniffed from the interface.
+        help='''Seed of the synthetic traffic. The same seed always
+        generates the same requests. Default: %(default)s
+        ''')
+
+    metrics_group = capture_parser.add_argument_group(
+        'Metrics Parameters',
+        '''Export pipeline metrics, such as requests per second,
+        drops, queue depth and write, resolution and redraw
+        latencies, in the Prometheus text format. A summary is drawn
+        in the status line regardless.'''
+    )
+
+    metrics_group.add_argument('--metrics-file','-mf',
+        help='''File to write metrics to periodically, e.g. in the
+        directory of the node_exporter textfile collector.
+        ''')
+
+    metrics_group.add_argument('--metrics-port','-mp',
+        type=int,
+        help='''Port on which to serve metrics over HTTP. Only the
+        loopback interface is listened on.
+        ''')
+
+    metrics_group.add_argument('--metrics-interval','-mi',
+        default=10,
+        type=float,
+        help='''Seconds between writes of the metrics file.
+        Default: %(default)s
         ''')
 
     resolution_group = capture_parser.add_argument_group(
@@ -148,13 +306,83 @@ if __name__ == '__main__':
     )
 
     arguments.stale_only.add(output_group)
+    arguments.limit.add(output_group)
+    arguments.window.add(output_group)
+    output_group.add_argument('--retention','-ret',
+        metavar='DURATION',
+        help='''Expire pairs not requested within this duration, e.g.
+        30d, along with their history. Minute history is rolled up to
+        hours after two hours, and hours to days after two days.
+        Pairs are kept indefinitely by default.
+        ''')
     arguments.database_output_file.add(output_group)
 
+    partition_group = capture_parser.add_argument_group(
+        'Partition Parameters',
+        '''Write the capture to time-partitioned databases, which the
+        database output file catalogs. Analyzing the catalog, and
+        the table drawn during capture, query the partitions
+        transparently, pruning those written before --window.'''
+    )
+
+    partition_group.add_argument('--partition-period','-pp',
+        metavar='DURATION',
+        help='''Create a new partition every DURATION, aligned to the
+        epoch, e.g. 1d for daily partitions beginning at midnight UTC.
+        ''')
+
+    partition_group.add_argument('--partition-size','-ps',
+        type=int,
+        metavar='MIB',
+        help='''Create a new partition once the current one exceeds
+        MIB MiB.
+        ''')
+
     # PCAP output file
     output_group.add_argument('--pcap-output-file','-pof',
         help='''Name of file to dump captured packets
         ''')
 
+    output_group.add_argument('--viewport','-vp',
+        action='store_true',
+        help='''Draw the output table in a full screen viewport
+        that can be scrolled with the arrow and page keys, sorted
+        by each column with s and r, and searched with /.
+        ''')
+
+    output_group.add_argument('--live-counters','-lc',
+        action='store_true',
+        help='''Draw the output table from pair counters in shared
+        memory, updated as requests are captured, in a separate
+        process, so that drawing never waits on the database. Only
+        the snac, sender, target, arp_count and stale columns are
+        drawn.
+        ''')
+
+    output_group.add_argument('--live-capacity','-lca',
+        type=int,
+        default=1<<18,
+        help='''Number of pairs held by the live counters, each
+        using 24 bytes. Default: %(default)s
+        ''')
+
+    output_group.add_argument('--headless','-hl',
+        action='store_true',
+        help='''Run without drawing the output table, only
+        writing requests to the database. Status messages are
+        written to stderr.
+        ''')
+
+    output_group.add_argument('--event-output','-eo',
+        help='''Emit changes as newline delimited JSON events:
+        new_pair, count_update, stale_target and mitm_candidate.
+        Supply "-" to write events to stdout, which requires
+        --headless, or a path at which to create a Unix socket
+        that clients connect to. stale_target and mitm_candidate
+        require ARP resolution, and mitm_candidate also requires
+        DNS resolution.
+        ''')
+
     arguments.output_columns.add(output_group)
     
     output_group.add_argument('--display-false','-ds',
@@ -240,6 +468,23 @@ if __name__ == '__main__':
 
     args.color_profile = ColorProfiles[args.color_profile]
 
+    for name in ['window','retention','partition_period']:
+
+        value = getattr(args,name,None)
+        if value is None: continue
+
+        seconds = validate_duration(value)
+        if not seconds:
+            print(f'- Invalid duration, e.g. 15m, 1h or 7d: {value}')
+            exit()
+
+        setattr(args,name,seconds)
+
+    if args.top_k < 1 or not 0 < args.sketch_error < 1:
+        print('- Top-k must be at least 1 and sketch error between 0 '
+            'and 1.')
+        exit()
+
     # Analyze and exit
     if args.cmd == 'analyze':
 
@@ -247,25 +492,171 @@ if __name__ == '__main__':
             print('- Analyze command requires at least one input file.')
             exit()
 
-        analyze(**args.__dict__,
-                sender_lists=sender_lists,
-                target_lists=target_lists)
+        invalids = [f for f in args.sqlite_files
+                if not validate_sqlite_file(f)]
+        if invalids:
+            print('- SQLite files not found or not created by '
+                f'eavesarp: {", ".join(invalids)}')
+            exit()
+
+        if args.federated and args.pcap_files:
+            print('- Federated analysis supports only SQLite files.')
+            exit()
+
+        if args.follow and (args.federated or not args.pcap_files):
+            print('- Following requires pcap files and is not '
+                'compatible with federated analysis.')
+            exit()
+
+        if args.memory_limit < 1:
+            print('- Memory limit must be at least 1 MiB.')
+            exit()
+
+        if args.approximate and not args.pcap_files:
+            print('- Approximate counting applies only to pcap files.')
+            exit()
+
+        if args.approximate and args.window:
+            print('- Approximate counting records no history to limit '
+                'to a --window.')
+            exit()
+
+        if args.parse_engine == 'numpy' and not numpy_available():
+            print('- The numpy parse engine requires the numpy '
+                'package: pip install numpy')
+            exit()
+
+        from Eavesarp.eavesarp import analyze
+        from Eavesarp.profiling import profiling
+
+        with profiling(args.profile):
+            analyze(**args.__dict__,
+                    sender_lists=sender_lists,
+                    target_lists=target_lists)
 
     # Capture and exit
     elif args.cmd == 'capture':
 
+        if args.simulate:
+
+            if args.simulate.isdigit():
+                args.simulate = int(args.simulate)
+            elif not Path(args.simulate).is_file():
+                print('- Simulation requires a number of requests or '
+                    f'a capture file: {args.simulate}')
+                exit()
+
+            if args.capture_helper or args.capture_stream:
+                print('- A simulated capture cannot use a capture '
+                    'helper or capture stream.')
+                exit()
+
+            if args.simulate_rate < 0:
+                print('- Simulation rate cannot be negative.')
+                exit()
+
         interfaces = get_interfaces()
-        if args.interface not in interfaces or not interfaces[args.interface][1]:
-            valids = ', '.join([i for i,vs in interfaces.items() if vs[1]])
-            print(f'Invalid interface provided: {args.interface}' \
+        invalids = [i for i in args.interfaces
+                if i not in interfaces or not interfaces[i][1]]
+        if invalids and not args.simulate:
+            print(f'Invalid interface provided: {", ".join(invalids)}' \
             f'\n\nValid interfaces:\n\n{get_interface_table(True)}\n' \
             '\nFYI: An interface is valid only when it has an IP\n\n' \
             'Exiting!')
             exit()
 
 
-        capture(**args.__dict__,
-            sender_lists=sender_lists,
-            target_lists=target_lists)
+        if args.capture_helper and args.capture_stream:
+            print('- A capture helper and capture stream cannot be '
+                'used together.')
+            exit()
+
+        if args.capture_stream and args.interfaces.__len__() > 1:
+            print('- A capture stream can be read for only one '
+                'interface.')
+            exit()
+
+        # Interfaces listed more than once would be captured twice
+        args.interfaces = list(dict.fromkeys(args.interfaces))
+
+        if args.capture_helper and not which(args.capture_helper):
+            print(f'- Capture helper not found: {args.capture_helper}')
+            exit()
+
+        if args.redraw_frequency <= 0 or args.render_budget <= 0:
+            print('- Redraw frequency and render budget must be greater '
+                'than zero.')
+            exit()
+
+        if args.viewport and args.headless:
+            print('- A viewport cannot be drawn when capturing with '
+                '--headless.')
+            exit()
+
+        if args.viewport and args.capture_stream == '-':
+            print('- A viewport cannot be drawn while reading a capture '
+                'stream from stdin.')
+            exit()
+
+        if args.live_counters and (args.headless or args.viewport or
+                args.window):
+            print('- Live counters cannot be drawn with --headless, '
+                '--viewport or --window.')
+            exit()
+
+        if args.live_counters:
+
+            from Eavesarp.live import LIVE_COLUMNS
+
+            if [c for c in args.output_columns if c not in LIVE_COLUMNS]:
+                print('- Live counters draw only the columns: '
+                    f'{" ".join(LIVE_COLUMNS)}')
+                exit()
+
+            if args.live_capacity < 1:
+                print('- Live capacity must be at least 1 pair.')
+                exit()
+
+        if args.event_output == '-' and not args.headless:
+            print('- Events can be written to stdout only when '
+                'capturing with --headless.')
+            exit()
+
+        if args.queue_size < 0:
+            print('- Queue size cannot be negative.')
+            exit()
+
+        if args.metrics_port is not None and \
+                not 0 < args.metrics_port < 65536:
+            print(f'- Invalid metrics port: {args.metrics_port}')
+            exit()
+
+        if args.metrics_interval <= 0:
+            print('- Metrics interval must be greater than zero.')
+            exit()
+
+        if args.partition_size is not None and args.partition_size < 1:
+            print('- Partition size must be at least 1 MiB.')
+            exit()
+
+        from Eavesarp.partition import can_catalog
+
+        if (args.partition_period or args.partition_size) and \
+                not can_catalog(args.database_output_file):
+            print('- Partitions can only be cataloged by a new database '
+                f'file: {args.database_output_file}')
+            exit()
+
+        from Eavesarp.eavesarp import capture
+        from Eavesarp.profiling import profiling
+
+        # Status messages are written to stderr when headless, leaving
+        # stdout to events
+        with redirect_stdout(stderr if args.headless else stdout):
+
+            with profiling(args.profile):
+                capture(**args.__dict__,
+                    sender_lists=sender_lists,
+                    target_lists=target_lists)
 
-        print('- Done! Exiting')
+            print('- Done! Exiting')
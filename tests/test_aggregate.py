@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+'''
+Memory bounded aggregation of requests, spilling sorted runs to disk.
+'''
+
+from Eavesarp.aggregate import PairAggregator, BUCKET_PERIOD
+from Eavesarp.sql import create_db, Transaction, TransactionHistory
+from Eavesarp.misc import ip_to_int
+from collections import Counter
+import numpy as np
+import random
+import pytest
+
+def make_records(count,seed=0):
+    '''Return `count` `(timestamp,sender,sender_mac,target)` records
+    over few addresses and several minute buckets, ordered by time.
+    '''
+
+    rand = random.Random(seed)
+    records = []
+
+    for ind in range(count):
+        sender = rand.randrange(1,12)
+        records.append((1000+ind*.7,f'10.0.0.{sender}',
+            f'02:00:00:00:{rand.randrange(2):02x}:{sender:02x}',
+            f'10.0.1.{rand.randrange(9)}'))
+
+    return records
+
+def exact_counts(records):
+
+    pairs, buckets, macs = Counter(), Counter(), {}
+
+    for timestamp, sender, shw, target in records:
+        bucket = int(timestamp//BUCKET_PERIOD*BUCKET_PERIOD)
+        pairs[(sender,target)] += 1
+        buckets[(sender,target,bucket)] += 1
+        macs[sender] = shw
+
+    return dict(pairs), dict(buckets), macs
+
+def db_counts(db_session):
+
+    pairs = {(t.sender.value,t.target.value):t.count
+        for t in db_session.query(Transaction)}
+
+    transactions = {t.id:(t.sender.value,t.target.value)
+        for t in db_session.query(Transaction)}
+    buckets = {transactions[h.transaction_id]+(h.bucket,):h.count
+        for h in db_session.query(TransactionHistory)}
+
+    macs = {t.sender.value:t.sender.mac_address
+        for t in db_session.query(Transaction)}
+
+    return pairs, buckets, macs
+
+@pytest.fixture
+def db_session(tmp_path):
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+    yield db_session
+    db_session.close()
+
+@pytest.mark.parametrize('max_pairs',[1,7,None])
+def test_spill(db_session,tmp_path,max_pairs):
+
+    records = make_records(2000)
+    aggregator = PairAggregator(directory=tmp_path)
+    if max_pairs: aggregator.max_pairs = max_pairs
+
+    # Records are counted in several updates
+    for offset in range(0,records.__len__(),300):
+        aggregator.update(records[offset:offset+300])
+
+    # Counts beyond the limit are spilled to runs on disk
+    assert bool(aggregator.runs) == bool(max_pairs)
+    assert aggregator.counts.__len__() < (max_pairs or 1<<20)
+
+    assert aggregator.flush(db_session) == 2000
+    assert db_counts(db_session) == exact_counts(records)
+    assert aggregator.runs == [] and not aggregator.counts
+
+def test_update_arrays(db_session,tmp_path):
+
+    records = make_records(600,1)
+    first, second = records[:300], records[300:]
+
+    # Arrays of the first records ordered by sender, target and
+    # bucket, as yielded by scan_chunks
+    keys = sorted((ip_to_int(sender),ip_to_int(target),bucket,count)
+        for (sender,target,bucket),count in exact_counts(first)[1].items())
+    counts = [key[3] for key in keys]
+    macs = {ip_to_int(sender):int(shw.replace(':',''),16)
+        for timestamp,sender,shw,target in first}
+
+    for limit in [keys.__len__()*2,5]:
+
+        aggregator = PairAggregator(directory=tmp_path)
+        aggregator.max_pairs = limit
+
+        aggregator.update(second[:10])
+        aggregator.update_arrays(np.array([key[0] for key in keys]),
+            np.array([key[1] for key in keys]),np.array(counts),
+            np.array([key[2] for key in keys]),macs)
+
+        # Runs are held in memory while they fit within the limit
+        assert isinstance(aggregator.runs[-1],list) == \
+            (limit > keys.__len__())
+
+        aggregator.update(second[10:])
+
+        assert aggregator.flush(db_session) == 600
+
+        # The MAC address of each sender is from its final request,
+        # whichever run it was counted in
+        expected = exact_counts(second[:10]+first+second[10:])
+        assert db_counts(db_session) == expected
+
+        db_session.query(TransactionHistory).delete()
+        db_session.query(Transaction).delete()
+        db_session.commit()
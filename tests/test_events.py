@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+'''
+NDJSON events emitted during capture, to standard output or to the
+clients of a Unix socket.
+'''
+
+from Eavesarp.events import EventStream
+import Eavesarp.events
+from Eavesarp.eavesarp import CaptureOrchestrator
+from Eavesarp.simulate import simulate_capture
+from Eavesarp.sql import create_db, Transaction
+from io import StringIO
+import asyncio
+import socket
+import json
+
+class ClosedPipe(StringIO):
+
+    def write(self,line):
+
+        raise BrokenPipeError
+
+def test_stdout(monkeypatch):
+
+    stream = EventStream()
+    stream.stdout = StringIO()
+
+    stream.emit('new_pair',sender='10.0.0.1',target='10.0.0.2',count=1)
+    stream.emit('stale_target',target='10.0.0.2',senders=['10.0.0.1'])
+    stream.flush()
+
+    events = [json.loads(line)
+        for line in stream.stdout.getvalue().splitlines()]
+
+    assert [event.pop('time') > 0 for event in events] == [True,True]
+    assert events == [dict(event='new_pair',sender='10.0.0.1',
+        target='10.0.0.2',count=1),dict(event='stale_target',
+        target='10.0.0.2',senders=['10.0.0.1'])]
+
+    # Capture continues once the consumer exits
+    monkeypatch.setattr(Eavesarp.events,'stderr',StringIO())
+    stream.stdout = ClosedPipe()
+    stream.emit('new_pair')
+    stream.emit('new_pair')
+
+    assert stream.stdout is None
+    assert Eavesarp.events.stderr.getvalue() == '- Event output closed\n'
+
+def test_socket(tmp_path):
+
+    path = tmp_path / 'events.sock'
+
+    # A socket left by a previous capture is replaced
+    previous = socket.socket(socket.AF_UNIX)
+    previous.bind(str(path))
+    previous.close()
+
+    async def receive():
+
+        stream = EventStream(str(path))
+        await stream.start()
+
+        reader, writer = await asyncio.open_unix_connection(str(path))
+        while not stream.clients: await asyncio.sleep(0.01)
+
+        stream.emit('count_update',increment=2,count=3)
+        line = await asyncio.wait_for(reader.readline(),5)
+
+        await stream.close()
+        writer.close()
+
+        return json.loads(line)
+
+    event = asyncio.run(receive())
+
+    assert (event['event'],event['increment'],event['count']) == \
+        ('count_update',2,3)
+    assert not path.exists()
+
+def test_capture(tmp_path):
+    '''Events of a simulated capture agree with the database.
+    '''
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+
+    sources, responder = simulate_capture(['sim0'],300)
+    responder.timeout = 0.01
+
+    stream = EventStream()
+    stream.stdout = StringIO()
+
+    orchestrator = CaptureOrchestrator(db_session,sources,None,['sim0'],
+        arp_resolve=True,dns_resolve=True,events=stream,log=lambda m: None,
+        arp_resolver=responder.arp_resolve,
+        dns_resolver=responder.reverse_dns_resolve,drain=True)
+
+    asyncio.run(orchestrator.run())
+
+    events = [json.loads(line)
+        for line in stream.stdout.getvalue().splitlines()]
+
+    # Each pair is created once and its count updated by increments
+    counts = {}
+    for event in events:
+
+        pair = (event.get('sender'),event.get('target'))
+
+        if event['event'] == 'new_pair':
+            assert pair not in counts
+            counts[pair] = event['count']
+
+        elif event['event'] == 'count_update':
+            assert counts[pair]+event['increment'] == event['count']
+            counts[pair] = event['count']
+
+    assert counts == {(t.sender.value,t.target.value):t.count
+        for t in db_session.query(Transaction)}
+    assert sum(counts.values()) == 300
+
+    # The only stale host has a PTR record resolving to a live host
+    senders = sorted(sender for sender,target in counts
+        if target == '10.0.0.1')
+    assert senders
+
+    resolutions = [event for event in events
+        if event['event'] in ('stale_target','mitm_candidate')]
+    for event in resolutions: del event['time']
+
+    assert [dict(event,senders=sorted(event['senders']))
+        for event in resolutions] == [
+        dict(event='stale_target',target='10.0.0.1',senders=senders),
+        dict(event='mitm_candidate',target='10.0.0.1',senders=senders,
+            ptr='host0.eavesarp.test',forward_ip='10.0.0.2')]
+
+    db_session.close()
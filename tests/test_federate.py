@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+'''
+Federated queries over multiple databases, through views or
+materialized tables.
+'''
+
+from Eavesarp.federate import (create_views, federated_session,
+        count_source_transactions)
+from Eavesarp.sql import create_db, write_pair_values, PTR
+from Eavesarp.output import get_output_csv
+from Eavesarp.misc import ip_to_int, int_to_ip
+import sqlite3
+import pytest
+
+def create_source(path,seed):
+
+    db_session = create_db(str(path))
+
+    write_pair_values([(ip_to_int(f'10.0.0.{sender}'),
+        ip_to_int(f'10.0.1.{(sender*seed) % 7}'),sender+seed,
+        f'02:00:00:00:00:{sender:02x}' if sender % 3 else None,
+        [(60,60*(sender % 4),sender)]) for sender in range(1,20)],
+        db_session,timestamp=1000*seed)
+
+    db_session.commit()
+    db_session.close()
+
+def federated_connection(dbfiles,attach_limit,materialize):
+
+    connection = sqlite3.connect(':memory:')
+    connection.create_function('eavesarp_ip_int',1,ip_to_int,
+            deterministic=True)
+    connection.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED,attach_limit)
+
+    create_views(connection,dbfiles,0,materialize)
+
+    return connection
+
+def temp_types(connection):
+
+    return dict(connection.execute('SELECT name, type '
+        "FROM sqlite_temp_master WHERE type IN ('table','view')"))
+
+@pytest.mark.parametrize('attach_limit',[10,2])
+def test_views_match_tables(tmp_path,attach_limit):
+
+    dbfiles = []
+    for seed in range(1,6):
+        dbfiles.append(tmp_path / f'{seed}.db')
+        create_source(dbfiles[-1],seed)
+
+    assert count_source_transactions(dbfiles) == 5*19
+
+    outputs = []
+    for materialize in [False,True]:
+
+        connection = federated_connection(dbfiles,attach_limit,
+            materialize)
+        types = temp_types(connection)
+
+        # Views are the default, while materialized sources are
+        # detached
+        assert types['transaction'] == \
+            ('table' if materialize else 'view')
+        attached = [name for seq, name, dbfile in
+            connection.execute('PRAGMA database_list')
+            if name.startswith('source_')]
+        assert (not attached) == materialize
+
+        db_session = federated_session(connection)
+        outputs.append((get_output_csv(db_session).read(),
+            get_output_csv(db_session,since=0).read()))
+        db_session.close()
+        connection.close()
+
+    assert outputs[0] == outputs[1]
+
+def test_ptr_forward_ip(tmp_path):
+
+    # The greatest PTR value and the forward IP of another source
+    for name, ptr, forward_ip in [('a.db','a.example.','10.0.0.9'),
+            ('b.db','b.example.',None)]:
+
+        create_source(tmp_path / name,1)
+
+        connection = sqlite3.connect(tmp_path / name)
+        connection.execute('INSERT INTO ptr (ip_id, forward_ip, value) '
+            "SELECT id, ?, ? FROM ip WHERE value = '10.0.0.1'",
+            (forward_ip,ptr))
+        connection.commit()
+        connection.close()
+
+    for materialize in [False,True]:
+
+        connection = federated_connection([tmp_path / 'a.db',
+            tmp_path / 'b.db'],10,materialize)
+        db_session = federated_session(connection)
+
+        ptr = db_session.query(PTR).one()
+        assert (int_to_ip(ptr.ip_id),ptr.value,ptr.forward_ip) == \
+            ('10.0.0.1','b.example.',None)
+
+        db_session.close()
+        connection.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+'''
+Import of SQLite input files by an analysis.
+'''
+
+from Eavesarp.eavesarp import import_sqlite_file
+from Eavesarp.sql import create_db, Transaction
+from test_migrations import create_v1_db
+from hashlib import sha256
+import sqlite3
+
+def test_import_v1_readonly(tmp_path):
+
+    source = tmp_path / 'v1.db'
+    create_v1_db(source)
+
+    connection = sqlite3.connect(source)
+    connection.execute("INSERT INTO ptr VALUES (1,2,'10.0.0.2','host.')")
+    connection.commit()
+    connection.close()
+
+    digest = sha256(source.read_bytes()).hexdigest()
+
+    outdb_sess = create_db(str(tmp_path / 'out.db'))
+    import_sqlite_file(source,outdb_sess)
+
+    transactions = [(t.sender.value,t.target.value,t.count,
+        t.target.ptr[0].value) for t in outdb_sess.query(Transaction)]
+    outdb_sess.close()
+
+    assert transactions == [('10.0.0.1','10.0.0.2',5,'host.')]
+
+    # The source is neither migrated nor otherwise modified
+    assert sha256(source.read_bytes()).hexdigest() == digest
+
+def create_source(path,mac,ptr,first_seen,last_seen,bucket):
+
+    db_session = create_db(str(path))
+    db_session.close()
+
+    connection = sqlite3.connect(path)
+    connection.executescript(f'''
+        INSERT INTO ip VALUES (1,'10.0.0.1',167772161,1,1,'{mac}');
+        INSERT INTO ip VALUES (2,'10.0.0.2',167772162,0,1,NULL);
+        INSERT INTO ptr VALUES (1,2,'10.0.0.2','{ptr}');
+        INSERT INTO "transaction" VALUES (1,1,2,3,{first_seen},{last_seen});
+        INSERT INTO "transaction" VALUES (2,2,1,1,NULL,NULL);
+        INSERT INTO transaction_history VALUES (1,60,{bucket},3);
+        INSERT INTO interface_count VALUES (1,1,'eth0',3);
+    ''')
+    connection.commit()
+    connection.close()
+
+def test_import_merge(tmp_path):
+
+    create_source(tmp_path / 'a.db','02:00:00:00:00:01','a.',100,200,60)
+    create_source(tmp_path / 'b.db','02:00:00:00:00:02','b.',50,150,120)
+
+    outdb_sess = create_db(str(tmp_path / 'out.db'))
+    for name in ['a.db','b.db']:
+        import_sqlite_file(tmp_path / name,outdb_sess)
+
+    connection = sqlite3.connect(tmp_path / 'out.db')
+    ips = connection.execute('SELECT value, arp_resolve_attempted, '
+        'reverse_dns_attempted, mac_address FROM ip ORDER BY value') \
+        .fetchall()
+    ptrs = connection.execute('SELECT value FROM ptr').fetchall()
+    transactions = connection.execute('SELECT count, first_seen, '
+        'last_seen FROM "transaction" ORDER BY sender_ip_id').fetchall()
+    history = connection.execute('SELECT period, bucket, count '
+        'FROM transaction_history ORDER BY bucket').fetchall()
+    interface_counts = connection.execute('SELECT interface, count '
+        'FROM interface_count').fetchall()
+    connection.close()
+    outdb_sess.close()
+
+    # IPs take the latest MAC address and keep their first PTR
+    assert ips == [('10.0.0.1',1,1,'02:00:00:00:00:02'),
+        ('10.0.0.2',0,1,None)]
+    assert ptrs == [('a.',)]
+
+    # Counts are summed, keeping the earliest and latest times seen
+    assert transactions == [(6,50.0,200.0),(2,None,None)]
+    assert history == [(60,60,3),(60,120,3)]
+    assert interface_counts == [('eth0',6)]
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+'''
+Import time of the command line for subcommands that don't capture.
+'''
+
+from pathlib import Path
+import subprocess
+import json
+import sys
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / 'eavesarp.py'
+
+# Seconds allowed to run the entry script, about ten times the time
+# taken by --help on a workstation
+BUDGET = 0.5
+
+# Packages loaded only to capture, resolve or analyze
+DEFERRED = ['scapy','sqlalchemy','dns','colored','emoji']
+
+# Runs the entry script, reporting the deferred packages it imported
+# and the seconds it took
+RUNNER = '''
+from contextlib import redirect_stdout
+from time import perf_counter
+import runpy, json, sys, io
+
+deferred = set(sys.argv[1].split(','))
+sys.argv = sys.argv[2:]
+start = perf_counter()
+
+with redirect_stdout(io.StringIO()):
+    try:
+        runpy.run_path(sys.argv[0],run_name='__main__')
+    except SystemExit:
+        pass
+
+seconds = perf_counter()-start
+print(json.dumps(dict(seconds=seconds,modules=sorted(
+    {name.split('.')[0] for name in sys.modules}.intersection(deferred)))))
+'''
+
+def run_script(*args):
+
+    result = subprocess.run([sys.executable,'-c',RUNNER,
+        ','.join(DEFERRED),str(SCRIPT),*args],capture_output=True,
+        text=True,check=True,cwd=SCRIPT.parent)
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+@pytest.mark.parametrize('args',[
+    ['--help'],
+    ['list'],
+])
+def test_import_budget(args):
+
+    # The best of a few runs, since the first may read a cold cache
+    runs = [run_script(*args) for i in range(3)]
+
+    assert runs[0]['modules'] == []
+    assert min(run['seconds'] for run in runs) < BUDGET
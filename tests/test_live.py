@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+'''
+Live pair counters shared between the capture loop and a renderer.
+'''
+
+from Eavesarp.live import (LiveCounters, get_live_table, STATUS_SIZE,
+        FLAG_ARP_RESOLVED, FLAG_STALE)
+from Eavesarp.misc import ip_to_int
+from multiprocessing import get_context
+import pickle
+import pytest
+
+@pytest.fixture
+def counters():
+
+    counters = LiveCounters(capacity=3)
+    yield counters
+    counters.close()
+
+def pairs(slots):
+
+    return {(sender,target):(count,flags)
+        for sender, target, count, flags in slots}
+
+def key(sender,target):
+
+    return (ip_to_int(sender),ip_to_int(target))
+
+def test_overflow(counters):
+
+    counters.add_counts({('10.0.0.1','10.0.0.2'):2,
+        ('10.0.0.1','10.0.0.3'):1})
+    counters.add_counts({('10.0.0.4','10.0.0.5'):1,
+        ('10.0.0.6','10.0.0.7'):4,('10.0.0.1','10.0.0.2'):3})
+
+    requests, overflow, status, slots = counters.snapshot()
+
+    # Pairs beyond the capacity are counted as overflow, while those
+    # holding slots are still counted
+    assert (requests,overflow) == (11,4)
+    assert pairs(slots) == {key('10.0.0.1','10.0.0.2'):(5,0),
+        key('10.0.0.1','10.0.0.3'):(1,0),key('10.0.0.4','10.0.0.5'):(1,0)}
+
+def test_target_flags(counters):
+
+    counters.set_target_flags({'10.0.0.3':FLAG_ARP_RESOLVED|FLAG_STALE})
+    counters.add_counts({('10.0.0.1','10.0.0.2'):1,
+        ('10.0.0.1','10.0.0.3'):1})
+    counters.set_target_flags({'10.0.0.2':FLAG_ARP_RESOLVED})
+
+    # Flags apply to pairs counted before and after they were set
+    assert pairs(counters.snapshot()[3]) == {
+        key('10.0.0.1','10.0.0.2'):(1,FLAG_ARP_RESOLVED),
+        key('10.0.0.1','10.0.0.3'):(1,FLAG_ARP_RESOLVED|FLAG_STALE)}
+
+    # A stale target that sends a request is resolved by it
+    counters.add_records([('10.0.0.3','02:00:00:00:00:03','10.0.0.1'),
+        ('10.0.0.1',None,'10.0.0.3')])
+
+    assert pairs(counters.snapshot()[3]) == {
+        key('10.0.0.1','10.0.0.2'):(1,FLAG_ARP_RESOLVED),
+        key('10.0.0.1','10.0.0.3'):(2,FLAG_ARP_RESOLVED),
+        key('10.0.0.3','10.0.0.1'):(1,0)}
+
+    requests, overflow, status, table = get_live_table(counters,
+        arp_resolve=True)
+    assert requests == 4
+    assert [line.split() for line in table.split('\n')[2:]] == [
+        ['10.0.0.1','10.0.0.3','2'],['10.0.0.2','1'],
+        ['10.0.0.3','10.0.0.1','1','[UNCONFIRMED]']]
+
+def test_publish(counters):
+
+    counters.publish(3,'- Capturing')
+    assert counters.snapshot()[2] == '- Capturing'
+
+    counters.publish(3,'x'*(STATUS_SIZE+10))
+    assert counters.snapshot()[2] == 'x'*STATUS_SIZE
+
+    counters.publish(3,'')
+    assert counters.snapshot()[2] == ''
+
+def read_snapshots(counters,reads,results):
+    '''Check that each snapshot read by a second process is
+    consistent, i.e. counts sum to the requests counted.
+    '''
+
+    inconsistent = 0
+    for ind in range(reads):
+        requests, overflow, status, slots = counters.snapshot()
+        if sum(slot[2] for slot in slots)+overflow != requests:
+            inconsistent += 1
+
+    results.put((inconsistent,requests))
+    counters.close()
+
+def test_snapshot_consistency():
+
+    context = get_context('spawn')
+    counters = LiveCounters(capacity=64)
+
+    # Attached by name when passed to another process
+    attached = pickle.loads(pickle.dumps(counters))
+    assert (attached.name,attached.capacity,attached.owner) == \
+        (counters.name,64,False)
+    attached.close()
+
+    results = context.Queue()
+    reader = context.Process(target=read_snapshots,
+        args=(counters,2000,results))
+    reader.start()
+
+    requests = 0
+    while reader.is_alive():
+        counts = {(f'10.0.0.{ind % 100}',f'10.0.1.{ind % 7}'):ind % 5+1
+            for ind in range(requests % 97,requests % 97+40)}
+        requests += sum(counts.values())
+        counters.add_counts(counts)
+        if not results.empty(): break
+
+    inconsistent, read = results.get(timeout=30)
+    reader.join()
+
+    assert inconsistent == 0
+    assert 0 < read <= requests
+    assert counters.snapshot()[0] == requests
+    counters.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+'''
+Migration of databases created by earlier versions of eavesarp.
+'''
+
+from Eavesarp.sql import create_db, SCHEMA_VERSION, Transaction
+import sqlite3
+
+# Schema of a version 1 database, as created before databases were
+# versioned
+V1_SCHEMA = '''
+CREATE TABLE ip (
+	id INTEGER NOT NULL,
+	value VARCHAR NOT NULL,
+	arp_resolve_attempted BOOLEAN NOT NULL,
+	reverse_dns_attempted BOOLEAN NOT NULL,
+	mac_address VARCHAR,
+	PRIMARY KEY (id),
+	UNIQUE (value),
+	CHECK (arp_resolve_attempted IN (0, 1)),
+	CHECK (reverse_dns_attempted IN (0, 1))
+);
+CREATE TABLE ptr (
+	id INTEGER NOT NULL,
+	ip_id INTEGER NOT NULL,
+	forward_ip VARCHAR,
+	value VARCHAR NOT NULL,
+	PRIMARY KEY (id),
+	UNIQUE (ip_id),
+	FOREIGN KEY(ip_id) REFERENCES ip (id),
+	UNIQUE (value)
+);
+CREATE TABLE "transaction" (
+	id INTEGER NOT NULL,
+	sender_ip_id INTEGER NOT NULL,
+	target_ip_id INTEGER NOT NULL,
+	count INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(sender_ip_id, target_ip_id) REFERENCES ip (id, id)
+);
+INSERT INTO ip VALUES (1,'10.0.0.1',1,0,'02:00:00:00:00:01');
+INSERT INTO ip VALUES (2,'10.0.0.2',0,0,NULL);
+INSERT INTO "transaction" VALUES (1,1,2,3);
+INSERT INTO "transaction" VALUES (2,1,2,2);
+'''
+
+def create_v1_db(path):
+
+    connection = sqlite3.connect(path)
+    connection.executescript(V1_SCHEMA)
+    connection.close()
+
+def test_migrate_v1(tmp_path):
+
+    dbfile = tmp_path / 'v1.db'
+    create_v1_db(dbfile)
+
+    db_session = create_db(str(dbfile))
+    transactions = [(t.sender.value,t.target.value,t.count,
+        t.sender.int_value) for t in db_session.query(Transaction)]
+    db_session.close()
+
+    # Duplicate pairs are merged
+    assert transactions == [('10.0.0.1','10.0.0.2',5,167772161)]
+
+    connection = sqlite3.connect(dbfile)
+    names = {name for name, in connection.execute(
+        'SELECT name FROM sqlite_master')}
+    columns = {row[1] for row in connection.execute(
+        'PRAGMA table_info("transaction")')}
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    connection.close()
+
+    assert version == SCHEMA_VERSION
+    assert {'ingest','interface_count','transaction_history',
+        'partition','ix_transaction_last_seen'} <= names
+    assert {'first_seen','last_seen'} <= columns
+
+def test_migrate_v6_history(tmp_path):
+
+    dbfile = tmp_path / 'v6.db'
+    db_session = create_db(str(dbfile))
+    db_session.close()
+
+    # Version 6 kept history buckets in a rowid table
+    connection = sqlite3.connect(dbfile)
+    connection.executescript('''
+        DROP TABLE transaction_history;
+        CREATE TABLE transaction_history (
+            id INTEGER NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(transaction_id) REFERENCES "transaction" (id)
+        );
+        CREATE UNIQUE INDEX ix_transaction_history_transaction_bucket
+            ON transaction_history (transaction_id, period, bucket);
+        CREATE INDEX ix_transaction_history_period_bucket
+            ON transaction_history (period, bucket);
+        INSERT INTO transaction_history VALUES (1,2,60,120,4);
+        INSERT INTO transaction_history VALUES (2,1,3600,0,7);
+        PRAGMA user_version = 6;
+    ''')
+    connection.close()
+
+    create_db(str(dbfile)).close()
+
+    connection = sqlite3.connect(dbfile)
+    rows = connection.execute('SELECT * FROM transaction_history') \
+        .fetchall()
+    sql, = connection.execute("SELECT sql FROM sqlite_master "
+        "WHERE name='transaction_history'").fetchone()
+    indexes = {name for name, in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' "
+        "AND tbl_name='transaction_history'")}
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    connection.close()
+
+    # Rows are ordered by their key rather than a rowid
+    assert rows == [(1,3600,0,7),(2,60,120,4)]
+    assert sql.endswith('WITHOUT ROWID')
+    assert 'ix_transaction_history_period_bucket' in indexes
+    assert 'ix_transaction_history_transaction_bucket' not in indexes
+    assert version == SCHEMA_VERSION
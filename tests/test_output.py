@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+'''
+Output tables and CSV read a page at a time by keyset pagination.
+'''
+
+from Eavesarp.sql import create_db, write_pair_values
+from Eavesarp.output import get_output_table, get_output_csv
+from Eavesarp.misc import ip_to_int
+import pytest
+
+@pytest.fixture
+def db_session(tmp_path):
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+
+    # Counts repeat, so pages are also split between equal counts
+    write_pair_values([(ip_to_int(f'10.0.0.{ind % 5+1}'),
+        ip_to_int(f'10.0.1.{ind}'),ind % 4+1,None,[(60,0,ind % 3+1)])
+        for ind in range(23)],db_session)
+    db_session.commit()
+
+    yield db_session
+
+    db_session.close()
+
+def table_rows(table):
+
+    return [line.split()[:3] for line in table.split('\n')[2:]]
+
+@pytest.mark.parametrize('since',[None,0])
+def test_table_pages(db_session,since):
+
+    table, cursor = get_output_table(db_session,force_sender=True,
+            since=since,return_cursor=True)
+    expected = table_rows(table)
+
+    rows, cursor = [], None
+    while True:
+
+        table, cursor = get_output_table(db_session,force_sender=True,
+                limit=5,after=cursor,since=since,return_cursor=True)
+        if cursor is None: break
+
+        rows += table_rows(table)
+
+    # Rows of the whole table are grouped by sender
+    assert sorted(rows) == sorted(expected)
+    assert expected.__len__() == 23
+
+    # The cursor is returned only when requested
+    assert get_output_table(db_session,limit=5) == \
+        get_output_table(db_session,limit=5,return_cursor=True)[0]
+
+def test_csv_pages(db_session):
+
+    expected = get_output_csv(db_session).read().splitlines()
+
+    rows, cursor = [], None
+    while True:
+
+        output, cursor = get_output_csv(db_session,limit=4,after=cursor,
+                return_cursor=True)
+        if cursor is None: break
+
+        rows += output.read().splitlines()[1:]
+
+    assert rows == expected[1:]
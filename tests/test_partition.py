@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+'''
+Time-partitioned capture databases and validation of SQLite input
+files.
+'''
+
+from Eavesarp.partition import (PartitionCatalog, read_partitions,
+        expand_partitions, can_catalog)
+from Eavesarp.sql import create_db, write_pair_counts, IP, Transaction
+from Eavesarp.validators import validate_sqlite_file
+import sqlite3
+
+def invalid_files(tmp_path):
+
+    missing = tmp_path / 'missing.db'
+
+    capture = tmp_path / 'capture.pcap'
+    capture.write_bytes(b'\xd4\xc3\xb2\xa1'+b'\x00'*60)
+
+    empty = tmp_path / 'empty.db'
+    empty.write_bytes(b'')
+
+    other = tmp_path / 'other.db'
+    connection = sqlite3.connect(other)
+    connection.execute('CREATE TABLE other (value)')
+    connection.close()
+
+    return missing, capture, empty, other
+
+def test_invalid_files(tmp_path):
+
+    missing, capture, empty, other = invalid_files(tmp_path)
+
+    for path in [missing,capture,empty,other,tmp_path]:
+        assert read_partitions(path) is None
+        assert expand_partitions([path]) == [path]
+        assert not validate_sqlite_file(path)
+
+    assert can_catalog(missing)
+    assert not can_catalog(capture)
+    assert not can_catalog(tmp_path)
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+    db_session.close()
+    assert validate_sqlite_file(tmp_path / 'eavesarp.db')
+
+def test_rotate(tmp_path):
+
+    catalog = PartitionCatalog(tmp_path / 'eavesarp.db',period=60)
+    assert catalog.describe() == \
+        f'every 60s, cataloged in {tmp_path / "eavesarp.db"}'
+
+    db_session = catalog.open(90)
+    first = catalog.partition_file(catalog.partition)
+    assert first.name == 'eavesarp-19700101T000130.db'
+
+    write_pair_counts([('10.0.0.1','10.0.0.2',3,'02:00:00:00:00:01')],
+        db_session)
+    db_session.commit()
+    catalog.add_requests(3)
+    ips = {ip.value:ip.id for ip in db_session.query(IP)}
+
+    assert not catalog.due(119)
+    assert catalog.due(120)
+
+    db_session = catalog.rotate(db_session,120)
+    second = catalog.partition_file(catalog.partition)
+    assert second != first
+
+    # The new partition is seeded with the IPs of the previous one,
+    # retaining their ids, but none of its transactions
+    assert {ip.value:ip.id for ip in db_session.query(IP)} == ips
+    assert db_session.query(IP).filter(IP.value == '10.0.0.1').one() \
+        .mac_address == '02:00:00:00:00:01'
+    assert db_session.query(Transaction).count() == 0
+
+    write_pair_counts([('10.0.0.1','10.0.0.2',2,None)],db_session)
+    db_session.commit()
+
+    assert read_partitions(catalog.path) == [first,second]
+    assert read_partitions(catalog.path,121) == [second]
+    assert can_catalog(catalog.path)
+    assert validate_sqlite_file(catalog.path)
+
+    # Partitions are queried in aggregate
+    catalog.refresh(120)
+    assert [t.count for t in catalog.session.query(Transaction)] == [5]
+
+    # A restarted capture resumes the latest partition
+    db_session.close()
+    catalog.session.close()
+    catalog = PartitionCatalog(tmp_path / 'eavesarp.db',period=60)
+    db_session = catalog.open(150)
+    assert catalog.partition_file(catalog.partition) == second
+
+    assert catalog.expire(121) == 1
+    assert not first.exists()
+    assert read_partitions(catalog.path) == [second]
+
+    db_session.close()
+    catalog.session.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+'''
+History recorded from the timestamps of pcap records.
+'''
+
+from Eavesarp.eavesarp import PcapFollower
+from Eavesarp.vectorized import numpy_available
+from Eavesarp.sql import create_db, Transaction, TransactionHistory
+from socket import inet_aton
+from struct import pack
+import pytest
+
+MAC = bytes.fromhex('020000000001')
+
+# Timestamps, senders and targets of the requests in the capture
+REQUESTS = [
+    (60,'10.0.0.1','10.0.0.2'),
+    (90,'10.0.0.1','10.0.0.2'),
+    (150,'10.0.0.1','10.0.0.2'),
+    (150,'10.0.0.3','10.0.0.2'),
+]
+
+def write_pcap(path):
+
+    with open(path,'wb') as outfile:
+
+        outfile.write(pack('<IHHiIII',0xa1b2c3d4,2,4,0,0,65535,1))
+
+        for timestamp, sender, target in REQUESTS:
+            data = b'\xff'*6+MAC+b'\x08\x06'+ \
+                pack('!HHBBH',1,0x0800,6,4,1)+MAC+inet_aton(sender)+ \
+                b'\x00'*6+inet_aton(target)
+            outfile.write(pack('<IIII',timestamp,0,data.__len__(),
+                data.__len__())+data)
+
+@pytest.mark.parametrize('parse_engine,memory_limit',[
+    ('python',256),
+    ('numpy',256),
+    # Spills each pair and bucket
+    ('python',0),
+])
+def test_pcap_history(tmp_path,parse_engine,memory_limit):
+
+    if parse_engine == 'numpy' and not numpy_available():
+        pytest.skip('numpy is not installed')
+
+    capture = tmp_path / 'requests.pcap'
+    write_pcap(capture)
+
+    db_session = create_db(str(tmp_path / 'out.db'))
+    follower = PcapFollower(capture,db_session,memory_limit,parse_engine)
+    follower.poll()
+    follower.close()
+
+    history = sorted((t.sender.value,t.target.value,h.period,h.bucket,
+        h.count) for t, h in db_session.query(Transaction,TransactionHistory)
+        .filter(TransactionHistory.transaction_id==Transaction.id))
+    db_session.close()
+
+    assert history == [
+        ('10.0.0.1','10.0.0.2',60,60,2),
+        ('10.0.0.1','10.0.0.2',60,120,1),
+        ('10.0.0.3','10.0.0.2',60,120,1),
+    ]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+'''
+Decompression of captures by a background thread.
+'''
+
+from Eavesarp.pcap import ReadAheadReader
+from io import BytesIO
+from time import perf_counter
+import pytest
+
+class CountingFile(BytesIO):
+    '''File object recording the number of reads made of it.
+    '''
+
+    def __init__(self,*args,**kwargs):
+
+        super().__init__(*args,**kwargs)
+        self.reads = 0
+
+    def read(self,size=-1):
+
+        self.reads += 1
+        return super().read(size)
+
+@pytest.mark.parametrize('size',[1,7,64])
+def test_read(size):
+
+    data = bytes(range(256))*40
+    reader = ReadAheadReader(BytesIO(data),chunk_size=100,depth=2)
+
+    assert reader.peek(5) == data[:5]
+
+    chunks = []
+    while True:
+        chunk = reader.read(size)
+        if not chunk: break
+        chunks.append(chunk)
+
+    reader.close()
+
+    assert b''.join(chunks) == data
+
+def test_close_stops_reading():
+
+    infile = CountingFile(bytes(1<<20))
+    reader = ReadAheadReader(infile,chunk_size=16,depth=2)
+    assert reader.read(16) == bytes(16)
+
+    start = perf_counter()
+    reader.close()
+
+    # The thread stops rather than reading the rest of the stream
+    assert perf_counter()-start < 1
+    assert not reader.thread.is_alive()
+    assert infile.reads < 10
+    assert infile.closed
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+'''
+Wall clock scheduling of redraws, backing off from slow frames.
+'''
+
+from Eavesarp.scheduler import RedrawScheduler
+import Eavesarp.scheduler
+import pytest
+
+class Clock:
+
+    def __init__(self):
+
+        self.now = 100.0
+
+    def __call__(self):
+
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = Clock()
+    monkeypatch.setattr(Eavesarp.scheduler,'monotonic',clock)
+
+    return clock
+
+def draw(scheduler,clock,seconds):
+
+    with scheduler.frame(): clock.now += seconds
+
+def test_frames(clock):
+
+    scheduler = RedrawScheduler(max_fps=4,budget=0.1)
+
+    # Nothing is due until a change is requested, and the first
+    # frame is due at once
+    assert scheduler.delay() is None and not scheduler.due()
+    scheduler.request()
+    assert scheduler.delay() == 0
+
+    draw(scheduler,clock,0.01)
+    assert scheduler.delay() is None
+
+    # Changes are coalesced until a frame interval has passed since
+    # the previous frame began
+    scheduler.request()
+    scheduler.request()
+    assert scheduler.delay() == pytest.approx(0.24)
+
+    clock.now += 0.24
+    assert scheduler.due()
+
+def test_backoff(clock):
+
+    scheduler = RedrawScheduler(max_fps=5,budget=0.1,max_interval=1)
+
+    # Frames over the budget double the interval up to the maximum
+    intervals = []
+    for ind in range(5):
+        draw(scheduler,clock,0.15)
+        intervals.append(scheduler.interval)
+
+    assert intervals == pytest.approx([0.4,0.8,1,1,1])
+    assert scheduler.backing_off
+    assert scheduler.status() == \
+        'Redraw: 150ms of 100ms budget, 1.0 fps max (backing off)'
+
+    # Frames within the budget keep the interval, and those under
+    # half of it halve the interval down to the minimum
+    draw(scheduler,clock,0.07)
+    assert scheduler.interval == 1
+
+    intervals = []
+    for ind in range(4):
+        draw(scheduler,clock,0.01)
+        intervals.append(scheduler.interval)
+
+    assert intervals == pytest.approx([0.5,0.25,0.2,0.2])
+    assert scheduler.status() == 'Redraw: 10ms of 100ms budget, 5.0 fps max'
+
+def test_failed_frame(clock):
+
+    scheduler = RedrawScheduler(max_fps=5,budget=0.1)
+    scheduler.request()
+
+    # Frames that raise are still timed
+    with pytest.raises(RuntimeError):
+        with scheduler.frame():
+            clock.now += 0.3
+            raise RuntimeError
+
+    assert not scheduler.pending
+    assert scheduler.render_time == pytest.approx(0.3)
+    assert scheduler.interval == pytest.approx(0.4)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+'''
+Simulated capture sources and resolution of simulated hosts.
+'''
+
+from Eavesarp.simulate import (SyntheticTraffic, SimulatedSource,
+        SimulatedResponder, simulate_capture)
+from time import monotonic, sleep
+
+def run(source,timeout=10):
+    '''Start `source` and return the requests it queued once it
+    stops.
+    '''
+
+    source.start()
+
+    start = monotonic()
+    while source.running and monotonic()-start < timeout: sleep(0.01)
+
+    return source.get()
+
+def test_synthetic():
+
+    sources, responder = simulate_capture(['sim0','sim1'],300,seed=5)
+
+    # Each interface generates the traffic of its own seed
+    for ind, source in enumerate(sources):
+        assert [record for record,frame in run(source)] == \
+            list(SyntheticTraffic(300,seed=5+ind).records())
+        assert source.describe_exit() == \
+            f'Simulated capture finished on sim{ind}'
+
+    # Live hosts answer ARP resolution, while the stale host does not
+    responder.latency = responder.timeout = 0
+    assert responder.arp_resolve('sim0','10.0.0.2') == '02:00:0a:00:00:02'
+    assert responder.arp_resolve('sim0','10.0.0.1') is None
+
+    # Every host has a PTR record, resolving to a live host
+    assert responder.reverse_dns_resolve('10.0.0.1') == \
+        ('host0.eavesarp.test.','10.0.0.2')
+    assert responder.reverse_dns_resolve('10.0.0.3') == \
+        ('host2.eavesarp.test.','10.0.0.3')
+    assert responder.reverse_dns_resolve('10.0.9.9') == (None,None)
+
+def test_replay(tmp_path):
+
+    traffic = SyntheticTraffic(100,seed=1)
+    traffic.write(tmp_path / 'arp.pcap')
+
+    sources, responder = simulate_capture(['a','b'],
+        str(tmp_path / 'arp.pcap'),keep_frames=True)
+
+    # Each interface replays the capture, recording the MAC address
+    # of each sender for the responder
+    for source in sources:
+        items = run(source)
+        assert [record for record,frame in items] == \
+            list(traffic.records())
+        assert [frame[0] for record,frame in items] == \
+            [frame[0] for frame in traffic.frames()]
+
+    assert responder.hosts == {sender:mac
+        for sender,mac,target in traffic.records()}
+
+def test_rate():
+
+    traffic = SyntheticTraffic(1000)
+
+    # Requests are queued at the rate until the source is stopped
+    source = SimulatedSource('sim0',traffic.frames(),rate=200)
+    source.start()
+    sleep(0.2)
+
+    start = monotonic()
+    source.stop()
+
+    assert monotonic()-start < 1
+    assert not source.running
+    assert 10 < source.get().__len__() < 200
+
+def test_max_queue():
+
+    source = SimulatedSource('sim0',SyntheticTraffic(100).frames(),
+        max_queue=30)
+
+    # Requests beyond the queue are dropped until it's read
+    assert run(source).__len__() == 30
+    assert source.dropped == 70
+
+def test_responder_latency():
+
+    responder = SimulatedResponder({'10.0.0.1':'02:00:00:00:00:01'},
+        latency=0.05,timeout=0.2)
+
+    start = monotonic()
+    assert responder.arp_resolve('eth0','10.0.0.1') == \
+        '02:00:00:00:00:01'
+    assert 0.05 <= monotonic()-start < 0.2
+
+    start = monotonic()
+    assert responder.arp_resolve('eth0','10.0.0.2') is None
+    assert monotonic()-start >= 0.2
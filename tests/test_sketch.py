@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+'''
+Approximate counting of requests by Count-Min sketches.
+'''
+
+from Eavesarp.sketch import CountMinSketch, HeavyHitters, ApproximateCounter
+from Eavesarp.sql import create_db, Transaction, IP
+from collections import Counter
+import random
+
+def zipf_stream(count,keys,seed=0):
+    '''Return `count` keys of `keys` drawn from a Zipf distribution.
+    '''
+
+    rand = random.Random(seed)
+    weights = [1/rank for rank in range(1,keys+1)]
+
+    return rand.choices(range(keys),weights,k=count)
+
+def test_error_bound():
+
+    stream = zipf_stream(100000,20000)
+    sketch = CountMinSketch(error=0.001,failure=0.01,seed=1)
+
+    for key in stream: sketch.add(key)
+    counts = Counter(stream)
+
+    assert sketch.total == 100000
+    assert (sketch.width,sketch.depth) == (2719,5)
+    assert sketch.bound() == 100
+
+    overcounts = [sketch.estimate(key)-count
+        for key,count in counts.items()]
+
+    # Estimates never undercount and overcount within the bound
+    assert min(overcounts) >= 0
+    assert max(overcounts) <= sketch.bound()
+
+    # Keys never counted are estimated within the bound as well
+    assert sketch.estimate(20001) <= sketch.bound()
+
+def test_heavy_hitters():
+
+    stream = zipf_stream(50000,5000,2)
+    sketch = CountMinSketch(error=0.0005,seed=2)
+    heavy = HeavyHitters(10)
+
+    for key in stream: heavy.offer(key,sketch.add(key))
+
+    assert heavy.__len__() == 10
+    assert set(heavy.counts) == \
+        {key for key,count in Counter(stream).most_common(10)}
+
+def test_flush(tmp_path):
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+    counter = ApproximateCounter(top_k=2,error=0.001)
+
+    records = [('10.0.0.1','02:00:00:00:00:01','10.0.0.2')]*50+ \
+        [('10.0.0.3','02:00:00:00:00:03','10.0.0.2')]*20+ \
+        [('10.0.0.4','02:00:00:00:00:04','10.0.0.9')]*3+ \
+        [('10.0.0.5','02:00:00:00:00:05',f'10.0.1.{ind}')
+            for ind in range(10)]
+
+    counter.update(records)
+    assert counter.flush(db_session) == 83
+
+    counts = lambda: {(t.sender.value,t.target.value):t.count
+        for t in db_session.query(Transaction)}
+
+    # Only the heavy hitters are written, while every address is
+    assert counts() == {('10.0.0.1','10.0.0.2'):50,
+        ('10.0.0.3','10.0.0.2'):20}
+    assert db_session.query(IP).count() == 16
+
+    # Once a target is found stale, the pairs requesting it are
+    # written with the requests counted before
+    target = db_session.query(IP).filter(IP.value == '10.0.0.9').one()
+    target.arp_resolve_attempted = True
+    db_session.commit()
+
+    counter.update(records[:10])
+    assert counter.flush(db_session) == 10
+
+    assert counts() == {('10.0.0.1','10.0.0.2'):60,
+        ('10.0.0.3','10.0.0.2'):20,('10.0.0.4','10.0.0.9'):3}
+
+    db_session.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+'''
+Synthetic ARP traffic generated for benchmarks and simulated captures.
+'''
+
+from Eavesarp.simulate import SyntheticTraffic
+from Eavesarp.pcap import open_capture, parse_arp
+from benchmarks.synthetic import add_arguments
+from collections import Counter
+import argparse
+import pytest
+
+def test_deterministic():
+
+    records = lambda **kwargs: list(SyntheticTraffic(2000,**kwargs)
+        .records())
+
+    assert records(seed=3) == records(seed=3)
+    assert records(seed=3) != records(seed=4)
+    assert records(distribution='uniform') != records()
+
+@pytest.mark.parametrize('distribution',['uniform','zipf'])
+def test_shape(distribution):
+
+    traffic = SyntheticTraffic(5000,pairs=200,stale_ratio=0.25,
+        distribution=distribution,seed=1)
+    assert (traffic.pairs,traffic.hosts,traffic.stale_hosts) == \
+        (200,28,7)
+
+    records = list(traffic.records())
+    counts = Counter((sender,target) for sender,mac,target in records)
+
+    # Each pair is requested at least once
+    assert records.__len__() == 5000
+    assert counts.__len__() == 200
+
+    # Stale hosts are only ever targets
+    stale = set(traffic.addresses[:traffic.stale_hosts])
+    senders = {sender for sender,target in counts}
+    assert not senders & stale
+    assert stale & {target for sender,target in counts}
+
+    # The most requested pairs account for most requests only when
+    # following a Zipf distribution
+    top = sum(count for pair,count in counts.most_common(20))
+    assert (top > 2500) == (distribution == 'zipf')
+
+def test_invalid():
+
+    with pytest.raises(ValueError):
+        SyntheticTraffic(100,distribution='pareto')
+
+    # 4 hosts, 1 of them stale, form at most 9 pairs
+    with pytest.raises(ValueError):
+        SyntheticTraffic(100,pairs=10,hosts=4,stale_ratio=0.25)
+
+def test_write(tmp_path):
+
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args(['-p','50','-d','uniform','-s','2'])
+
+    traffic = SyntheticTraffic(300,pairs=args.pairs,
+        distribution=args.distribution,seed=args.seed)
+    traffic.write(tmp_path / 'arp.pcap')
+
+    reader = open_capture(tmp_path / 'arp.pcap')
+    frames = list(reader.records())
+    reader.infile.close()
+
+    # Requests are written a millisecond apart
+    assert [frame[0] for frame in frames] == \
+        pytest.approx([ind/1000 for ind in range(300)])
+    assert [parse_arp(data,linktype)[:3]
+        for timestamp,linktype,data in frames] == list(traffic.records())
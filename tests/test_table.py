@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+'''
+Output tables laid out as tabulate's "simple" format, with and
+without color profiles.
+'''
+
+from Eavesarp.table import TableFormatter, visible_width
+from Eavesarp.color import ColorProfiles
+import pytest
+
+tabulate = pytest.importorskip('tabulate').tabulate
+
+HEADERS = ['SNAC','Sender','Target','ARP#','Stale']
+
+ROWS = {
+    'empty':[],
+    'counts':[[None,'10.0.0.1','10.0.0.2',5,None],
+        [None,'','10.0.0.30',1234,None],
+        [True,'10.0.0.100','10.0.0.4',12,'True']],
+    'false':[[False,'10.0.0.1','10.0.0.2',1,False],
+        [True,'10.0.0.3','10.0.0.4',22,True]],
+    'floats':[[1.5,'10.0.0.1',' padded ',3,'1e3'],
+        [22,'10.0.0.2','x',4.25,'inf'],
+        [None,'10.0.0.3','',-7,'n/a']],
+    'emoji':[['\U0001f370','10.0.0.1','10.0.0.2',1,'\U0001f47b'],
+        [None,'10.0.0.3','10.0.0.4',10,None]],
+}
+
+def format_table(rows,color_profile=None):
+
+    table = TableFormatter(HEADERS,color_profile)
+
+    for ind, row in enumerate(rows):
+        table.add_row(row,('odd','even')[ind % 2] if color_profile
+            else None)
+
+    return table.format()
+
+@pytest.mark.parametrize('name',ROWS)
+def test_layout(name):
+
+    assert format_table(ROWS[name]) == \
+        tabulate(ROWS[name],headers=HEADERS)
+
+@pytest.mark.parametrize('name',ROWS)
+@pytest.mark.parametrize('profile',['default','cupcake'])
+def test_styles(name,profile):
+
+    pytest.importorskip('colored')
+    color_profile = ColorProfiles[profile]
+
+    # Styled as output tables were before, by colored.stylize
+    rows = [(color_profile.style_odd,color_profile.style_even)[ind % 2](row)
+        for ind,row in enumerate(ROWS[name])]
+
+    assert format_table(ROWS[name],color_profile) == \
+        tabulate(rows,headers=color_profile.style_header(HEADERS))
+
+def test_visible_width():
+
+    assert visible_width('\x1b[38;5;254m10.0.0.1\x1b[0m') == 8
+    assert visible_width('abc') == 3
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+'''
+The numpy parse engine, compared with the python parse engine.
+'''
+
+from Eavesarp.vectorized import numpy_available
+from Eavesarp.pcap import (write_pcap, open_capture, iter_arp_requests,
+        LINKTYPE_ETHERNET, RECORD_HEADER_LENGTH)
+from collections import Counter
+from socket import inet_aton
+from struct import pack
+import random
+import pytest
+
+pytestmark = pytest.mark.skipif(not numpy_available(),
+    reason='numpy is not installed')
+
+def request(sender,target,padding=0):
+
+    mac = pack('!HI',0x0200,sender)
+
+    return b'\xff'*6+mac+b'\x08\x06'+pack('!HHBBH',1,0x0800,6,4,1)+ \
+        mac+inet_aton(f'10.0.{sender>>8}.{sender&0xff}')+b'\x00'*6+ \
+        inet_aton(f'10.0.{target>>8}.{target&0xff}')+b'\x00'*padding
+
+def frames(seed=0,count=5000):
+    '''Generator yielding Ethernet frames in runs of equal length,
+    alternating lengths and other traffic of random length.
+    '''
+
+    rand = random.Random(seed)
+
+    for ind in range(count):
+
+        pattern = ind//500 % 3
+        sender, target = rand.randrange(1,40), rand.randrange(1,40)
+
+        if pattern == 0:
+            data = request(sender,target)
+        elif pattern == 1:
+            data = request(sender,target,18*(ind % 2))
+        elif rand.random() < 0.5:
+            data = b'\xff'*12+b'\x08\x00'+bytes(rand.randrange(20,1500))
+        else:
+            data = request(sender,target,rand.randrange(0,30))
+
+        yield ind/10, LINKTYPE_ETHERNET, data
+
+def python_counts(path):
+
+    reader = open_capture(str(path))
+    counts = Counter((timestamp//60*60,sender,target)
+        for timestamp, sender, shw, target in
+        iter_arp_requests(reader,True))
+    reader.infile.close()
+
+    return counts
+
+@pytest.mark.parametrize('chunk_records',[1<<20,37])
+def test_index_records(tmp_path,chunk_records):
+
+    from Eavesarp.vectorized import index_records, map_capture
+
+    capture = tmp_path / 'requests.pcap'
+    write_pcap(capture,frames())
+
+    # Records located by visiting each, excluding a truncated record
+    with open(capture,'ab') as outfile:
+        outfile.write(pack('<IIII',0,0,60,60)+b'\x00'*10)
+
+    with map_capture(capture) as buf:
+
+        expected, offset = [], 24
+        while True:
+            caplen = int.from_bytes(buf[offset+8:offset+12],'little')
+            if offset+RECORD_HEADER_LENGTH+caplen > buf.__len__(): break
+            expected.append((offset,caplen))
+            offset += RECORD_HEADER_LENGTH+caplen
+
+        chunks = index_records(buf,'<',24,buf.__len__(),chunk_records)
+        indexed = []
+        while True:
+            try:
+                offsets, caplens = next(chunks)
+            except StopIteration as e:
+                end = e.value
+                break
+            assert offsets.size <= chunk_records
+            indexed += zip(offsets.tolist(),caplens.tolist())
+
+    assert indexed == expected
+    assert end == offset
+
+def test_scan_chunks(tmp_path):
+
+    from Eavesarp.vectorized import scan_chunks, map_capture
+    from Eavesarp.misc import int_to_ip
+
+    capture = tmp_path / 'requests.pcap'
+    write_pcap(capture,frames(1))
+
+    counts = Counter()
+    with map_capture(capture) as buf:
+        for senders, targets, chunk_counts, buckets, macs in \
+                scan_chunks(buf,bucket_period=60):
+            for sender, target, count, bucket in zip(senders.tolist(),
+                    targets.tolist(),chunk_counts.tolist(),
+                    buckets.tolist()):
+                counts[(bucket,int_to_ip(sender),int_to_ip(target))] += \
+                    count
+
+    assert counts == python_counts(capture)
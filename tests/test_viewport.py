@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+'''
+Scrolling, sorting and searching the capture table in a curses
+viewport, drawn to a stand-in for the curses screen.
+'''
+
+from Eavesarp.viewport import Viewport
+from Eavesarp.sql import create_db, write_pair_values
+from Eavesarp.misc import ip_to_int
+import curses
+import pytest
+
+class Screen:
+    '''Curses window recording the lines drawn on it and returning
+    queued keys.
+    '''
+
+    def __init__(self,height=10,width=80):
+
+        self.height, self.width = height, width
+        self.lines = {}
+        self.keys = []
+
+    def getmaxyx(self):
+
+        return self.height, self.width
+
+    def erase(self):
+
+        self.lines = {}
+
+    def addnstr(self,y,x,text,n,attr=0):
+
+        if y >= self.height: raise curses.error
+        self.lines[y] = text[:n].rstrip()
+
+    def refresh(self):
+
+        pass
+
+    def getch(self):
+
+        return self.keys.pop(0) if self.keys else -1
+
+def write_pairs(db_session,pairs):
+
+    write_pair_values([(ip_to_int(sender),ip_to_int(target),count,None,
+        [(60,0,count)]) for sender,target,count in pairs],db_session)
+    db_session.commit()
+
+@pytest.fixture
+def viewport(tmp_path):
+
+    db_session = create_db(str(tmp_path / 'eavesarp.db'))
+    write_pairs(db_session,[(f'10.0.0.{ind % 3+1}',f'10.0.1.{ind}',ind+1)
+        for ind in range(12)])
+
+    viewport = Viewport(db_session,columns=['sender','target','arp_count'])
+    viewport.screen = Screen()
+
+    yield viewport
+
+    db_session.close()
+
+def rows(viewport):
+    '''Return the rows drawn, below the count, status and headers and
+    above the footer.
+    '''
+
+    lines = viewport.screen.lines
+    return [lines[y].split() for y in range(4,viewport.screen.height-1)
+        if y in lines]
+
+def press(viewport,*keys):
+
+    viewport.screen.keys += [ord(key) if isinstance(key,str) else key
+        for key in keys]
+    viewport.handle_input()
+
+def test_pages(viewport):
+
+    viewport.update(78,'- Capturing')
+
+    lines = viewport.screen.lines
+    assert lines[0] == 'Requests analyzed: 78'
+    assert lines[1] == '- Capturing'
+    assert lines[2].split() == ['Sender','Target','ARP#']
+
+    # Rows are ordered by count and only a page of them is drawn
+    assert viewport.page_size() == 5
+    assert rows(viewport) == [['10.0.0.3','10.0.1.11','12'],
+        ['10.0.0.2','10.0.1.10','11'],['10.0.0.1','10.0.1.9','10'],
+        ['10.0.0.3','10.0.1.8','9'],['10.0.0.2','10.0.1.7','8']]
+    assert lines[9].startswith('Rows 1-5 of 12 |')
+
+    press(viewport,curses.KEY_NPAGE,curses.KEY_DOWN)
+    assert [row[2] for row in rows(viewport)] == ['6','5','4','3','2']
+
+    # Scrolling stops at the final page
+    press(viewport,curses.KEY_END)
+    assert [row[2] for row in rows(viewport)] == ['5','4','3','2','1']
+    assert lines is not viewport.screen.lines
+    assert viewport.screen.lines[9].startswith('Rows 8-12 of 12 |')
+
+    press(viewport,curses.KEY_HOME,curses.KEY_UP)
+    assert rows(viewport)[0][2] == '12'
+
+def test_sort_and_search(viewport):
+
+    viewport.update()
+
+    # Sorted by sender, then target, ordering addresses numerically
+    press(viewport,'s')
+    assert viewport.sort_column == 'sender'
+    assert [row[0] for row in rows(viewport)] == ['10.0.0.1']*4+ \
+        ['10.0.0.2']
+
+    press(viewport,'s','r')
+    assert [row[1] for row in rows(viewport)] == ['10.0.1.11',
+        '10.0.1.10','10.0.1.9','10.0.1.8','10.0.1.7']
+    assert 'Sort: Target desc' in viewport.screen.lines[9]
+
+    # The footer shows the search as it's typed, which applies once
+    # entered
+    press(viewport,'/','0','.','1','.','1')
+    assert viewport.screen.lines[9] == '/0.1.1'
+    assert rows(viewport).__len__() == 5
+
+    press(viewport,10)
+    assert [row[1] for row in rows(viewport)] == ['10.0.1.11',
+        '10.0.1.10','10.0.1.1']
+
+    press(viewport,'/',27)
+    assert viewport.search == '' and viewport.visible.__len__() == 12
+
+def test_update(viewport):
+
+    viewport.update()
+    press(viewport,curses.KEY_DOWN)
+    widths = viewport.widths
+
+    # Rows are read again each frame, keeping the position
+    write_pairs(viewport.db_session,[('10.0.0.1','10.0.1.9',100),
+        ('10.0.0.100','10.0.1.100',1)])
+    viewport.update(200)
+
+    assert viewport.visible.__len__() == 13
+    assert rows(viewport)[0] == ['10.0.0.3','10.0.1.11','12']
+
+    press(viewport,curses.KEY_UP)
+    assert rows(viewport)[0] == ['10.0.0.1','10.0.1.9','110']
+
+    # Only the rows drawn are measured, and columns only widen
+    assert viewport.widths == widths
+    press(viewport,curses.KEY_END)
+    assert rows(viewport)[-1] == ['10.0.0.100','10.0.1.100','1']
+    press(viewport,curses.KEY_HOME)
+    assert viewport.widths[:2] == [10,10]
+    assert viewport.screen.lines[4] == \
+        '10.0.0.1    10.0.1.9    110'
+
+    # The latest message logged is drawn in the footer, truncated to
+    # the width of the screen
+    viewport.log('- Resolving\n')
+    assert viewport.messages == ['- Resolving']
+    assert viewport.screen.lines[9].startswith('Rows 1-5 of 13 | '
+        '- Resolving | Arrows')
+    assert viewport.screen.lines[9].__len__() == 79